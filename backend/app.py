@@ -40,6 +40,7 @@ def create_app():
     from routes.intimacy_routes import intimacy_bp
     from routes.asr_routes import asr_bp
     from routes.tts_routes import tts_bp
+    from routes.avatar_routes import avatar_bp
     
     app.register_blueprint(ai_bp, url_prefix='/api')
     app.register_blueprint(character_bp, url_prefix='/api')
@@ -49,6 +50,7 @@ def create_app():
     app.register_blueprint(intimacy_bp, url_prefix='/api')
     app.register_blueprint(asr_bp, url_prefix='/api')
     app.register_blueprint(tts_bp, url_prefix='/api')
+    app.register_blueprint(avatar_bp, url_prefix='/api')
     
     # 错误处理
     @app.errorhandler(404)
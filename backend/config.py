@@ -8,15 +8,116 @@ class Config:
     # 七牛云AI API配置
     QINIU_AI_API_KEY = os.getenv('QINIU_AI_API_KEY', 'sk-7b910549d43e0b5ca876b8aa3392f71fe1dd35b73c256f8e3b3a22bb708de331')
     QINIU_AI_BASE_URL = os.getenv('QINIU_AI_BASE_URL', 'https://openai.qiniu.com/v1')
-    
+
+    # 上游 HTTP（AI、TTS、ASR）连接池：每个主机保留的连接数、失败重试次数与退避系数（秒）；
+    # 超时为 (连接, 读取) 秒，可按主机名覆盖，例如 {'openai.qiniu.com': (3, 60)}
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 16))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 2))
+    HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', 0.3))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+    HTTP_HOST_TIMEOUTS = {}
+
     # Flask配置
     FLASK_APP = os.getenv('FLASK_APP', 'app.py')
     FLASK_ENV = os.getenv('FLASK_ENV', 'development')
     FLASK_RUN_PORT = int(os.getenv('FLASK_RUN_PORT', 5000))
     
+    # JSON 文件（users.json、快照模式的 sessions.json）的合并写入窗口（毫秒），窗口内的多次修改只写一次盘；
+    # 0 表示每次修改同步写入
+    PERSIST_WRITE_BEHIND_MS = float(os.getenv('PERSIST_WRITE_BEHIND_MS', 200))
+    
+    # 用户数据持久化：sqlite 每个用户一行，只写被修改的用户（首次启用时自动迁移 users.json）；
+    # json: 整个用户库保存在 users.json。数据库默认为 users.json 同目录的 users.db
+    USER_PERSISTENCE = os.getenv('USER_PERSISTENCE', 'sqlite')
+    USER_SQLITE_FILE = os.getenv('USER_SQLITE_FILE') or None
+    
+    # 管理员用户列表的默认每页条数与上限
+    ADMIN_USER_PAGE_SIZE = int(os.getenv('ADMIN_USER_PAGE_SIZE', 50))
+    ADMIN_USER_PAGE_MAX = int(os.getenv('ADMIN_USER_PAGE_MAX', 500))
+    
+    # 角色亲密度排行榜的默认每页条数与上限
+    INTIMACY_LEADERBOARD_PAGE_SIZE = int(os.getenv('INTIMACY_LEADERBOARD_PAGE_SIZE', 50))
+    INTIMACY_LEADERBOARD_PAGE_MAX = int(os.getenv('INTIMACY_LEADERBOARD_PAGE_MAX', 200))
+
+    # 亲密度事件日志（每次累加追加一条，按天 / 按角色汇总），默认为 users.json 同目录的 intimacy_events.jsonl；
+    # 管理后台趋势查询默认统计最近 INTIMACY_TREND_DAYS 天，最多 INTIMACY_TREND_MAX_DAYS 天
+    INTIMACY_EVENT_FILE = os.getenv('INTIMACY_EVENT_FILE') or None
+    INTIMACY_TREND_DAYS = int(os.getenv('INTIMACY_TREND_DAYS', 7))
+    INTIMACY_TREND_MAX_DAYS = int(os.getenv('INTIMACY_TREND_MAX_DAYS', 366))
+    # 日志累积到 COMPACT_THRESHOLD 条事件时写成汇总快照并清空日志；按天的汇总和升级事件保留最近
+    # RETENTION_DAYS 天（0 表示一直保留）
+    INTIMACY_EVENT_COMPACT_THRESHOLD = int(os.getenv('INTIMACY_EVENT_COMPACT_THRESHOLD', 10000))
+    INTIMACY_EVENT_RETENTION_DAYS = int(os.getenv('INTIMACY_EVENT_RETENTION_DAYS', 400))
+    
+    # 登录令牌：签发后 USER_TOKEN_TTL 秒过期，使用时滑动续期（同一令牌至少间隔 RENEW_INTERVAL 秒续期一次）；
+    # 令牌文件默认为 users.json 同目录的 tokens.jsonl
+    USER_TOKEN_TTL = float(os.getenv('USER_TOKEN_TTL', 7 * 24 * 3600))
+    USER_TOKEN_RENEW_INTERVAL = float(os.getenv('USER_TOKEN_RENEW_INTERVAL', 3600))
+    USER_TOKEN_FILE = os.getenv('USER_TOKEN_FILE') or None
+    
+    # 用户头像按内容哈希保存成文件的目录，默认为 users.json 同目录的 avatars
+    AVATAR_STORE_DIR = os.getenv('AVATAR_STORE_DIR') or None
+    
+    # 会话持久化配置
+    # sqlite: 会话与消息存入 SQLite，启动时只读会话元数据，消息按需读入（首次启用时自动迁移 sessions.json）；
+    # journal: 变更追加到日志，后台压缩成快照；snapshot: 变更后（合并写入窗口结束时）重写整个 sessions.json。
+    # journal 和 snapshot 启动时会解析全部消息，也不做消息的 LRU 淘汰
+    SESSION_PERSISTENCE = os.getenv('SESSION_PERSISTENCE', 'sqlite')
+    SESSION_SQLITE_FILE = os.getenv('SESSION_SQLITE_FILE') or None  # 默认与 sessions.json 同目录的 sessions.db
+    SESSION_JOURNAL_COMPACT_THRESHOLD = int(os.getenv('SESSION_JOURNAL_COMPACT_THRESHOLD', 200))
+    SESSION_JOURNAL_FSYNC = os.getenv('SESSION_JOURNAL_FSYNC', 'false').lower() == 'true'
+    # sqlite 模式下已读入内存的会话消息上限（MB），超出后按 LRU 移出最久未访问会话的消息
+    SESSION_MESSAGE_CACHE_MB = float(os.getenv('SESSION_MESSAGE_CACHE_MB', 64))
+    
+    # 过期会话清理：扫描间隔（秒）与每批最多删除的会话数
+    SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 60))
+    SESSION_SWEEP_BATCH_SIZE = int(os.getenv('SESSION_SWEEP_BATCH_SIZE', 500))
+    
+    # 冷会话归档：空闲超过 SESSION_ARCHIVE_AFTER 秒（应小于 24 小时的会话超时）的会话由清理线程
+    # 移出热存储，按用户压缩保存（gzip 或 lzma），打开时自动恢复；目录默认为 sessions.json 同目录下的 session_archive
+    SESSION_ARCHIVE_ENABLED = os.getenv('SESSION_ARCHIVE_ENABLED', 'true').lower() == 'true'
+    SESSION_ARCHIVE_AFTER = float(os.getenv('SESSION_ARCHIVE_AFTER', 6 * 3600))
+    SESSION_ARCHIVE_COMPRESSION = os.getenv('SESSION_ARCHIVE_COMPRESSION', 'gzip')
+    SESSION_ARCHIVE_DIR = os.getenv('SESSION_ARCHIVE_DIR') or None
+    
+    # 会话消息保留条数：默认值，可按角色或用户等级（管理员为 admin，其余默认 standard）覆盖，
+    # 角色配置优先，例如 {'socrates': 100} / {'admin': 200}
+    SESSION_MAX_MESSAGES = int(os.getenv('SESSION_MAX_MESSAGES', 50))
+    SESSION_RETENTION_BY_CHARACTER = {}
+    SESSION_RETENTION_BY_TIER = {}
+    
+    # 消息分页接口单页最多返回的条数
+    SESSION_PAGE_MAX_LIMIT = int(os.getenv('SESSION_PAGE_MAX_LIMIT', 200))
+    
+    # 滚动摘要：未摘要的对话超过 TRIGGER 条时，后台把除最近 KEEP_RECENT 条之外的部分折叠进 context_summary
+    SESSION_SUMMARY_ENABLED = os.getenv('SESSION_SUMMARY_ENABLED', 'true').lower() == 'true'
+    SESSION_SUMMARY_TRIGGER = int(os.getenv('SESSION_SUMMARY_TRIGGER', 30))
+    SESSION_SUMMARY_KEEP_RECENT = int(os.getenv('SESSION_SUMMARY_KEEP_RECENT', 10))
+    SESSION_SUMMARY_MODEL = os.getenv('SESSION_SUMMARY_MODEL', 'x-ai/grok-4-fast')
+    SESSION_SUMMARY_MAX_TOKENS = int(os.getenv('SESSION_SUMMARY_MAX_TOKENS', 512))
+    SESSION_SUMMARY_WORKERS = int(os.getenv('SESSION_SUMMARY_WORKERS', 2))
+    
+    # 聊天回复之后的记账任务（保存助手消息、累加亲密度、聊天日志）在后台执行，同一会话按提交顺序串行；
+    # 待执行任务超过 QUEUE_MAX 时提交方阻塞等待。WORKERS 为 0 时在请求线程里同步执行
+    POST_RESPONSE_WORKERS = int(os.getenv('POST_RESPONSE_WORKERS', 4))
+    POST_RESPONSE_QUEUE_MAX = int(os.getenv('POST_RESPONSE_QUEUE_MAX', 1000))
+    
     # 默认模型配置
     DEFAULT_MODEL = 'x-ai/grok-4-fast'
     
+    # 上下文 token 预算：每轮发送给模型的系统消息 + 历史消息的上限（按模型配置）
+    CONTEXT_TOKEN_BUDGETS = {
+        'x-ai/grok-4-fast': 8000,
+    }
+    DEFAULT_CONTEXT_TOKEN_BUDGET = int(os.getenv('DEFAULT_CONTEXT_TOKEN_BUDGET', 4000))
+    # 模型上下文窗口（输入 + 输出），用于按已用 token 数调整 max_tokens
+    MODEL_CONTEXT_WINDOWS = {
+        'x-ai/grok-4-fast': 2000000,
+    }
+    DEFAULT_MODEL_CONTEXT_WINDOW = int(os.getenv('DEFAULT_MODEL_CONTEXT_WINDOW', 32768))
+    MIN_COMPLETION_TOKENS = 256
+    
     # 角色配置
     CHARACTER_PROMPT_TEMPLATE = """你现在需要扮演{character_name}，请严格按照以下要求进行对话：
 1. 保持{character_name}的语言风格、性格特点和知识背景
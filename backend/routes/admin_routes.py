@@ -2,9 +2,14 @@
 管理员路由
 """
 from flask import Blueprint, request, jsonify
+from config import Config
 from services.log_service import LogService
 from services.user_service import get_user_service
-from services.session_service import SessionService
+from services.session_service import get_session_service
+from services.intimacy_service import IntimacyService
+from services.write_behind import get_write_behind_stats
+from services.background_tasks import get_post_response_executor
+from services.http_client import get_http_client
 import json
 import os
 from datetime import datetime, timedelta
@@ -55,7 +60,14 @@ def get_all_users():
             return jsonify({'success': False, 'error': '权限不足'}), 403
         
         user_service = get_user_service()
-        result = user_service.get_all_users(token)
+        result = user_service.get_all_users(
+            token,
+            page=request.args.get('page', 1, type=int),
+            page_size=request.args.get('page_size', type=int),
+            sort=request.args.get('sort', 'created_at'),
+            order=request.args.get('order', 'asc'),
+            prefix=request.args.get('q')
+        )
         
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                       log_level='Info', message=f'管理员获取用户列表，共{result.get("total", 0)}个用户')
@@ -335,7 +347,7 @@ def get_statistics():
             return jsonify({'success': False, 'error': '权限不足'}), 403
         
         user_service = get_user_service()
-        session_service = SessionService()
+        session_service = get_session_service()
         
         # 获取基本统计
         users_result = user_service.get_all_users(token)
@@ -346,31 +358,25 @@ def get_statistics():
         total_characters = len(configs)
         
         # 获取会话统计
-        all_sessions = session_service.get_all_sessions()
         total_messages = 0
         today_messages = 0
         character_stats = {}
         
-        # 计算今天的日期
-        from datetime import datetime, timedelta
-        today = datetime.now().date()
+        # 计算今天零点的时间戳（消息时间戳为 epoch 秒，直接比较）
+        from datetime import datetime, time as day_time
+        today_start = datetime.combine(datetime.now().date(), day_time.min).timestamp()
         
-        for session_id, session_data in all_sessions.items():
+        # 只读消息数和今日消息数，不把消息内容读进内存
+        for session_data in session_service.get_message_stats(today_start):
             # 统计消息数量
-            messages = session_data.get('messages', [])
-            total_messages += len(messages)
+            message_count = session_data['message_count']
+            total_messages += message_count
             
             # 统计今日消息
-            for message in messages:
-                try:
-                    message_date = datetime.fromisoformat(message.get('timestamp', '')).date()
-                    if message_date == today:
-                        today_messages += 1
-                except:
-                    pass
+            today_messages += session_data['recent_count']
             
             # 统计角色使用情况
-            character_id = session_data.get('character_id', 'unknown')
+            character_id = session_data.get('character_id') or 'unknown'
             if character_id not in character_stats:
                 character_stats[character_id] = {
                     'messageCount': 0,
@@ -379,27 +385,45 @@ def get_statistics():
                     'totalIntimacy': 0
                 }
             
-            character_stats[character_id]['messageCount'] += len(messages)
+            character_stats[character_id]['messageCount'] += message_count
             character_stats[character_id]['sessionCount'] += 1
             user_id = session_data.get('user_id')
             if user_id:
                 character_stats[character_id]['userCount'].add(user_id)
         
-        # 计算每个角色的亲密度总和（基于所有用户）
-        all_users_data = user_service.get_all_users_data()
-        for user_id, user_data in all_users_data.items():
-            intimacy_data = user_data.get('intimacy', {})
-            for character_id, intimacy_value in intimacy_data.items():
-                if character_id in character_stats:
-                    character_stats[character_id]['totalIntimacy'] += intimacy_value
-                elif character_id in configs:
-                    # 如果角色存在但没有会话记录，也要统计亲密度
-                    character_stats[character_id] = {
-                        'messageCount': 0,
-                        'userCount': set(),
-                        'sessionCount': 0,
-                        'totalIntimacy': intimacy_value
-                    }
+        # 已归档的会话只读归档索引中的元数据（消息数与按天的消息数），不解压归档文件
+        today = datetime.now().date().isoformat()
+        for meta in session_service.get_archived_sessions():
+            message_count = meta.get('message_count') or 0
+            total_messages += message_count
+            today_messages += (meta.get('daily_message_counts') or {}).get(today, 0)
+            
+            character_id = meta.get('character_id') or 'unknown'
+            if character_id not in character_stats:
+                character_stats[character_id] = {
+                    'messageCount': 0,
+                    'userCount': set(),
+                    'sessionCount': 0,
+                    'totalIntimacy': 0
+                }
+            
+            character_stats[character_id]['messageCount'] += message_count
+            character_stats[character_id]['sessionCount'] += 1
+            if meta.get('user_id'):
+                character_stats[character_id]['userCount'].add(meta['user_id'])
+        
+        # 每个角色的亲密度总和（亲密度计数随累加维护，直接读取）
+        for character_id, intimacy_value in IntimacyService().get_character_totals().items():
+            if character_id in character_stats:
+                character_stats[character_id]['totalIntimacy'] += intimacy_value
+            elif character_id in configs:
+                # 如果角色存在但没有会话记录，也要统计亲密度
+                character_stats[character_id] = {
+                    'messageCount': 0,
+                    'userCount': set(),
+                    'sessionCount': 0,
+                    'totalIntimacy': intimacy_value
+                }
         
         # 生成热门角色列表（按亲密度总和排序）
         popular_characters = []
@@ -426,7 +450,17 @@ def get_statistics():
             'totalUsers': total_users,
             'totalCharacters': total_characters,
             'todayMessages': today_messages,
-            'popularCharacters': popular_characters
+            'popularCharacters': popular_characters,
+            'sessionExpiry': session_service.get_expiry_stats(),
+            'sessionSummary': session_service.get_summary_stats(),
+            'sessionMessageCache': session_service.get_message_cache_stats(),
+            'sessionArchive': session_service.get_archive_stats(),
+            'userTokens': user_service.tokens.get_stats(),
+            'userStore': user_service.store.get_stats(),
+            'writeBehind': get_write_behind_stats(),
+            'postResponse': get_post_response_executor().get_stats(),
+            'intimacyEvents': IntimacyService().events.get_stats(),
+            'upstreamHttp': get_http_client().get_stats()
         }
         
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
@@ -455,48 +489,79 @@ def get_character_user_stats(character_id):
             return jsonify({'success': False, 'error': '权限不足'}), 403
         
         user_service = get_user_service()
-        session_service = SessionService()
+        session_service = get_session_service()
         
-        # 获取所有用户数据
-        all_users_data = user_service.get_all_users_data()
+        # 按亲密度从高到低分页读取角色排行榜（亲密度>0的用户），对话数按 (用户, 角色) 会话索引统计
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = request.args.get('page_size', Config.INTIMACY_LEADERBOARD_PAGE_SIZE, type=int)
+        page_size = min(max(page_size, 1), Config.INTIMACY_LEADERBOARD_PAGE_MAX)
+        leaderboard = IntimacyService().get_leaderboard(character_id, (page - 1) * page_size, page_size)
         
-        # 获取所有会话数据
-        all_sessions = session_service.get_all_sessions()
-        
-        # 统计每个用户与该角色的数据
         user_stats = []
-        
-        for user_id, user_data in all_users_data.items():
-            # 获取该用户与该角色的亲密度
-            intimacy = user_data.get('intimacy', {}).get(character_id, 0)
-            
-            # 统计该用户与该角色的对话数
-            message_count = 0
-            for session_id, session_data in all_sessions.items():
-                if (session_data.get('user_id') == user_id and 
-                    session_data.get('character_id') == character_id):
-                    message_count += len(session_data.get('messages', []))
-            
-            # 只包含有交互的用户（亲密度>0或有对话）
-            if intimacy > 0 or message_count > 0:
-                user_stats.append({
-                    'userId': user_id,
-                    'username': user_data.get('username', ''),
-                    'nickname': user_data.get('nickname', user_data.get('username', '')),
-                    'avatar': user_data.get('avatar', '/user-avatar.svg'),
-                    'intimacy': intimacy,
-                    'messageCount': message_count
-                })
-        
-        # 按亲密度降序排序
-        user_stats.sort(key=lambda x: x['intimacy'], reverse=True)
+        for entry in leaderboard['entries']:
+            profile = user_service.get_public_profile(entry['user_id'])
+            if profile is None:
+                continue
+            user_stats.append({
+                'userId': entry['user_id'],
+                'username': profile['username'],
+                'nickname': profile['nickname'],
+                'avatar': profile['avatar'] or '/user-avatar.svg',
+                'intimacy': entry['intimacy'],
+                'rank': entry['rank'],
+                'messageCount': session_service.count_user_messages(entry['user_id'], character_id)
+            })
         
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
-                      log_level='Info', message=f'获取角色{character_id}用户统计: {len(user_stats)}个用户')
+                      log_level='Info', message=f'获取角色{character_id}用户统计: {leaderboard["total"]}个用户')
         
-        return jsonify({'success': True, 'data': user_stats})
+        return jsonify({'success': True, 'data': user_stats, 'total': leaderboard['total'],
+                        'page': page, 'page_size': page_size})
         
     except Exception as e:
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                       log_level='Error', message=f'获取角色用户统计失败: {str(e)}')
         return jsonify({'success': False, 'error': '获取角色用户统计失败'}), 500
+
+@admin_bp.route('/intimacy-trends', methods=['GET'])
+def get_intimacy_trends():
+    """获取亲密度趋势（按天、按角色汇总以及升级记录）"""
+    current_time = LogService.get_current_time()
+    function_name = 'get_intimacy_trends'
+    model_name = 'Admin'
+    
+    try:
+        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        if not token:
+            return jsonify({'success': False, 'error': '缺少认证令牌'}), 401
+        
+        if not check_admin_permission(token):
+            return jsonify({'success': False, 'error': '权限不足'}), 403
+        
+        # 日期范围为 YYYY-MM-DD（含首尾），默认最近 INTIMACY_TREND_DAYS 天
+        try:
+            end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else datetime.now().date()
+            start = (datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start')
+                     else end - timedelta(days=Config.INTIMACY_TREND_DAYS - 1))
+        except ValueError:
+            return jsonify({'success': False, 'error': '日期格式应为 YYYY-MM-DD'}), 400
+        if start > end:
+            return jsonify({'success': False, 'error': '开始日期不能晚于结束日期'}), 400
+        start = max(start, end - timedelta(days=Config.INTIMACY_TREND_MAX_DAYS - 1))
+        character_id = request.args.get('character_id') or None
+        
+        trends = IntimacyService().get_trends(start, end, character_id)
+        user_service = get_user_service()
+        for event in trends['level_ups']:
+            profile = user_service.get_public_profile(event['user_id'])
+            event['nickname'] = profile['nickname'] if profile else None
+        
+        LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
+                      log_level='Info', message=f'获取亲密度趋势: {start} ~ {end}, 升级{len(trends["level_ups"])}次')
+        
+        return jsonify({'success': True, 'data': trends, 'start': start.isoformat(), 'end': end.isoformat()})
+        
+    except Exception as e:
+        LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
+                      log_level='Error', message=f'获取亲密度趋势失败: {str(e)}')
+        return jsonify({'success': False, 'error': '获取亲密度趋势失败'}), 500
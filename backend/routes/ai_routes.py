@@ -1,17 +1,18 @@
 """
 AI相关的路由处理
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import Config
-from routes.ai_service import AIService
+from routes.ai_service import get_ai_service
 from services.log_service import LogService
-from services.session_service import SessionService
+from services.session_service import get_session_service
 from services.intimacy_service import IntimacyService
-from services.user_service import UserService
+from services.background_tasks import get_post_response_executor
+from services.user_service import get_user_service
 import json
 
 # 创建蓝图
@@ -30,6 +31,39 @@ def load_character_configs():
         LogService.log(current_time=current_time, model_name='App', function_name='load_character_configs', log_level='Error', message=f'加载角色配置失败: {str(e)}')
         return {}
 
+def _sse_event(data, event=None):
+    """一条 SSE 事件"""
+    prefix = f'event: {event}\n' if event else ''
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _stream_reply(deltas, done_data, on_finish, model, function_name, current_time):
+    """把模型回复的文本增量以 text/event-stream 转发给客户端
+    
+    每段增量是一条 {"content": 增量} 消息；生成结束后发送 done 事件（完整回复以及 done_data），
+    上游中途出错时发送 error 事件。无论正常结束、出错还是客户端断开，最后都用已生成的内容调用 on_finish。
+    """
+    def generate():
+        parts = []
+        try:
+            for delta in deltas:
+                parts.append(delta)
+                yield _sse_event({'content': delta})
+            yield _sse_event(dict(done_data, content=''.join(parts)), 'done')
+        except Exception as e:
+            LogService.log(current_time=current_time, model_name=model, function_name=function_name,
+                         log_level='Error', message=f'流式回复中断: {str(e)}')
+            yield _sse_event({'success': False, 'error': 'AI服务响应中断'}, 'error')
+        finally:
+            # 客户端断开时服务器关闭本生成器，同时关闭上游连接
+            close = getattr(deltas, 'close', None)
+            if close is not None:
+                close()
+            on_finish(''.join(parts))
+    
+    # 禁止代理缓冲，每段增量到达后立即发给客户端
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # 移除全局缓存，每次使用时重新加载
 
 @ai_bp.route('/models', methods=['GET'])
@@ -43,7 +77,7 @@ def get_models():
     LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, log_level='Info', message='请求开始获取可用模型列表')
     
     try:
-        ai_service = AIService()
+        ai_service = get_ai_service()
         models = ai_service.list_models()
         
         # 请求成功日志
@@ -92,7 +126,7 @@ def chat():
         last_message_content = messages[-1].get('content', '')[:50] if messages else ''
         LogService.log(current_time=current_time, model_name=model, function_name=function_name, log_level='Debug', message=f'最后一条消息内容: {last_message_content}...')
         
-        ai_service = AIService()
+        ai_service = get_ai_service()
         response = ai_service.chat_completion(messages, model, stream, max_tokens)
         
         if not response:
@@ -102,6 +136,11 @@ def chat():
                 'error': 'AI服务响应失败'
             }), 500
         
+        if stream:
+            def on_finish(content):
+                LogService.log(current_time=current_time, model_name=model, function_name=function_name, log_level='Info', message=f'流式聊天请求处理完成, 响应内容长度: {len(content)}字符')
+            return _stream_reply(response, {'success': True}, on_finish, model, function_name, current_time)
+        
         # 提取响应内容
         content = response.get('choices', [{}])[0].get('message', {}).get('content', '')
         
@@ -164,24 +203,30 @@ def character_chat():
         LogService.log(current_time=current_time, model_name=model, function_name=function_name, 
                      log_level='Debug', message=f'用户查询内容: {user_query_content}...')
         
-        ai_service = AIService()
-        session_service = SessionService()
+        ai_service = get_ai_service()
+        session_service = get_session_service()
+        post_response = get_post_response_executor()
+        if session_id:
+            # 上一轮回复的记账任务（保存助手消息、累加亲密度）执行完后再处理这一轮，保证消息顺序
+            post_response.wait(session_id)
         
         # 获取用户亲密度信息
         intimacy_level = 0
         intimacy_name = "陌生人"
+        intimacy_loaded = False
         is_first_message = False
         session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        user_id = None
+        intimacy_service = IntimacyService()
         
         if session_token and character_id:
             try:
-                user_service = UserService()
-                user_id = user_service.get_user_id_by_session(session_token)
+                # 亲密度保存在进程内的计数表中，读取和累加都不访问磁盘
+                user_id = get_user_service().get_user_id_by_session(session_token)
                 if user_id:
-                    from services.intimacy_service import IntimacyService
-                    intimacy_service = IntimacyService()
                     intimacy_level = intimacy_service.get_intimacy(user_id, character_id)
                     intimacy_name = intimacy_service.get_level_name(intimacy_level)
+                    intimacy_loaded = True
                     LogService.log(current_time=current_time, model_name=model, function_name=function_name,
                                  log_level='Info', message=f'获取亲密度: 用户 {user_id}, 角色 {character_id}, 亲密度 {intimacy_level}({intimacy_name})')
             except Exception as e:
@@ -193,18 +238,20 @@ def character_chat():
             # 先将用户消息添加到会话中
             session_service.add_message(session_id, 'user', user_query, character_id)
             
-            # 获取会话上下文消息
-            context_messages = session_service.get_context_messages(session_id, character_name, character_description)
+            # 获取会话上下文消息（按模型的 token 预算截取最新的历史）
+            context_messages, context_tokens = session_service.build_context(
+                session_id, character_name, character_description, model
+            )
             
-            # 检查是否是第一次对话（除了系统消息外没有其他消息）
-            user_messages = [msg for msg in context_messages if msg.get('role') == 'user']
+            # 检查是否是第一次对话（上下文可能被预算截断，因此按完整历史判断）
+            user_messages = [msg for msg in session_service.get_messages(session_id) if msg.get('role') == 'user']
             is_first_message = len(user_messages) <= 1  # 当前用户消息已经添加，所以<=1表示是第一次
             
             # 使用带亲密度的聊天方法
             response = ai_service.character_chat_with_intimacy(
                 context_messages, character_name, character_description,
                 intimacy_level, intimacy_name, is_first_message,
-                model, stream
+                model, stream, context_tokens=context_tokens
             )
         else:
             # 没有会话ID的情况，构建简单的消息列表
@@ -226,36 +273,28 @@ def character_chat():
                 'error': 'AI服务响应失败'
             }), 500
         
-        # 提取响应内容
-        content = response.get('choices', [{}])[0].get('message', {}).get('content', '')
-        
-        # 如果有会话ID，将AI回复也添加到会话中
-        if session_id:
-            session_service.add_message(session_id, 'assistant', content, character_id)
-        
-        # 增加亲密度（仅对已登录用户）
-        intimacy_result = None
-        session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        if session_token and character_id:
-            try:
-                user_service = UserService()
-                user_id = user_service.get_user_id_by_session(session_token)
-                if user_id:
-                    intimacy_service = IntimacyService()
-                    intimacy_result = intimacy_service.increase_intimacy(user_id, character_id)
+        # 保存助手消息、累加亲密度和聊天日志交给后台执行（同一会话按顺序），回复内容直接返回
+        def record_reply(content):
+            if session_id:
+                session_service.add_message(session_id, 'assistant', content, character_id)
+            if user_id and character_id:
+                try:
+                    intimacy_service.increase_intimacy(user_id, character_id)
                     LogService.log(current_time=current_time, model_name=model, function_name=function_name,
                                  log_level='Info', message=f'亲密度增加: 用户 {user_id}, 角色 {character_id}')
-            except Exception as e:
-                LogService.log(current_time=current_time, model_name=model, function_name=function_name,
-                             log_level='Warning', message=f'增加亲密度失败: {str(e)}')
+                except Exception as e:
+                    LogService.log(current_time=current_time, model_name=model, function_name=function_name,
+                                 log_level='Warning', message=f'增加亲密度失败: {str(e)}')
+            LogService.log(current_time=current_time, model_name=model, function_name=function_name, 
+                         log_level='Info', message=f'角色扮演聊天请求处理成功, 响应内容长度: {len(content)}字符')
         
-        # 请求成功日志
-        LogService.log(current_time=current_time, model_name=model, function_name=function_name, 
-                     log_level='Info', message=f'角色扮演聊天请求处理成功, 响应内容长度: {len(content)}字符')
+        # 返回给前端的亲密度按请求开始时读到的值加一计算，后台任务随后完成实际的累加
+        intimacy_result = None
+        if user_id and character_id and intimacy_loaded:
+            intimacy_result = intimacy_service.describe_increase(intimacy_level)
         
         response_data = {
             'success': True,
-            'content': content,
             'character_id': character_id,
             'session_id': session_id
         }
@@ -269,6 +308,29 @@ def character_chat():
                 'old_level': intimacy_result.get('old_level')
             }
         
+        if stream:
+            # 流式：上游每生成一段就转发给客户端，生成结束（或客户端断开）后保存已生成的回复。
+            # 回复生成期间先为会话预留记账任务的位置，同一会话的下一轮请求会等到这一轮保存完
+            reservation = post_response.reserve(session_id or object())
+            
+            def on_finish(content):
+                if content:
+                    reservation.submit(record_reply, content)
+                else:
+                    reservation.cancel()
+            
+            reply = _stream_reply(response, response_data, on_finish, model, function_name, current_time)
+            # 生成器还没开始就被关闭时不会调用 on_finish，响应关闭时兜底释放预留位置
+            reply.call_on_close(reservation.cancel)
+            return reply
+        
+        # 提取响应内容
+        content = response.get('choices', [{}])[0].get('message', {}).get('content', '')
+        response_data['content'] = content
+        
+        # 没有会话ID的请求之间不需要保持顺序
+        post_response.submit(session_id or object(), record_reply, content)
+        
         return jsonify(response_data)
     except Exception as e:
         LogService.log(current_time=current_time, model_name=Config.DEFAULT_MODEL, function_name=function_name, 
@@ -353,7 +415,7 @@ def multimodal_chat():
             }), 400
         
         # 调用多模态服务
-        ai_service = AIService()
+        ai_service = get_ai_service()
         response = ai_service.multimodal_completion(text, image, audio, video, model)
         
         if not response:
@@ -7,6 +7,8 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import Config
+from services.http_client import get_http_client
+from services.context_builder import completion_budget, estimate_tokens, MESSAGE_OVERHEAD_TOKENS
 
 class AIService:
     def __init__(self):
@@ -56,12 +58,17 @@ class AIService:
     
     
     def chat_completion(self, messages, model=None, stream=False, max_tokens=4096):
-        """发送聊天请求到AI模型"""
+        """发送聊天请求到AI模型
+        
+        stream 为 True 时返回逐段产出回复文本的生成器（见 chat_completion_stream）。
+        """
         # 获取当前时间
         current_time = datetime.datetime.now().strftime('%Y%m%d/%H:%M')
         function_name = 'chat_completion'
         if model is None:
             model = self.default_model
+        if stream:
+            return self.chat_completion_stream(messages, model, max_tokens)
         
         try:
             # 方法开始日志
@@ -93,12 +100,12 @@ class AIService:
             
             # 添加代理支持并处理可能的代理错误
             try:
-                response = requests.post(url, json=payload, headers=headers, proxies=self.proxies, timeout=30)
+                response = get_http_client().post(url, json=payload, headers=headers, proxies=self.proxies)
             except requests.exceptions.ProxyError as proxy_err:
                 print(f"[{current_time}--{model}-{function_name}-[Error]: 代理连接错误: {str(proxy_err)}")
                 # 尝试不使用代理再次请求
                 print(f"[{current_time}--{model}-{function_name}-[Info]: 尝试不使用代理重新请求")
-                response = requests.post(url, json=payload, headers=headers, timeout=30)
+                response = get_http_client().post(url, json=payload, headers=headers)
             except requests.exceptions.Timeout as timeout_err:
                 print(f"[{current_time}--{model}-{function_name}-[Error]: 请求超时: {str(timeout_err)}")
                 return None
@@ -117,6 +124,79 @@ class AIService:
             print(f"[{current_time}--{model}-{function_name}-[Error]: 聊天请求异常: {str(e)}")
             return None
     
+    def chat_completion_stream(self, messages, model=None, max_tokens=4096):
+        """以流式（SSE）请求AI模型，返回逐段产出回复文本的生成器
+        
+        连接和状态码在返回前检查，失败时返回 None；之后上游每到一个数据块就产出其中的增量文本，
+        不等待整个回复生成完。生成器关闭（如客户端断开）时同时关闭上游连接。
+        """
+        # 获取当前时间
+        current_time = datetime.datetime.now().strftime('%Y%m%d/%H:%M')
+        function_name = 'chat_completion_stream'
+        if model is None:
+            model = self.default_model
+        
+        try:
+            # 方法开始日志
+            print(f"[{current_time}--{model}-{function_name}-[Info]: 开始处理流式聊天请求, 消息数量: {len(messages)}, max_tokens: {max_tokens}")
+            
+            headers = {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream"
+            }
+            payload = {
+                "stream": True,
+                "model": model,
+                "messages": messages,
+                "max_tokens": max_tokens
+            }
+            url = f"{self.base_url}/chat/completions"
+            
+            # timeout 在流式请求中是两次收到数据之间的最长等待时间，而不是整个回复的生成时间
+            try:
+                response = get_http_client().post(url, json=payload, headers=headers, proxies=self.proxies, stream=True)
+            except requests.exceptions.ProxyError as proxy_err:
+                print(f"[{current_time}--{model}-{function_name}-[Error]: 代理连接错误: {str(proxy_err)}")
+                print(f"[{current_time}--{model}-{function_name}-[Info]: 尝试不使用代理重新请求")
+                response = get_http_client().post(url, json=payload, headers=headers, stream=True)
+            except requests.exceptions.Timeout as timeout_err:
+                print(f"[{current_time}--{model}-{function_name}-[Error]: 请求超时: {str(timeout_err)}")
+                return None
+            
+            if response.status_code != 200:
+                print(f"[{current_time}--{model}-{function_name}-[Error]: 流式聊天请求失败，状态码: {response.status_code}, 错误信息: {response.text}")
+                response.close()
+                return None
+            return self._iter_stream_deltas(response, model)
+        except Exception as e:
+            print(f"[{current_time}--{model}-{function_name}-[Error]: 流式聊天请求异常: {str(e)}")
+            return None
+    
+    def _iter_stream_deltas(self, response, model):
+        """逐行解析上游的 SSE 数据块（data: {...}，以 data: [DONE] 结束），产出每块中的增量文本"""
+        current_time = datetime.datetime.now().strftime('%Y%m%d/%H:%M')
+        function_name = 'chat_completion_stream'
+        total_length = 0
+        try:
+            for line in response.iter_lines():
+                if not line or not line.startswith(b'data:'):
+                    continue  # 空行分隔事件，其余字段（event:、注释等）不需要
+                data = line[5:].strip()
+                if data == b'[DONE]':
+                    break
+                chunk = json.loads(data)
+                choices = chunk.get('choices') or []
+                if not choices:
+                    continue
+                delta = (choices[0].get('delta') or {}).get('content')
+                if delta:
+                    total_length += len(delta)
+                    yield delta
+            print(f"[{current_time}--{model}-{function_name}-[Info]: 流式聊天请求完成, 响应内容长度: {total_length}字符")
+        finally:
+            response.close()
+    
     def character_chat(self, character_name, character_description, user_query, 
                       model=None, stream=False):
         """以特定角色进行对话（兼容旧接口）"""
@@ -150,7 +230,7 @@ class AIService:
             result = self.chat_completion(messages, model, stream)
             
             # 处理响应结果
-            if result:
+            if isinstance(result, dict):
                 content_length = len(result.get('choices', [{}])[0].get('message', {}).get('content', ''))
                 print(f"[{current_time}--{model}-{function_name}-[Info]: 角色扮演聊天请求成功, 响应内容长度: {content_length}字符")
             return result
@@ -190,7 +270,7 @@ class AIService:
             result = self.chat_completion(messages, model, stream, max_tokens)
             
             # 处理响应结果
-            if result:
+            if isinstance(result, dict):
                 content_length = len(result.get('choices', [{}])[0].get('message', {}).get('content', ''))
                 print(f"[{current_time}--{model}-{function_name}-[Info]: 带上下文角色扮演聊天成功, 响应内容长度: {content_length}字符")
             return result
@@ -200,8 +280,12 @@ class AIService:
     
     def character_chat_with_intimacy(self, messages, character_name=None, character_description=None, 
                                    intimacy_level=0, intimacy_name="陌生人", is_first_message=False,
-                                   model=None, stream=False, max_tokens=4096):
-        """带亲密度的角色扮演对话"""
+                                   model=None, stream=False, max_tokens=4096, context_tokens=None):
+        """带亲密度的角色扮演对话
+        
+        context_tokens 为 messages 的估算 token 数（见 SessionService.build_context），
+        提供时会在模型上下文窗口内相应收紧 max_tokens。
+        """
         # 获取当前时间
         current_time = datetime.datetime.now().strftime('%Y%m%d/%H:%M')
         function_name = 'character_chat_with_intimacy'
@@ -232,6 +316,12 @@ class AIService:
                         "content": system_content
                     }
                     messages = [system_message] + messages
+                    if context_tokens is not None:
+                        context_tokens += estimate_tokens(system_content) + MESSAGE_OVERHEAD_TOKENS
+            
+            if context_tokens is not None:
+                max_tokens = completion_budget(model, context_tokens, max_tokens)
+                print(f"[{current_time}--{model}-{function_name}-[Debug]: 上下文约 {context_tokens} tokens, max_tokens: {max_tokens}")
             
             # 调试日志：打印消息概要和亲密度信息
             if messages:
@@ -242,7 +332,7 @@ class AIService:
             result = self.chat_completion(messages, model, stream, max_tokens)
             
             # 处理响应结果
-            if result:
+            if isinstance(result, dict):
                 content_length = len(result.get('choices', [{}])[0].get('message', {}).get('content', ''))
                 print(f"[{current_time}--{model}-{function_name}-[Info]: 带亲密度角色扮演聊天成功, 响应内容长度: {content_length}字符")
             return result
@@ -453,12 +543,12 @@ class AIService:
             
             # 添加代理支持并处理可能的代理错误
             try:
-                response = requests.post(url, json=payload, headers=headers, proxies=self.proxies, timeout=30)
+                response = get_http_client().post(url, json=payload, headers=headers, proxies=self.proxies)
             except requests.exceptions.ProxyError as proxy_err:
                 print(f"[{current_time}--{model}-{function_name}-[Error]: 代理连接错误: {str(proxy_err)}")
                 # 尝试不使用代理再次请求
                 print(f"[{current_time}--{model}-{function_name}-[Info]: 尝试不使用代理重新请求")
-                response = requests.post(url, json=payload, headers=headers, timeout=30)
+                response = get_http_client().post(url, json=payload, headers=headers)
             except requests.exceptions.Timeout as timeout_err:
                 print(f"[{current_time}--{model}-{function_name}-[Error]: 请求超时: {str(timeout_err)}")
                 return None
@@ -485,9 +575,25 @@ class AIService:
         
         try:
             # 对于非流式响应，直接返回内容
-            if "choices" in response and len(response["choices"]) > 0:
-                content = response["choices"][0]["message"]["content"]
-                yield content
+            if isinstance(response, dict):
+                if "choices" in response and len(response["choices"]) > 0:
+                    content = response["choices"][0]["message"]["content"]
+                    yield content
+                return
+            # 流式响应逐段返回
+            for delta in response:
+                yield delta
         except Exception as e:
             print(f"处理响应失败: {e}")
-            yield "发生错误，请重试"
\ No newline at end of file
+            yield "发生错误，请重试"
+
+
+_ai_service = None
+
+
+def get_ai_service() -> AIService:
+    """进程内共享的 AIService（只保存配置，可在线程之间共用）"""
+    global _ai_service
+    if _ai_service is None:
+        _ai_service = AIService()
+    return _ai_service
@@ -102,8 +102,8 @@ def login():
                     # 使用昵称或用户名生成头像
                     display_name = user.get('nickname') or user.get('username')
                     avatar_data = create_user_avatar(display_name)
-                    user_service.update_user_avatar(user['id'], avatar_data)
-                    result['user']['avatar'] = avatar_data
+                    updated = user_service.update_user_avatar(user['id'], avatar_data)
+                    result['user']['avatar'] = updated.get('avatar', avatar_data)
                     LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                                  log_level='Info', message=f'为用户生成头像: {username}')
             except Exception as e:
@@ -0,0 +1,29 @@
+"""
+用户头像文件路由
+"""
+from flask import Blueprint, jsonify, send_file
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.user_service import get_user_service
+
+# 创建蓝图
+avatar_bp = Blueprint('avatar', __name__)
+
+# 头像 URL 中带有内容哈希，内容变化时 URL 也会变化，可以按不可变资源长期缓存
+AVATAR_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@avatar_bp.route('/avatars/<name>', methods=['GET'])
+def get_avatar(name):
+    """按内容哈希返回用户头像图片"""
+    found = get_user_service().avatars.resolve(name)
+    if found is None:
+        return jsonify({'success': False, 'error': '头像不存在'}), 404
+
+    path, content_type = found
+    response = send_file(path, mimetype=content_type, etag=name.split('.')[0], conditional=True,
+                         max_age=31536000)
+    response.headers['Cache-Control'] = AVATAR_CACHE_CONTROL
+    return response
@@ -4,7 +4,8 @@
 from flask import Blueprint, request, jsonify
 from services.intimacy_service import IntimacyService
 from services.log_service import LogService
-from services.user_service import UserService
+from config import Config
+from services.user_service import get_user_service
 
 # 创建蓝图
 intimacy_bp = Blueprint('intimacy', __name__)
@@ -24,7 +25,7 @@ def get_intimacy(character_id):
                 'error': '未提供认证令牌'
             }), 401
         
-        user_service = UserService()
+        user_service = get_user_service()
         user_id = user_service.get_user_id_by_session(session_token)
         
         if not user_id:
@@ -79,7 +80,7 @@ def increase_intimacy(character_id):
                 'error': '未提供认证令牌'
             }), 401
         
-        user_service = UserService()
+        user_service = get_user_service()
         user_id = user_service.get_user_id_by_session(session_token)
         
         if not user_id:
@@ -118,6 +119,72 @@ def increase_intimacy(character_id):
             'error': str(e)
         }), 500
 
+@intimacy_bp.route('/intimacy/<character_id>/leaderboard', methods=['GET'])
+def get_intimacy_leaderboard(character_id):
+    """角色亲密度排行榜（?page=&page_size= 分页），附带当前用户的名次"""
+    current_time = LogService.get_current_time()
+    function_name = 'get_intimacy_leaderboard'
+    
+    try:
+        session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        if not session_token:
+            return jsonify({
+                'success': False,
+                'error': '未提供认证令牌'
+            }), 401
+        
+        user_service = get_user_service()
+        user_id = user_service.get_user_id_by_session(session_token)
+        
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'error': '无效的认证令牌'
+            }), 401
+        
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = request.args.get('page_size', Config.INTIMACY_LEADERBOARD_PAGE_SIZE, type=int)
+        page_size = min(max(page_size, 1), Config.INTIMACY_LEADERBOARD_PAGE_MAX)
+        
+        intimacy_service = IntimacyService()
+        leaderboard = intimacy_service.get_leaderboard(character_id, (page - 1) * page_size, page_size)
+        entries = []
+        for entry in leaderboard['entries']:
+            profile = user_service.get_public_profile(entry['user_id'])
+            if profile is None:
+                continue
+            entries.append({
+                'rank': entry['rank'],
+                'nickname': profile['nickname'],
+                'avatar': profile['avatar'],
+                'intimacy': entry['intimacy'],
+                'level_name': entry['level_name'],
+                'is_me': entry['user_id'] == user_id
+            })
+        
+        return jsonify({
+            'success': True,
+            'entries': entries,
+            'total': leaderboard['total'],
+            'page': page,
+            'page_size': page_size,
+            'my_rank': intimacy_service.get_user_rank(user_id, character_id),
+            'my_intimacy': intimacy_service.get_intimacy(user_id, character_id)
+        })
+        
+    except Exception as e:
+        LogService.log(
+            current_time=current_time,
+            model_name='IntimacyAPI',
+            function_name=function_name,
+            log_level='Error',
+            message=f'获取亲密度排行榜失败: {str(e)}'
+        )
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @intimacy_bp.route('/intimacy/all', methods=['GET'])
 def get_all_intimacy():
     """获取用户所有角色的亲密度"""
@@ -133,7 +200,7 @@ def get_all_intimacy():
                 'error': '未提供认证令牌'
             }), 401
         
-        user_service = UserService()
+        user_service = get_user_service()
         user_id = user_service.get_user_id_by_session(session_token)
         
         if not user_id:
@@ -6,8 +6,10 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from config import Config
 from services.log_service import LogService
-from services.session_service import SessionService
+from services.session_service import get_session_service
+from services.background_tasks import get_post_response_executor
 from services.user_service import get_user_service
 
 # 创建蓝图
@@ -39,7 +41,7 @@ def create_session():
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                      log_level='Info', message=f'创建新会话请求, 角色ID: {character_id}, 用户ID: {user_id}')
         
-        session_service = SessionService()
+        session_service = get_session_service()
         session_id = session_service.create_session(character_id, user_id, user_token)
         
         # 如果是认证用户，将会话添加到用户历史
@@ -61,9 +63,27 @@ def create_session():
             'error': str(e)
         }), 500
 
+def _settle(session_id: str):
+    """等待该会话上一轮回复的后台记账任务（保存助手消息等）执行完，之后读写到的是完整的消息"""
+    get_post_response_executor().wait(session_id)
+
+def _parse_page_args():
+    """解析分页参数 before / limit，未提供时为 None；参数非法时抛出 ValueError"""
+    before = request.args.get('before')
+    limit = request.args.get('limit')
+    before = int(before) if before not in (None, '') else None
+    if limit not in (None, ''):
+        limit = int(limit)
+        if limit <= 0:
+            raise ValueError('limit必须为正整数')
+        limit = min(limit, Config.SESSION_PAGE_MAX_LIMIT)
+    else:
+        limit = None
+    return before, limit
+
 @session_bp.route('/sessions/<session_id>', methods=['GET'])
 def get_session(session_id):
-    """获取会话信息"""
+    """获取会话信息（可用 ?limit=N 只返回最新的 N 条消息）"""
     current_time = LogService.get_current_time()
     function_name = 'get_session'
     model_name = 'API'
@@ -72,7 +92,16 @@ def get_session(session_id):
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                      log_level='Info', message=f'获取会话信息: {session_id}')
         
-        session_service = SessionService()
+        try:
+            _, limit = _parse_page_args()
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': '分页参数错误'
+            }), 400
+        
+        _settle(session_id)
+        session_service = get_session_service()
         session = session_service.get_session(session_id)
         if not session:
             return jsonify({
@@ -82,7 +111,7 @@ def get_session(session_id):
         
         return jsonify({
             'success': True,
-            'session': session
+            'session': session_service.session_to_dict(session, limit)
         })
     except Exception as e:
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
@@ -94,7 +123,11 @@ def get_session(session_id):
 
 @session_bp.route('/sessions/<session_id>/messages', methods=['GET'])
 def get_session_messages(session_id):
-    """获取会话消息历史"""
+    """获取会话消息历史
+    
+    支持游标分页：?limit=N 返回最新的 N 条，?before=<消息ID>&limit=N 返回该消息之前的 N 条；
+    不带参数时返回全部消息。
+    """
     current_time = LogService.get_current_time()
     function_name = 'get_session_messages'
     model_name = 'API'
@@ -103,12 +136,23 @@ def get_session_messages(session_id):
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                      log_level='Info', message=f'获取会话消息: {session_id}')
         
-        session_service = SessionService()
-        messages = session_service.get_messages(session_id)
+        try:
+            before, limit = _parse_page_args()
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': '分页参数错误'
+            }), 400
+        
+        _settle(session_id)
+        session_service = get_session_service()
+        page = session_service.get_messages_page(session_id, before, limit)
+        if page is None:
+            page = {'messages': [], 'has_more': False, 'next_cursor': None}
         
         return jsonify({
             'success': True,
-            'messages': messages
+            **page
         })
     except Exception as e:
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
@@ -129,7 +173,8 @@ def clear_session(session_id):
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                      log_level='Info', message=f'清空会话消息: {session_id}')
         
-        session_service = SessionService()
+        _settle(session_id)
+        session_service = get_session_service()
         success = session_service.clear_session(session_id)
         if not success:
             return jsonify({
@@ -180,7 +225,7 @@ def get_user_sessions():
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                      log_level='Info', message=f'获取用户会话历史, 用户ID: {user["id"]}, 角色ID: {character_id}')
         
-        session_service = SessionService()
+        session_service = get_session_service()
         sessions = session_service.get_user_sessions(token, character_id)
         
         return jsonify({
@@ -225,7 +270,7 @@ def get_latest_session(character_id):
         LogService.log(current_time=current_time, model_name=model_name, function_name=function_name, 
                      log_level='Info', message=f'获取最新会话, 用户ID: {user["id"]}, 角色ID: {character_id}')
         
-        session_service = SessionService()
+        session_service = get_session_service()
         session_id = session_service.get_latest_user_session(token, character_id)
         
         if session_id:
@@ -277,7 +322,8 @@ def delete_session(character_id, session_id):
                      log_level='Info', message=f'删除会话, 用户ID: {user["id"]}, 角色ID: {character_id}, 会话ID: {session_id}')
         
         # 删除会话
-        session_service = SessionService()
+        _settle(session_id)
+        session_service = get_session_service()
         success = session_service.delete_session(session_id)
         
         if success:
@@ -332,7 +378,7 @@ def clear_all_history():
                      log_level='Info', message=f'清空所有历史记录, 用户ID: {user["id"]}')
         
         # 清空用户的所有会话历史
-        session_service = SessionService()
+        session_service = get_session_service()
         success = session_service.clear_all_user_sessions(token)
         
         if success:
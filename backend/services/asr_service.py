@@ -6,6 +6,7 @@ import json
 import base64
 import logging
 from typing import Optional, Dict, Any
+from services.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +33,7 @@ class ASRService:
                 "client_secret": self.SECRET_KEY
             }
             
-            response = requests.post(self.token_url, params=params, timeout=10)
+            response = get_http_client().post(self.token_url, params=params)
             response.raise_for_status()
             
             result = response.json()
@@ -174,11 +175,10 @@ class ASRService:
                 logger.info(f"音频数据大小正常: {len(audio_data)} bytes")
             
             # 发送识别请求
-            response = requests.post(
+            response = get_http_client().post(
                 self.asr_url,
                 headers=headers,
-                data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
-                timeout=30
+                data=json.dumps(payload, ensure_ascii=False).encode("utf-8")
             )
             
             response.raise_for_status()
@@ -0,0 +1,103 @@
+"""
+用户头像文件存储（按内容寻址）
+
+头像原来以 base64 data URL 直接保存在 users.json 的用户记录里，占了文件的大部分体积，
+每次保存都要重新序列化，/api/auth/me 和管理员用户列表也每次都带上整张图片。
+这里把图片按内容的 SHA-256 保存成文件（avatars/<前两位>/<哈希>.<扩展名>），
+用户记录里只保存短 URL（/api/avatars/<哈希>.<扩展名>）。同样的内容总是得到同一个 URL，
+内容变化 URL 也随之变化，因此可以按不可变资源长期缓存。
+"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+URL_PREFIX = '/api/avatars/'
+
+CONTENT_TYPES = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/svg+xml': 'svg',
+}
+EXTENSION_TYPES = {ext: content_type for content_type, ext in CONTENT_TYPES.items()}
+
+_DATA_URL = re.compile(r'^data:(?P<type>[\w.+-]+/[\w.+-]+);base64,(?P<data>.*)$', re.S)
+_BLOB_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})\.(?P<ext>[a-z]+)$')
+
+
+class AvatarStore:
+    """按内容哈希保存头像图片"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._stats = {'stored': 0, 'deduplicated': 0, 'bytes_stored': 0}
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.{ext}")
+
+    def put(self, data: bytes, content_type: str = 'image/png') -> str:
+        """保存图片内容，返回它的 URL；内容已存在时直接复用"""
+        ext = CONTENT_TYPES.get(content_type)
+        if ext is None:
+            raise ValueError(f"不支持的头像格式: {content_type}")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest, ext)
+        if os.path.exists(path):
+            with self._lock:
+                self._stats['deduplicated'] += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 临时文件名带上进程和线程标识，多个 worker 同时写同一内容时互不干扰
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._stats['stored'] += 1
+                self._stats['bytes_stored'] += len(data)
+        return f"{URL_PREFIX}{digest}.{ext}"
+
+    def store_data_url(self, value: Optional[str]) -> Optional[str]:
+        """data URL 保存成文件并返回短 URL；其他值（普通 URL、None）原样返回"""
+        if not value or not value.startswith('data:'):
+            return value
+        match = _DATA_URL.match(value)
+        if match is None or match.group('type') not in CONTENT_TYPES:
+            return value
+        try:
+            data = base64.b64decode(match.group('data'), validate=True)
+        except (binascii.Error, ValueError):
+            return value
+        return self.put(data, match.group('type'))
+
+    def resolve(self, name: str) -> Optional[Tuple[str, str]]:
+        """按文件名（<哈希>.<扩展名>）查找头像，返回 (路径, content type)，不存在时返回 None"""
+        match = _BLOB_NAME.match(name)
+        if match is None or match.group('ext') not in EXTENSION_TYPES:
+            return None
+        path = self._path(match.group('digest'), match.group('ext'))
+        if not os.path.exists(path):
+            return None
+        return path, EXTENSION_TYPES[match.group('ext')]
+
+    def migrate_users(self, users: Dict[str, Dict]) -> List[str]:
+        """把用户记录中的 data URL 头像提取成文件，返回迁移过的用户名"""
+        migrated = []
+        for username, user_data in users.items():
+            avatar = user_data.get('avatar')
+            stored = self.store_data_url(avatar)
+            if stored != avatar:
+                user_data['avatar'] = stored
+                migrated.append(username)
+        return migrated
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats)
+
@@ -0,0 +1,248 @@
+"""
+响应之后的后台任务
+
+角色聊天拿到模型回复后还有几件与回复内容无关的记账工作：保存助手消息、累加亲密度、
+写聊天日志。原来这些都在请求线程里依次完成，用户要等它们做完才收到回复。
+这里把它们交给一个有界的后台执行器，回复生成后立即返回：
+
+- 任务按 key（会话ID）串行：同一会话的任务按提交顺序执行，不同会话之间并行。
+  同一会话的下一个请求先用 wait(key) 等上一轮的任务执行完，消息顺序不会错乱；
+- 任务内容要等一段时间才能确定时（流式回复生成完才知道要保存的内容），先用 reserve(key)
+  占住排队位置：之后提交的任务和 wait(key) 都排在它后面，但在填入任务之前不占用工作线程；
+- 待执行的任务数有上限（Config.POST_RESPONSE_QUEUE_MAX），满了以后 submit 阻塞，
+  把压力传回请求线程，而不是无限堆积；
+- 统计排队深度、任务从提交到开始执行的延迟（lag）和执行耗时，供管理后台观察积压；
+- 工作线程数为 0 时在调用线程里同步执行；进程退出时先执行完队列中的任务。
+"""
+import atexit
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+from config import Config
+# 先让合并写入注册退出钩子：atexit 后注册的先执行，退出时先排空任务、再写出数据
+import services.write_behind  # noqa: F401
+
+_instances = weakref.WeakSet()
+
+
+class KeyedExecutor:
+    """同一 key 的任务按提交顺序串行执行、不同 key 之间并行的有界线程池"""
+
+    def __init__(self, name: str, workers: int = None, max_pending: int = None):
+        self.name = name
+        self.workers = Config.POST_RESPONSE_WORKERS if workers is None else workers
+        self.max_pending = max(Config.POST_RESPONSE_QUEUE_MAX if max_pending is None else max_pending, 1)
+
+        self._cond = threading.Condition()  # 保护下面全部状态；有任务、有空位、key 执行完时通知
+        # 有任务待执行、正在执行或有预留位置的 key -> [提交时间, 函数, 参数]，预留位置的函数为 None
+        self._queues: Dict[Hashable, Deque[List]] = {}
+        self._ready: Deque[Hashable] = deque()  # 队首任务可以执行、且没有线程在执行的 key
+        self._active = set()  # 正在执行任务的 key
+        self._pending = 0  # 待执行的任务数（包括预留位置）
+        self._reserved = 0  # 尚未填入任务的预留位置数
+        self._running = 0
+        self._threads = []
+        self._closed = False
+        self._stats = {'submitted': 0, 'completed': 0, 'failures': 0, 'blocked': 0, 'max_depth': 0,
+                       'blocked_ms': 0.0, 'last_lag_ms': None, 'max_lag_ms': 0.0, 'total_lag_ms': 0.0,
+                       'max_run_ms': 0.0, 'total_run_ms': 0.0}
+        _instances.add(self)
+
+    def submit(self, key: Hashable, fn: Callable, *args: Any):
+        """提交任务；队列已满时阻塞到有空位为止"""
+        submitted = time.perf_counter()
+        with self._cond:
+            self._stats['submitted'] += 1
+            inline = self._enqueue(key, [submitted, fn, args]) is None
+        if inline:
+            self._run(submitted, fn, args)
+
+    def reserve(self, key: Hashable) -> 'Reservation':
+        """为 key 预留一个排队位置，之后用返回值的 submit 填入任务或 cancel 放弃；队列已满时同样阻塞"""
+        with self._cond:
+            entry = self._enqueue(key, [time.perf_counter(), None, ()])
+            if entry is not None:
+                self._reserved += 1
+        return Reservation(self, key, entry)
+
+    def _enqueue(self, key: Hashable, entry: List) -> Optional[List]:
+        """把任务（或预留位置）排进 key 的队列；需要在调用线程里同步执行时返回 None（调用方需持有 _cond）"""
+        if self.workers <= 0 or self._closed:
+            return None
+        if self._pending >= self.max_pending:
+            self._stats['blocked'] += 1
+            began = time.perf_counter()
+            while self._pending >= self.max_pending and not self._closed:
+                self._cond.wait()
+            self._stats['blocked_ms'] += (time.perf_counter() - began) * 1000
+        self._start_workers()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            if entry[1] is not None:
+                self._ready.append(key)
+        queue.append(entry)
+        self._pending += 1
+        self._stats['max_depth'] = max(self._stats['max_depth'], self._pending)
+        self._cond.notify_all()
+        return entry
+
+    def _fill(self, key: Hashable, entry: Optional[List], fn: Optional[Callable], args: tuple):
+        """填入预留位置（fn 为 None 时取消预留）"""
+        if entry is None:
+            # 预留时是同步执行模式
+            if fn is not None:
+                with self._cond:
+                    self._stats['submitted'] += 1
+                self._run(time.perf_counter(), fn, args)
+            return
+        with self._cond:
+            self._reserved -= 1
+            queue = self._queues[key]
+            if fn is not None:
+                self._stats['submitted'] += 1
+                entry[:] = [time.perf_counter(), fn, args]
+                head_ready = queue[0] is entry
+            else:
+                head_ready = queue[0] is entry and len(queue) > 1
+                del queue[next(i for i, queued in enumerate(queue) if queued is entry)]
+                self._pending -= 1
+                if not queue and key not in self._active:
+                    del self._queues[key]
+            # 预留位置排在队首时没有线程会处理这个 key，队首变为可执行后交给工作线程
+            if head_ready and key not in self._active and queue[0][1] is not None:
+                self._ready.append(key)
+            self._cond.notify_all()
+
+    def wait(self, key: Hashable, timeout: float = None) -> bool:
+        """等待 key 已提交的任务全部执行完，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: key not in self._queues, timeout)
+
+    def _start_workers(self):
+        """按需启动工作线程（调用方需持有 _cond）"""
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f'{self.name}-{len(self._threads)}', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                # 关闭后仍要等尚未填入的预留位置，它们之后的任务还要执行
+                while not self._ready and not (self._closed and not self._reserved):
+                    self._cond.wait()
+                if not self._ready:
+                    return  # 已关闭且没有待执行的任务
+                key = self._ready.popleft()
+                submitted, fn, args = self._queues[key].popleft()
+                self._pending -= 1
+                self._running += 1
+                self._active.add(key)
+                self._cond.notify_all()
+            self._run(submitted, fn, args)
+            with self._cond:
+                self._running -= 1
+                self._active.discard(key)
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                elif queue[0][1] is not None:
+                    self._ready.append(key)
+                # 队首是尚未填入的预留位置：key 留在 _queues 中，填入后再交给工作线程
+                self._cond.notify_all()
+
+    def _run(self, submitted: float, fn: Callable, args: tuple):
+        started = time.perf_counter()
+        failed = False
+        try:
+            fn(*args)
+        except Exception as e:
+            failed = True
+            print(f"[KeyedExecutor]: {self.name} 后台任务执行失败: {str(e)}")
+        finished = time.perf_counter()
+        lag_ms = (started - submitted) * 1000
+        run_ms = (finished - started) * 1000
+        with self._cond:
+            stats = self._stats
+            stats['failures' if failed else 'completed'] += 1
+            stats['last_lag_ms'] = round(lag_ms, 3)
+            stats['max_lag_ms'] = round(max(stats['max_lag_ms'], lag_ms), 3)
+            stats['total_lag_ms'] += lag_ms
+            stats['max_run_ms'] = round(max(stats['max_run_ms'], run_ms), 3)
+            stats['total_run_ms'] += run_ms
+
+    def shutdown(self, timeout: float = None):
+        """停止接收新任务（之后提交的任务在调用线程里执行），等待队列中的任务执行完"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def get_stats(self) -> Dict:
+        """排队深度、阻塞次数、尚未填入的预留位置数、任务延迟（提交到开始执行）和执行耗时"""
+        now = time.perf_counter()
+        with self._cond:
+            stats = dict(self._stats, depth=self._pending, running=self._running, reserved=self._reserved,
+                         workers=self.workers, max_pending=self.max_pending)
+            heads = [queue[0][0] for queue in self._queues.values() if queue and queue[0][1] is not None]
+        stats['oldest_pending_ms'] = round((now - min(heads)) * 1000, 3) if heads else 0.0
+        finished = stats['completed'] + stats['failures']
+        total_lag, total_run = stats.pop('total_lag_ms'), stats.pop('total_run_ms')
+        stats['avg_lag_ms'] = round(total_lag / finished, 3) if finished else None
+        stats['avg_run_ms'] = round(total_run / finished, 3) if finished else None
+        stats['blocked_ms'] = round(stats['blocked_ms'], 3)
+        return stats
+
+
+class Reservation:
+    """KeyedExecutor.reserve 预留的排队位置，submit 或 cancel 只有第一次调用有效"""
+
+    def __init__(self, executor: KeyedExecutor, key: Hashable, entry: Optional[List]):
+        self._executor = executor
+        self._key = key
+        self._entry = entry
+        self._done = False
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args: Any):
+        """在预留的位置上执行任务"""
+        self._release(fn, args)
+
+    def cancel(self):
+        """放弃预留的位置，排在它后面的任务继续执行"""
+        self._release(None, ())
+
+    def _release(self, fn: Optional[Callable], args: tuple):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        self._executor._fill(self._key, self._entry, fn, args)
+
+
+_post_response_executor = None
+_post_response_lock = threading.Lock()
+
+
+def get_post_response_executor() -> KeyedExecutor:
+    """聊天回复之后的记账任务共用的执行器"""
+    global _post_response_executor
+    with _post_response_lock:
+        if _post_response_executor is None:
+            _post_response_executor = KeyedExecutor('post-response')
+        return _post_response_executor
+
+
+def shutdown_all(timeout: float = None):
+    """执行完所有执行器中的任务（进程退出时调用）"""
+    for instance in list(_instances):
+        instance.shutdown(timeout)
+
+
+atexit.register(shutdown_all)
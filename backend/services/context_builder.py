@@ -0,0 +1,63 @@
+"""
+按 token 预算组装对话上下文
+
+没有引入分词器依赖，token 数按字符粗略估算：中日韩字符约 1 个 token，
+其余字符约 4 个一个 token，每条消息另加固定的格式开销。会话中的消息（Message）
+把估算值缓存在 tokens 上，同一条消息只计算一次。
+"""
+from typing import Dict, List, Tuple, Union
+from config import Config
+from services.session_message import Message
+
+# 每条消息的角色、分隔符等格式开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算一段文本的 token 数"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: Union[Message, Dict]) -> int:
+    """消息的 token 估算值；Message 首次计算后缓存在 tokens 上，字典（临时拼的系统消息）每次现算"""
+    if isinstance(message, dict):
+        return estimate_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+    if message.tokens is None:
+        message.tokens = estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+    return message.tokens
+
+
+def context_budget(model: str = None) -> int:
+    """模型的上下文 token 预算（系统消息 + 历史消息）"""
+    return Config.CONTEXT_TOKEN_BUDGETS.get(model or Config.DEFAULT_MODEL, Config.DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+def context_window(model: str = None) -> int:
+    """模型的上下文窗口大小（输入 + 输出）"""
+    return Config.MODEL_CONTEXT_WINDOWS.get(model or Config.DEFAULT_MODEL, Config.DEFAULT_MODEL_CONTEXT_WINDOW)
+
+
+def completion_budget(model: str, prompt_tokens: int, max_tokens: int) -> int:
+    """在上下文窗口内给回复留出的 max_tokens，不超过调用方要求的上限"""
+    return max(min(max_tokens, context_window(model) - prompt_tokens), Config.MIN_COMPLETION_TOKENS)
+
+
+def build_context(system_messages: List[Dict], history: List[Message], budget: int) -> Tuple[List[Dict], int]:
+    """在预算内挑选最新的历史消息，返回 (上下文消息, 已用 token 数)
+
+    系统消息总是保留；历史消息从新到旧依次加入，放不下时停止。最新的一条消息
+    （通常是本轮用户输入）即使超出预算也会保留，否则模型无从回答。
+    """
+    used = sum(message_tokens(msg) for msg in system_messages)
+    selected = []
+    for msg in reversed(history):
+        tokens = message_tokens(msg)
+        if selected and used + tokens > budget:
+            break
+        selected.append({"role": msg.role, "content": msg.content})
+        used += tokens
+    selected.reverse()
+    return system_messages + selected, used
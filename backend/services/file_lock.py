@@ -0,0 +1,88 @@
+"""
+跨进程文件锁
+
+多个 worker 进程共享 users.json、sessions.json 等文件时，用 fcntl.flock 咨询锁串行化
+“读取 - 合并 - 写回”。锁加在旁边的 <文件>.lock 上而不是数据文件本身：数据文件通过
+os.replace 原子替换，inode 会变化，加在旧 inode 上的锁就失去了意义。
+
+同一进程内按路径共享一个 FileLock（flock 对同一进程打开的两个文件描述符也会互斥），
+线程之间由其中的 RLock 串行化，可重入。没有 fcntl 的平台（Windows）上只有进程内的线程锁。
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class FileLock:
+    """一个数据文件的跨进程锁"""
+
+    def __init__(self, path: str):
+        self.lock_file = f"{path}.lock"
+        self._thread_lock = threading.RLock()
+        self._fd = None
+        self._depth = 0
+
+    def acquire(self, shared: bool = False, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking=blocking):
+            return False
+        if self._depth == 0 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.lock_file) or '.', exist_ok=True)
+                self._fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+                flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                fcntl.flock(self._fd, flags if blocking else flags | fcntl.LOCK_NB)
+            except OSError:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._thread_lock.release()
+                if blocking:
+                    raise
+                return False
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        self._thread_lock.release()
+
+    @contextmanager
+    def shared(self):
+        """共享锁（只读），与其他进程的共享锁兼容"""
+        self.acquire(shared=True)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def file_lock(path: str) -> FileLock:
+    """获取进程内共享的文件锁"""
+    path = os.path.abspath(path)
+    with _locks_guard:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = FileLock(path)
+        return lock
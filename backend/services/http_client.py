@@ -0,0 +1,130 @@
+"""
+上游 HTTP 连接池
+
+AI 聊天、多模态、TTS、ASR 原来都直接调用 requests.post：每次请求新建一个连接，
+对 HTTPS 上游要重新做一遍 TCP 和 TLS 握手。这里为每个上游主机（scheme://host:port）
+建立一个共享的 HTTPAdapter（内部是 urllib3 连接池，线程安全），请求结束后连接放回池中，
+下一次请求直接复用：
+
+- 每个线程各用一个 requests.Session（Session 的 cookie 等状态不是线程安全的），
+  同一主机的 Session 挂载同一个 HTTPAdapter，连接在线程之间共享；
+- 池大小（Config.HTTP_POOL_MAXSIZE）是每个主机保留的空闲连接数，并发超出时临时新建连接；
+- 失败重试（Config.HTTP_RETRIES，指数退避 Config.HTTP_RETRY_BACKOFF）：连接失败时请求还没有
+  发出，任何方法都可以重试；读超时和 502/503/504 只对幂等方法（GET 等）重试，POST 不会重复提交；
+- 超时按主机配置（Config.HTTP_HOST_TIMEOUTS），没有配置的主机使用调用方给出的超时，
+  再没有时使用 (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)。
+"""
+import threading
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import Config
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class HttpClient:
+    """按上游主机共享连接池的 HTTP 客户端"""
+
+    def __init__(self, pool_maxsize: int = None, retries: int = None, backoff: float = None):
+        self.pool_maxsize = Config.HTTP_POOL_MAXSIZE if pool_maxsize is None else pool_maxsize
+        self.retries = Config.HTTP_RETRIES if retries is None else retries
+        self.backoff = Config.HTTP_RETRY_BACKOFF if backoff is None else backoff
+
+        self._lock = threading.Lock()  # 保护 _adapters 和统计
+        self._adapters: Dict[str, HTTPAdapter] = {}  # 主机 -> 共享的连接池
+        self._local = threading.local()  # 每个线程的 {主机: Session}
+        self._requests: Dict[str, int] = {}
+        self._failures: Dict[str, int] = {}
+
+    def _adapter(self, host: str) -> HTTPAdapter:
+        with self._lock:
+            adapter = self._adapters.get(host)
+            if adapter is None:
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.backoff,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # 幂等方法，不含 POST
+                    raise_on_status=False  # 重试用完后把最后一次的响应交给调用方处理状态码
+                )
+                # pool_connections 是适配器缓存的连接池个数：一个主机一个，经代理访问时再多一个
+                adapter = self._adapters[host] = HTTPAdapter(
+                    pool_connections=2, pool_maxsize=self.pool_maxsize, max_retries=retry
+                )
+            return adapter
+
+    def session(self, url: str) -> requests.Session:
+        """当前线程访问 url 所在主机使用的 Session"""
+        host = _host_of(url)
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+        session = sessions.get(host)
+        if session is None:
+            session = sessions[host] = requests.Session()
+            session.mount(host + '/', self._adapter(host))
+        return session
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None, **kwargs) -> requests.Response:
+        """发送请求，参数与 requests.request 相同"""
+        host = _host_of(url)
+        timeout = Config.HTTP_HOST_TIMEOUTS.get(urlsplit(url).hostname, timeout)
+        if timeout is None:
+            timeout = (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+        with self._lock:
+            self._requests[host] = self._requests.get(host, 0) + 1
+        try:
+            return self.session(url).request(method, url, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._failures[host] = self._failures.get(host, 0) + 1
+            raise
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """关闭全部连接池（之后的请求会重新建立连接）"""
+        with self._lock:
+            adapters, self._adapters = self._adapters, {}
+        self._local = threading.local()
+        for adapter in adapters.values():
+            adapter.close()
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """每个主机的请求数、失败数、新建连接数（其余请求复用了已有连接）"""
+        with self._lock:
+            adapters = dict(self._adapters)
+            stats = {host: {'requests': count, 'failures': self._failures.get(host, 0)}
+                     for host, count in self._requests.items()}
+        for host, adapter in adapters.items():
+            pools = adapter.poolmanager.pools
+            entry = stats.setdefault(host, {'requests': 0, 'failures': 0})
+            entry['connections'] = sum(pools[key].num_connections for key in pools.keys())
+            entry['pool_maxsize'] = self.pool_maxsize
+        return stats
+
+
+def _host_of(url: str) -> str:
+    """url 所在的主机：scheme://host[:port]"""
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'.lower()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """进程内共享的上游 HTTP 客户端"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,292 @@
+"""
+亲密度事件日志
+
+亲密度原来只是用户记录里被不断覆盖的一个整数，想回答“这周谁升级了”一类的问题只能把
+所有数据重新扫一遍。这里把每一次累加记成一条追加写入的事件
+[时间戳, 用户ID, 角色ID, 增量, 累加后的亲密度]，保存在 intimacy_events.jsonl，
+事件在记录（或读入）时顺带折叠进汇总：
+
+- 每天每个角色：累加量、活跃用户、升级次数；
+- 每个角色：累计的累加量和升级次数；
+- 升级事件按时间排序单独保存（每个用户在每个角色上最多升级几次）。
+
+按时间范围查询只遍历范围内的天数，不回扫事件。事件先进内存汇总，写盘交给合并写入
+（见 services/write_behind.py），累加亲密度的热路径不读写文件。多个 worker 共享文件时，
+追加在文件锁内进行，查询前先补放其他 worker 追加的事件。
+
+日志追加的事件超过 compact_threshold 条时，把汇总写成快照（intimacy_events.snapshot.json），
+再清空日志：启动时读快照、只回放快照之后的事件。快照记录了它覆盖到的日志文件和位置，
+写完快照、清空日志之前崩溃也不会重复计入。按天的汇总和升级事件只保留最近 retention_days 天，
+内存和快照大小不随历史增长；各角色的累计值一直保留。
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from config import Config
+from services.file_lock import file_lock
+from services.write_behind import WriteBehind, atomic_write
+
+
+class IntimacyEventLog:
+    """亲密度事件的追加日志，以及按天、按角色的增量汇总"""
+
+    def __init__(self, path: str, level_of: Callable[[int], str], window_ms: float = None,
+                 compact_threshold: int = None, retention_days: int = None):
+        self.path = path
+        self.snapshot_file = os.path.splitext(path)[0] + '.snapshot.json'
+        self.level_of = level_of  # 亲密度 -> 等级名称，用来判断一次累加是否升级
+        self.compact_threshold = Config.INTIMACY_EVENT_COMPACT_THRESHOLD if compact_threshold is None else compact_threshold
+        self.retention_days = Config.INTIMACY_EVENT_RETENTION_DAYS if retention_days is None else retention_days
+        self.file_lock = file_lock(path)
+
+        self._lock = threading.RLock()
+        self._days: Dict[str, Dict[str, Dict]] = {}  # 'YYYY-MM-DD' -> 角色ID -> {'increments', 'users', 'level_ups'}
+        self._characters: Dict[str, Dict[str, int]] = {}  # 角色ID -> {'increments', 'level_ups'}
+        # (时间戳, 事件序号, 用户ID, 角色ID, 新等级, 亲密度)，同一时间戳的事件按到达顺序排列
+        self._level_ups: List[Tuple[float, int, str, str, str, int]] = []
+        self._pending: List[str] = []  # 已计入汇总、尚未写盘的事件
+        self._events = 0
+        self._journal_events = 0  # 日志中快照之后的事件数
+        self._offset = 0
+        self._file_id = None
+        self._writer = WriteBehind(f'intimacy-events:{os.path.basename(path)}', self._flush, window_ms)
+        with self._lock, self.file_lock.shared():
+            self._load()
+
+    # ---- 文件 ----
+
+    def _load(self):
+        self._days, self._characters, self._level_ups = {}, {}, []
+        self._events = 0
+        self._journal_events = 0
+        self._offset = 0
+        self._file_id = _file_id(self.path)
+        self._load_snapshot()
+        self._replay()
+        # 尚未写盘的事件不在文件里，重新计入
+        for line in self._pending:
+            self._fold(json.loads(line))
+        self._prune()
+
+    def _load_snapshot(self):
+        """读入快照中的汇总；快照覆盖的仍是当前日志文件时（清空日志前崩溃），跳过已计入的部分"""
+        if not os.path.exists(self.snapshot_file):
+            return
+        with open(self.snapshot_file, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        self._days = {day: {character_id: dict(bucket, users=set(bucket['users']))
+                            for character_id, bucket in buckets.items()}
+                      for day, buckets in snapshot['days'].items()}
+        self._characters = snapshot['characters']
+        self._level_ups = [tuple(event) for event in snapshot['level_ups']]
+        self._events = snapshot['events']
+        if self._file_id is not None and snapshot['file_id'] == list(self._file_id):
+            self._offset = min(snapshot['offset'], os.path.getsize(self.path))
+
+    def _replay(self):
+        """从 _offset 开始读入事件（包括其他 worker 追加的事件）"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    event = json.loads(raw.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    break
+                self._offset += len(raw)
+                self._journal_events += 1
+                self._fold(event)
+
+    def refresh(self):
+        """读入其他 worker 追加的事件；文件被替换过时整体重新加载"""
+        with self._lock:
+            file_id = _file_id(self.path)
+            if file_id != self._file_id or (file_id is not None and os.path.getsize(self.path) < self._offset):
+                with self.file_lock.shared():
+                    self._load()
+            elif file_id is not None and os.path.getsize(self.path) > self._offset:
+                self._replay()
+
+    def _flush(self):
+        """在文件锁内追加尚未写盘的事件：先读入其他 worker 的事件，写完后跳过自己的事件"""
+        with self._lock, self.file_lock:
+            if not self._pending:
+                return
+            self.refresh()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(self._pending))
+            self._journal_events += len(self._pending)
+            self._pending = []
+            self._file_id = _file_id(self.path)
+            self._offset = os.path.getsize(self.path)
+            if self.compact_threshold and self._journal_events >= self.compact_threshold:
+                self._compact()
+
+    def _compact(self):
+        """把汇总写成快照，再清空日志（调用方需持有 _lock 和排他的文件锁，且日志已全部读入）"""
+        self._prune()
+        snapshot = {
+            'file_id': list(self._file_id) if self._file_id else None,
+            'offset': self._offset,
+            'events': self._events,
+            'days': {day: {character_id: dict(bucket, users=sorted(bucket['users']))
+                           for character_id, bucket in buckets.items()}
+                     for day, buckets in self._days.items()},
+            'characters': self._characters,
+            'level_ups': self._level_ups
+        }
+        atomic_write(self.snapshot_file, json.dumps(snapshot, ensure_ascii=False))
+        # 新日志是另一个文件，快照中记录的 file_id 不再匹配，之后从头回放
+        atomic_write(self.path, '')
+        self._file_id = _file_id(self.path)
+        self._offset = 0
+        self._journal_events = 0
+        print(f"[IntimacyEventLog]: 已压缩亲密度事件日志，共 {self._events} 条事件，保留 {len(self._days)} 天的汇总")
+
+    def _prune(self):
+        """丢弃 retention_days 天之前的按天汇总和升级事件（调用方需持有 _lock）"""
+        if not self.retention_days:
+            return
+        cutoff = datetime.now().date() - timedelta(days=self.retention_days - 1)
+        for day in [day for day in self._days if day < cutoff.isoformat()]:
+            del self._days[day]
+        cutoff_ts = datetime.combine(cutoff, datetime.min.time()).timestamp()
+        del self._level_ups[:bisect.bisect_left(self._level_ups, (cutoff_ts,))]
+
+    def flush(self):
+        """立即写出尚未落盘的事件"""
+        self._writer.flush()
+
+    # ---- 汇总 ----
+
+    def _fold(self, event: List):
+        """把一条事件计入汇总（调用方需持有 _lock）"""
+        timestamp, user_id, character_id, delta, value = event
+        self._events += 1
+        day = self._days.setdefault(_day_of(timestamp), {})
+        bucket = day.get(character_id)
+        if bucket is None:
+            bucket = day[character_id] = {'increments': 0, 'users': set(), 'level_ups': 0}
+        totals = self._characters.setdefault(character_id, {'increments': 0, 'level_ups': 0})
+        bucket['increments'] += delta
+        bucket['users'].add(user_id)
+        totals['increments'] += delta
+
+        level_name = self.level_of(value)
+        if delta > 0 and self.level_of(value - delta) != level_name:
+            bucket['level_ups'] += 1
+            totals['level_ups'] += 1
+            # 多个 worker 的事件到达顺序可能与时间戳略有出入，按时间插入
+            bisect.insort(self._level_ups, (timestamp, self._events, user_id, character_id, level_name, value))
+
+    def record(self, user_id: str, character_id: str, delta: int, value: int, timestamp: float = None):
+        """记录一次亲密度变化（value 为变化后的亲密度），立即计入汇总，合并写入窗口结束时写盘"""
+        event = [round(time.time() if timestamp is None else timestamp, 3), user_id, character_id, delta, value]
+        with self._lock:
+            self._fold(event)
+            self._pending.append(json.dumps(event, ensure_ascii=False) + '\n')
+        self._writer.mark_dirty()
+
+    # ---- 查询 ----
+
+    def daily(self, start: date, end: date, character_id: str = None) -> List[Dict]:
+        """start 到 end（含）每天的汇总，没有事件的日期也返回（各项为 0）"""
+        with self._lock:
+            self.refresh()
+            result = []
+            day = start
+            while day <= end:
+                buckets = self._days.get(day.isoformat(), {})
+                if character_id is not None:
+                    buckets = {character_id: buckets[character_id]} if character_id in buckets else {}
+                users = set()
+                increments = level_ups = 0
+                for bucket in buckets.values():
+                    increments += bucket['increments']
+                    level_ups += bucket['level_ups']
+                    users |= bucket['users']
+                result.append({'date': day.isoformat(), 'increments': increments,
+                               'active_users': len(users), 'level_ups': level_ups})
+                day += timedelta(days=1)
+            return result
+
+    def by_character(self, start: date, end: date) -> Dict[str, Dict]:
+        """start 到 end（含）各角色的汇总：累加量、活跃用户数、升级次数"""
+        with self._lock:
+            self.refresh()
+            merged: Dict[str, Dict] = {}
+            day = start
+            while day <= end:
+                for character_id, bucket in self._days.get(day.isoformat(), {}).items():
+                    entry = merged.setdefault(character_id, {'increments': 0, 'users': set(), 'level_ups': 0})
+                    entry['increments'] += bucket['increments']
+                    entry['level_ups'] += bucket['level_ups']
+                    entry['users'] |= bucket['users']
+                day += timedelta(days=1)
+            return {character_id: {'increments': entry['increments'], 'active_users': len(entry['users']),
+                                   'level_ups': entry['level_ups']}
+                    for character_id, entry in merged.items()}
+
+    def level_ups(self, start: float, end: float, character_id: str = None, limit: int = None) -> List[Dict]:
+        """时间戳在 [start, end) 内的升级事件，按时间从新到旧"""
+        with self._lock:
+            self.refresh()
+            lo = bisect.bisect_left(self._level_ups, (start,))
+            hi = bisect.bisect_left(self._level_ups, (end,))
+            result = []
+            for timestamp, _, user_id, event_character, level_name, value in reversed(self._level_ups[lo:hi]):
+                if character_id is not None and event_character != character_id:
+                    continue
+                result.append({'timestamp': timestamp, 'user_id': user_id, 'character_id': event_character,
+                               'level_name': level_name, 'intimacy': value})
+                if limit is not None and len(result) >= limit:
+                    break
+            return result
+
+    def totals(self) -> Dict[str, Dict[str, int]]:
+        """各角色累计的累加量和升级次数"""
+        with self._lock:
+            self.refresh()
+            return {character_id: dict(totals) for character_id, totals in self._characters.items()}
+
+    def get_stats(self) -> Dict:
+        """事件数、覆盖天数、尚未写盘的事件数、快照之后的日志事件数以及日志文件大小"""
+        with self._lock:
+            return {'events': self._events, 'days': len(self._days), 'level_ups': len(self._level_ups),
+                    'pending': len(self._pending), 'journal_events': self._journal_events,
+                    'file_bytes': self._offset}
+
+
+_logs: Dict[str, IntimacyEventLog] = {}
+_logs_lock = threading.Lock()
+
+
+def intimacy_event_log(path: str, level_of: Callable[[int], str]) -> IntimacyEventLog:
+    """获取进程内按路径共享的亲密度事件日志"""
+    path = os.path.abspath(path)
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = IntimacyEventLog(path, level_of)
+        return log
+
+
+def _day_of(timestamp: float) -> str:
+    """时间戳所在的本地日期"""
+    return datetime.fromtimestamp(timestamp).date().isoformat()
+
+
+def _file_id(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
@@ -1,10 +1,177 @@
 """
 亲密度服务
 """
-import json
 import os
-from typing import Dict, Optional
+import bisect
+import threading
+from datetime import date, datetime, time as day_time, timedelta
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from services.intimacy_events import IntimacyEventLog, intimacy_event_log
 from services.log_service import LogService
+from services.user_store import UserStore, user_store
+
+
+class IntimacyCounters:
+    """内存中的亲密度计数：用户ID -> {角色ID: 亲密度}
+
+    计数来自用户记录的 intimacy 字段，与 UserService 使用同一个用户存储（见 services/user_store.py）。
+    读取只查这张表；累加时同时修改这张表，并以增量形式登记到存储，由存储合并写盘。
+    存储的 version 变化（同步进其他 worker 的修改）时整体重建；建表之后才注册的用户
+    （本进程的注册不改变 version）在用户数变化后第一次查不到时扫描一遍用户记录补上，
+    用户数没有变化时查不到的用户ID直接返回，不再逐个扫描。
+
+    同时为每个角色维护排行榜（按亲密度从高到低的有序列表）和亲密度总和，
+    随计数一起增量更新，排行和统计只需读索引。
+    """
+
+    def __init__(self, store: UserStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._owners: Dict[str, str] = {}  # 用户ID -> username
+        self._boards: Dict[str, List[Tuple[int, str]]] = {}  # 角色ID -> [(-亲密度, 用户ID)]，升序即亲密度从高到低
+        self._totals: Dict[str, int] = {}  # 角色ID -> 亲密度总和
+        self._scanned_users = None  # 上次补齐计数表时的用户数，变化说明有新注册的用户
+        self.version = None
+
+    def _rebuild(self, users: Dict[str, Dict]):
+        self._counts, self._owners = {}, {}
+        self._boards, self._totals = {}, {}
+        for username, user_data in users.items():
+            self._add(username, user_data, sort=False)
+        for board in self._boards.values():
+            board.sort()
+        self._scanned_users = len(users)
+        self.version = self.store.version
+
+    def _add(self, username: str, user_data: Dict, sort: bool = True):
+        user_id = user_data.get('id')
+        if user_id is None:
+            return
+        self._owners[user_id] = username
+        counts = self._counts[user_id] = dict(user_data.get('intimacy') or {})
+        for character_id, value in counts.items():
+            if value > 0:
+                board = self._boards.setdefault(character_id, [])
+                if sort:
+                    bisect.insort(board, (-value, user_id))
+                else:
+                    board.append((-value, user_id))
+            self._totals[character_id] = self._totals.get(character_id, 0) + value
+
+    def _set(self, user_id: str, character_id: str, old: int, new: int):
+        """更新一名用户在某个角色上的亲密度及排行榜、总和（调用方需持有 _lock）"""
+        self._counts[user_id][character_id] = new
+        board = self._boards.setdefault(character_id, [])
+        if old > 0:
+            i = bisect.bisect_left(board, (-old, user_id))
+            if i < len(board) and board[i] == (-old, user_id):
+                del board[i]
+        if new > 0:
+            bisect.insort(board, (-new, user_id))
+        self._totals[character_id] = self._totals.get(character_id, 0) + new - old
+
+    def _refresh(self) -> Dict[str, Dict]:
+        """存储的 version 变化时重建（调用方需持有 _lock），返回用户字典"""
+        users = self.store.read()  # 读取时可能同步进其他 worker 的修改
+        if self.version != self.store.version:
+            self._rebuild(users)
+        return users
+
+    def _counts_for(self, user_id: str) -> Optional[Dict[str, int]]:
+        """用户的计数表，用户不存在时返回 None（调用方需持有 _lock）"""
+        users = self._refresh()
+        counts = self._counts.get(user_id)
+        if counts is None and len(users) != self._scanned_users:
+            # 有新注册的用户：一次补上计数表里还没有的全部用户
+            self._scanned_users = len(users)
+            for username, user_data in users.items():
+                if user_data.get('id') is not None and user_data['id'] not in self._owners:
+                    self._add(username, user_data)
+            counts = self._counts.get(user_id)
+        return counts
+
+    def get(self, user_id: str, character_id: str) -> int:
+        with self._lock:
+            counts = self._counts_for(user_id)
+            return counts.get(character_id, 0) if counts is not None else 0
+
+    def get_all(self, user_id: str) -> Optional[Dict[str, int]]:
+        with self._lock:
+            counts = self._counts_for(user_id)
+            return dict(counts) if counts is not None else None
+
+    def increment(self, user_id: str, character_id: str) -> Optional[int]:
+        """亲密度加一，返回新值；用户不存在时返回 None"""
+        with self._lock:
+            counts = self._counts_for(user_id)
+            username = self._owners.get(user_id)
+            if counts is None or username not in self.store.read():
+                return None
+            current = counts.get(character_id, 0)
+            self._set(user_id, character_id, current, current + 1)
+
+            # 以增量形式登记：多个 worker 同时累加同一用户的亲密度也不会互相覆盖
+            def increment(record: Optional[Dict]) -> Optional[Dict]:
+                if record is None or record.get('id') != user_id:
+                    return None
+                intimacy = record.setdefault('intimacy', {})
+                intimacy[character_id] = intimacy.get(character_id, 0) + 1
+                return record
+
+            self.store.update(username, increment)
+            return counts[character_id]
+
+    def remove_user(self, user_id: str):
+        """用户被删除后从计数和排行榜中去掉"""
+        with self._lock:
+            # 删除后再注册可能让用户数不变，下一次查不到时重新补齐
+            self._scanned_users = None
+            counts = self._counts.get(user_id)
+            if counts is None:
+                return
+            for character_id, value in list(counts.items()):
+                self._set(user_id, character_id, value, 0)
+            del self._counts[user_id]
+            self._owners.pop(user_id, None)
+
+    def leaderboard(self, character_id: str, offset: int = 0, limit: int = 10) -> Tuple[List[Tuple[str, int]], int]:
+        """角色排行榜的一页：([(用户ID, 亲密度)], 上榜用户总数)，亲密度相同时按用户ID排列"""
+        with self._lock:
+            self._refresh()
+            board = self._boards.get(character_id, [])
+            page = board[offset:offset + limit]
+            return [(user_id, -negative) for negative, user_id in page], len(board)
+
+    def rank(self, user_id: str, character_id: str) -> Optional[int]:
+        """用户在角色排行榜上的名次（从 1 开始），没有上榜时返回 None"""
+        with self._lock:
+            counts = self._counts_for(user_id)
+            value = counts.get(character_id, 0) if counts is not None else 0
+            if value <= 0:
+                return None
+            return bisect.bisect_left(self._boards.get(character_id, []), (-value, user_id)) + 1
+
+    def totals(self) -> Dict[str, int]:
+        """各角色的亲密度总和"""
+        with self._lock:
+            self._refresh()
+            return {character_id: total for character_id, total in self._totals.items() if total}
+
+
+_counters: Dict[str, IntimacyCounters] = {}
+_counters_lock = threading.Lock()
+
+
+def intimacy_counters(users_file: str) -> IntimacyCounters:
+    """获取进程内按用户数据文件共享的亲密度计数"""
+    path = os.path.abspath(users_file)
+    with _counters_lock:
+        counters = _counters.get(path)
+        if counters is None or counters.store is not user_store(path):
+            counters = _counters[path] = IntimacyCounters(user_store(path))
+        return counters
 
 class IntimacyService:
     """亲密度管理服务"""
@@ -18,93 +185,56 @@ class IntimacyService:
         50: "知音难觅",
         100: "伯乐"
     }
+    # 按阈值排好序的等级表，等级和进度用二分查找得到
+    _THRESHOLDS = sorted(INTIMACY_LEVELS)
+    _LEVEL_NAMES = [name for _, name in sorted(INTIMACY_LEVELS.items())]
     
     def __init__(self):
         self.users_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'users.json')
     
-    def _load_users(self) -> Dict:
-        """加载用户数据"""
+    @property
+    def counters(self) -> IntimacyCounters:
+        return intimacy_counters(self.users_file)
+    
+    @property
+    def events(self) -> IntimacyEventLog:
+        """亲密度事件日志，默认为用户数据文件同目录的 intimacy_events.jsonl"""
+        events_file = Config.INTIMACY_EVENT_FILE or os.path.join(os.path.dirname(self.users_file), 'intimacy_events.jsonl')
+        return intimacy_event_log(events_file, self.get_level_name)
+    
+    def get_intimacy(self, user_id: str, character_id: str) -> int:
+        """获取用户与角色的亲密度"""
+        return self.counters.get(user_id, character_id)
+    
+    def increase_intimacy(self, user_id: str, character_id: str) -> Dict:
+        """增加亲密度"""
         try:
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            new_intimacy = self.counters.increment(user_id, character_id)
         except Exception as e:
             LogService.log(
                 current_time=LogService.get_current_time(),
                 model_name='IntimacyService',
-                function_name='_load_users',
+                function_name='increase_intimacy',
                 log_level='Error',
-                message=f'加载用户数据失败: {str(e)}'
+                message=f'保存用户数据失败: {str(e)}'
             )
-            return {}
-    
-    def _save_users(self, users_data: Dict) -> bool:
-        """保存用户数据"""
+            return {'success': False, 'error': '保存失败'}
+        
+        if new_intimacy is None:
+            return {'success': False, 'error': '用户不存在'}
+        current_intimacy = new_intimacy - 1
+        
         try:
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(users_data, f, ensure_ascii=False, indent=2)
-            return True
+            self.events.record(user_id, character_id, 1, new_intimacy)
         except Exception as e:
+            # 事件只用于统计，记录失败不影响亲密度本身
             LogService.log(
                 current_time=LogService.get_current_time(),
                 model_name='IntimacyService',
-                function_name='_save_users',
+                function_name='increase_intimacy',
                 log_level='Error',
-                message=f'保存用户数据失败: {str(e)}'
+                message=f'记录亲密度事件失败: {str(e)}'
             )
-            return False
-    
-    def get_intimacy(self, user_id: str, character_id: str) -> int:
-        """获取用户与角色的亲密度"""
-        users_data = self._load_users()
-        
-        # 查找用户
-        user = None
-        for username, user_data in users_data.get('users', {}).items():
-            if user_data.get('id') == user_id:
-                user = user_data
-                break
-        
-        if not user:
-            return 0
-        
-        intimacy_data = user.get('intimacy', {})
-        return intimacy_data.get(character_id, 0)
-    
-    def increase_intimacy(self, user_id: str, character_id: str) -> Dict:
-        """增加亲密度"""
-        users_data = self._load_users()
-        
-        # 查找用户
-        user = None
-        username = None
-        for uname, user_data in users_data.get('users', {}).items():
-            if user_data.get('id') == user_id:
-                user = user_data
-                username = uname
-                break
-        
-        if not user:
-            return {'success': False, 'error': '用户不存在'}
-        
-        # 初始化亲密度数据
-        if 'intimacy' not in user:
-            user['intimacy'] = {}
-        
-        # 获取当前亲密度
-        current_intimacy = user['intimacy'].get(character_id, 0)
-        new_intimacy = current_intimacy + 1
-        
-        # 更新亲密度
-        user['intimacy'][character_id] = new_intimacy
-        
-        # 保存数据
-        if not self._save_users(users_data):
-            return {'success': False, 'error': '保存失败'}
-        
-        # 检查是否达到新等级
-        old_level = self.get_level_name(current_intimacy)
-        new_level = self.get_level_name(new_intimacy)
-        level_up = old_level != new_level
         
         LogService.log(
             current_time=LogService.get_current_time(),
@@ -114,11 +244,19 @@ class IntimacyService:
             message=f'用户 {user_id} 与角色 {character_id} 亲密度增加: {current_intimacy} -> {new_intimacy}'
         )
         
+        return self.describe_increase(current_intimacy)
+    
+    def describe_increase(self, current_intimacy: int) -> Dict:
+        """亲密度从 current_intimacy 加一后的结果（新值、等级名称以及是否升级）"""
+        new_intimacy = current_intimacy + 1
+        old_level = self.get_level_name(current_intimacy)
+        new_level = self.get_level_name(new_intimacy)
+        
         return {
             'success': True,
             'intimacy': new_intimacy,
             'level_name': new_level,
-            'level_up': level_up,
+            'level_up': old_level != new_level,
             'old_level': old_level
         }
     
@@ -126,43 +264,27 @@ class IntimacyService:
         """根据亲密度获取等级名称"""
         if intimacy == 0:
             return "陌生人"
-        
-        # 找到对应的等级
-        for threshold in sorted(self.INTIMACY_LEVELS.keys(), reverse=True):
-            if intimacy >= threshold:
-                return self.INTIMACY_LEVELS[threshold]
-        
-        return "初次相识"
+        i = bisect.bisect_right(self._THRESHOLDS, intimacy) - 1
+        return self._LEVEL_NAMES[i] if i >= 0 else "初次相识"
     
     def get_level_progress(self, intimacy: int) -> Dict:
         """获取等级进度信息"""
         if intimacy == 0:
             return {
                 'current_level': "陌生人",
-                'next_level': "初次相识",
+                'next_level': self._LEVEL_NAMES[0],
                 'current_threshold': 0,
-                'next_threshold': 1,
+                'next_threshold': self._THRESHOLDS[0],
                 'progress': 0
             }
         
-        # 找到当前等级和下一等级
-        current_threshold = 0
-        next_threshold = None
-        current_level = "初次相识"
-        next_level = None
-        
-        thresholds = sorted(self.INTIMACY_LEVELS.keys())
-        
-        for i, threshold in enumerate(thresholds):
-            if intimacy >= threshold:
-                current_threshold = threshold
-                current_level = self.INTIMACY_LEVELS[threshold]
-                if i + 1 < len(thresholds):
-                    next_threshold = thresholds[i + 1]
-                    next_level = self.INTIMACY_LEVELS[next_threshold]
+        # 当前等级是阈值不超过亲密度的最高一级，下一等级紧随其后
+        i = bisect.bisect_right(self._THRESHOLDS, intimacy) - 1
+        current_threshold = self._THRESHOLDS[i] if i >= 0 else 0
+        current_level = self._LEVEL_NAMES[i] if i >= 0 else "初次相识"
         
         # 如果已经是最高等级
-        if next_threshold is None:
+        if i + 1 >= len(self._THRESHOLDS):
             return {
                 'current_level': current_level,
                 'next_level': None,
@@ -172,13 +294,14 @@ class IntimacyService:
             }
         
         # 计算进度百分比
+        next_threshold = self._THRESHOLDS[i + 1]
         progress_range = next_threshold - current_threshold
         current_progress = intimacy - current_threshold
         progress_percent = (current_progress / progress_range) * 100
         
         return {
             'current_level': current_level,
-            'next_level': next_level,
+            'next_level': self._LEVEL_NAMES[i + 1],
             'current_threshold': current_threshold,
             'next_threshold': next_threshold,
             'progress': progress_percent
@@ -186,16 +309,35 @@ class IntimacyService:
     
     def get_all_intimacy(self, user_id: str) -> Dict:
         """获取用户所有角色的亲密度"""
-        users_data = self._load_users()
-        
-        # 查找用户
-        user = None
-        for username, user_data in users_data.get('users', {}).items():
-            if user_data.get('id') == user_id:
-                user = user_data
-                break
-        
-        if not user:
-            return {}
-        
-        return user.get('intimacy', {})
+        return self.counters.get_all(user_id) or {}
+    
+    def get_leaderboard(self, character_id: str, offset: int = 0, limit: int = 10) -> Dict:
+        """角色亲密度排行榜的一页（按亲密度从高到低），以及上榜用户总数"""
+        entries, total = self.counters.leaderboard(character_id, offset, limit)
+        return {
+            'entries': [{
+                'rank': offset + i + 1,
+                'user_id': user_id,
+                'intimacy': intimacy,
+                'level_name': self.get_level_name(intimacy)
+            } for i, (user_id, intimacy) in enumerate(entries)],
+            'total': total
+        }
+    
+    def get_user_rank(self, user_id: str, character_id: str) -> Optional[int]:
+        """用户在角色排行榜上的名次，没有上榜时返回 None"""
+        return self.counters.rank(user_id, character_id)
+    
+    def get_character_totals(self) -> Dict[str, int]:
+        """各角色的亲密度总和"""
+        return self.counters.totals()
+    
+    def get_trends(self, start: date, end: date, character_id: str = None, level_up_limit: int = 100) -> Dict:
+        """start 到 end（含）的亲密度趋势：每天的汇总、各角色的汇总以及期间的升级事件"""
+        start_ts = datetime.combine(start, day_time.min).timestamp()
+        end_ts = datetime.combine(end + timedelta(days=1), day_time.min).timestamp()
+        return {
+            'daily': self.events.daily(start, end, character_id),
+            'characters': self.events.by_character(start, end),
+            'level_ups': self.events.level_ups(start_ts, end_ts, character_id, level_up_limit)
+        }
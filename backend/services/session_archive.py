@@ -0,0 +1,296 @@
+"""
+冷会话归档
+
+长时间没有活动的会话从热存储（sessions.json / 日志 / SQLite）中移出，按用户写进压缩的
+归档文件（session_archive/<user_id>.json.gz 或 .json.xz），不再占用内存和每次保存的写入量。
+会话列表只需要元数据，归档索引（index.jsonl，追加写入，启动时回放）里保存了这些元数据；
+会话被打开时才解压对应用户的归档文件，把会话恢复回热存储。
+
+每个 worker 都有自己的清理线程，可能同时归档、恢复、删除同一个用户的会话：对用户归档文件的
+“读取 - 修改 - 写回”和索引的追加 / 重写都在 index.jsonl 的跨进程排他锁内进行，回放索引时加共享锁。
+"""
+import gzip
+import heapq
+import json
+import lzma
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from services.file_lock import file_lock
+from services.session_message import to_epoch
+from services.write_behind import atomic_write
+
+COMPRESSORS = {
+    'gzip': ('.json.gz', gzip),
+    'lzma': ('.json.xz', lzma),
+}
+
+# 列表展示需要的会话元数据，随归档索引保存；统计用的消息数与按天的消息数（daily_message_counts）也一并保存
+ARCHIVE_META_FIELDS = ('session_id', 'user_id', 'character_id', 'created_at', 'last_activity',
+                       'context_summary', 'message_count')
+
+
+class SessionArchive:
+    """按用户分文件的压缩归档，以及归档会话的元数据索引"""
+
+    def __init__(self, directory: str, compression: str = 'gzip'):
+        if compression not in COMPRESSORS:
+            raise ValueError(f"不支持的归档压缩方式: {compression}")
+        self.directory = directory
+        self.compression = compression
+        self.index_file = os.path.join(directory, 'index.jsonl')
+        self.file_lock = file_lock(self.index_file)
+
+        self._lock = threading.RLock()
+        self._index: Dict[str, Dict] = {}  # session_id -> 元数据
+        self._by_user: Dict[Optional[str], set] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []  # (last_activity 时间戳, session_id)
+        self._offset = 0
+        self._index_id = None
+        self._dead_records = 0  # 索引中已失效的记录数，过多时重写索引
+        self._stats = {'archived': 0, 'restored': 0, 'purged': 0,
+                       'archive_ms_total': 0.0, 'restore_ms_total': 0.0,
+                       'last_archive_ms': None, 'last_restore_ms': None}
+        self._load_index()
+
+    # ---- 索引 ----
+
+    def _load_index(self):
+        self._index = {}
+        self._by_user = {}
+        self._expiry_heap = []
+        self._offset = 0
+        self._dead_records = 0
+        self._index_id = _file_id(self.index_file)
+        self._replay_index()
+
+    def _replay_index(self):
+        """从 _offset 开始回放索引记录（包括其他 worker 追加的记录）"""
+        if not os.path.exists(self.index_file):
+            return
+        with self.file_lock.shared(), open(self.index_file, 'rb') as f:
+            f.seek(self._offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(raw.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    break
+                self._offset += len(raw)
+                self._apply_index_record(record)
+
+    def _apply_index_record(self, record: Dict):
+        if record['op'] == 'archive':
+            meta = record['session']
+            if self._drop_entry(meta['session_id']):
+                self._dead_records += 1
+            self._index[meta['session_id']] = meta
+            self._by_user.setdefault(meta.get('user_id'), set()).add(meta['session_id'])
+            heapq.heappush(self._expiry_heap, (to_epoch(meta['last_activity']) or 0, meta['session_id']))
+        else:
+            for session_id in record['session_ids']:
+                if self._drop_entry(session_id):
+                    self._dead_records += 1
+            self._dead_records += 1
+
+    def _drop_entry(self, session_id: str) -> bool:
+        meta = self._index.pop(session_id, None)
+        if meta is None:
+            return False
+        bucket = self._by_user.get(meta.get('user_id'))
+        if bucket is not None:
+            bucket.discard(session_id)
+            if not bucket:
+                del self._by_user[meta.get('user_id')]
+        return True
+
+    def refresh(self):
+        """读入其他 worker 追加的索引记录；索引被重写过时整体重新加载"""
+        with self._lock, self.file_lock.shared():
+            index_id = _file_id(self.index_file)
+            if index_id != self._index_id or (index_id is not None and os.path.getsize(self.index_file) < self._offset):
+                self._load_index()
+            else:
+                self._replay_index()
+
+    def _append_index(self, records: List[Dict]):
+        """追加索引记录：先补放其他 worker 的记录，再通过回放应用自己写入的记录"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, self.file_lock:
+            self.refresh()
+            with open(self.index_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+            if self._index_id is None:
+                self._index_id = _file_id(self.index_file)
+            self._replay_index()
+            if self._dead_records > max(len(self._index), 1000):
+                self._rewrite_index()
+
+    def _rewrite_index(self):
+        """只保留仍在归档中的会话，重写索引文件"""
+        with self._lock, self.file_lock:
+            payload = ''.join(json.dumps({'op': 'archive', 'session': meta}, ensure_ascii=False) + '\n'
+                              for meta in self._index.values())
+            atomic_write(self.index_file, payload)
+            self._index_id = _file_id(self.index_file)
+            self._offset = os.path.getsize(self.index_file)
+            self._dead_records = 0
+
+    # ---- 归档文件 ----
+
+    def _user_path(self, user_id: Optional[str], compression: str = None) -> str:
+        name = re.sub(r'[^A-Za-z0-9_-]', '_', user_id) if user_id else '_anonymous'
+        return os.path.join(self.directory, name + COMPRESSORS[compression or self.compression][0])
+
+    def _read_user(self, user_id: Optional[str]) -> Dict[str, Dict]:
+        """读取用户的归档文件；切换过压缩方式时也能读出旧格式的文件"""
+        sessions = {}
+        for compression, (_, module) in COMPRESSORS.items():
+            path = self._user_path(user_id, compression)
+            if os.path.exists(path):
+                with module.open(path, 'rt', encoding='utf-8') as f:
+                    sessions.update(json.load(f))
+        return sessions
+
+    def _write_user(self, user_id: Optional[str], sessions: Dict[str, Dict]):
+        path = self._user_path(user_id)
+        for compression in COMPRESSORS:
+            other = self._user_path(user_id, compression)
+            if other != path and os.path.exists(other):
+                os.remove(other)
+        if not sessions:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        module = COMPRESSORS[self.compression][1]
+        with module.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(sessions, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    # ---- 对外接口 ----
+
+    def archive(self, sessions: Iterable[Dict]) -> int:
+        """把完整的会话（消息为字典列表）写进各自用户的归档文件，返回归档的会话数"""
+        started = time.perf_counter()
+        by_user: Dict[Optional[str], List[Dict]] = {}
+        for session in sessions:
+            by_user.setdefault(session.get('user_id'), []).append(session)
+
+        count = 0
+        with self._lock, self.file_lock:
+            for user_id, user_sessions in by_user.items():
+                archived = self._read_user(user_id)
+                for session in user_sessions:
+                    archived[session['session_id']] = session
+                self._write_user(user_id, archived)
+                self._append_index([{'op': 'archive', 'session': _meta(session)} for session in user_sessions])
+                count += len(user_sessions)
+            self._record('archive', count, started)
+        return count
+
+    def restore(self, session_id: str) -> Optional[Dict]:
+        """把会话从归档中取出（同时从归档删除），不在归档中时返回 None"""
+        with self._lock, self.file_lock:
+            # 其他 worker 可能刚恢复或重新归档了这个会话，以最新的索引为准
+            self.refresh()
+            meta = self._index.get(session_id)
+            if meta is None:
+                return None
+            started = time.perf_counter()
+            archived = self._read_user(meta.get('user_id'))
+            session = archived.pop(session_id, None)
+            self._write_user(meta.get('user_id'), archived)
+            self._append_index([{'op': 'remove', 'session_ids': [session_id]}])
+            if session is not None:
+                self._record('restore', 1, started)
+            return session
+
+    def discard(self, session_ids: Iterable[str]) -> int:
+        """从归档中删除会话（不恢复），返回删除的会话数"""
+        with self._lock, self.file_lock:
+            self.refresh()
+            by_user: Dict[Optional[str], List[str]] = {}
+            for session_id in session_ids:
+                meta = self._index.get(session_id)
+                if meta is not None:
+                    by_user.setdefault(meta.get('user_id'), []).append(session_id)
+            removed = []
+            for user_id, user_session_ids in by_user.items():
+                archived = self._read_user(user_id)
+                for session_id in user_session_ids:
+                    archived.pop(session_id, None)
+                self._write_user(user_id, archived)
+                removed.extend(user_session_ids)
+            if removed:
+                self._append_index([{'op': 'remove', 'session_ids': removed}])
+            return len(removed)
+
+    def contains(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._index
+
+    def user_sessions(self, user_id: Optional[str], character_id: str = None) -> List[Dict]:
+        """用户归档会话的元数据（不解压归档文件）"""
+        with self._lock:
+            metas = [self._index[session_id] for session_id in self._by_user.get(user_id, ())]
+        if character_id:
+            metas = [meta for meta in metas if meta.get('character_id') == character_id]
+        return [dict(meta) for meta in metas]
+
+    def all_sessions(self) -> List[Dict]:
+        """全部归档会话的元数据（用于统计，不解压归档文件）"""
+        with self._lock:
+            return [dict(meta) for meta in self._index.values()]
+
+    def purge_expired(self, before: float, batch_size: int = 500) -> int:
+        """删除最后活动早于 before（epoch 秒）的归档会话，最多 batch_size 个"""
+        with self._lock, self.file_lock:
+            self.refresh()
+            expired = []
+            while self._expiry_heap and self._expiry_heap[0][0] < before and len(expired) < batch_size:
+                last_activity, session_id = heapq.heappop(self._expiry_heap)
+                meta = self._index.get(session_id)
+                # 归档后又被恢复、重新归档的会话，以索引中的最新元数据为准
+                if meta is not None and (to_epoch(meta['last_activity']) or 0) == last_activity:
+                    expired.append(session_id)
+            purged = self.discard(expired)
+            self._stats['purged'] += purged
+            return purged
+
+    def _record(self, kind: str, count: int, started: float):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._stats['archived' if kind == 'archive' else 'restored'] += count
+        self._stats[f'{kind}_ms_total'] += elapsed_ms
+        self._stats[f'last_{kind}_ms'] = round(elapsed_ms, 3)
+
+    def get_stats(self) -> Dict:
+        """归档统计：归档 / 恢复 / 过期删除的会话数以及耗时"""
+        with self._lock:
+            stats = dict(self._stats, archived_sessions=len(self._index), compression=self.compression)
+        for kind, count_key in (('archive', 'archived'), ('restore', 'restored')):
+            total = stats.pop(f'{kind}_ms_total')
+            stats[f'avg_{kind}_ms'] = round(total / stats[count_key], 3) if stats[count_key] else None
+        return stats
+
+
+def _meta(session: Dict) -> Dict:
+    meta = {field: session.get(field) for field in ARCHIVE_META_FIELDS}
+    messages = session.get('messages') or ()
+    meta['message_count'] = len(messages)
+    daily = Counter(message['timestamp'][:10] for message in messages if message.get('timestamp'))
+    meta['daily_message_counts'] = dict(daily)
+    return meta
+
+
+def _file_id(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
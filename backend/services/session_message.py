@@ -0,0 +1,178 @@
+"""
+会话消息的内存表示
+
+每条消息用一个带 __slots__ 的小对象保存：时间戳是 epoch 浮点数，role 和
+character_id 经过 intern 在所有消息间共享。只有在 API 返回和持久化时才转换成
+{'role', 'content', 'timestamp', 'character_id'} 形式的字典（ISO 时间字符串）。
+
+一个会话的全部消息放在 MessageHistory 中：系统消息单独固定，对话消息放在有界
+deque 里，追加和淘汰最早的消息都是 O(1)。消息可以按需从存储层读入时，MessageCache
+按估算的内存占用淘汰最久未访问的会话消息。
+"""
+import datetime
+import itertools
+import sys
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def to_epoch(iso_time: Optional[str]) -> Optional[float]:
+    """ISO 时间字符串转 epoch 秒，空值返回 None"""
+    if not iso_time:
+        return None
+    return datetime.datetime.fromisoformat(iso_time).timestamp()
+
+
+def to_iso(timestamp: float) -> str:
+    """epoch 秒转 ISO 时间字符串（本地时间，与 datetime.now().isoformat() 一致）"""
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
+
+
+class Message:
+    """一条会话消息"""
+
+    __slots__ = ('id', 'role', 'content', 'timestamp', 'character_id', 'tokens')
+
+    def __init__(self, role: str, content: str, timestamp: float, character_id: str = None, tokens: int = None,
+                 id: int = None):
+        self.id = id  # 会话内单调递增的消息ID，用作分页游标
+        self.role = _intern(role)
+        self.content = content
+        self.timestamp = timestamp
+        self.character_id = _intern(character_id)
+        self.tokens = tokens  # token 估算值缓存，见 context_builder.message_tokens
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Message':
+        return cls(data['role'], data['content'], to_epoch(data['timestamp']),
+                   data.get('character_id'), data.get('tokens'), data.get('id'))
+
+    def to_dict(self) -> Dict:
+        # tokens 只是进程内的估算缓存，不出现在 API 返回和持久化数据中，读入后按需重新估算
+        return {
+            'id': self.id,
+            'role': self.role,
+            'content': self.content,
+            'timestamp': to_iso(self.timestamp),
+            'character_id': self.character_id
+        }
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, timestamp={self.timestamp!r}, content={self.content[:20]!r})"
+
+
+class MessageHistory:
+    """会话消息历史，超过上限时保留全部系统消息和最新的 limit - len(系统消息) 条对话消息"""
+
+    __slots__ = ('limit', 'pinned', 'turns')
+
+    def __init__(self, messages: Iterable[Message] = (), limit: int = 50):
+        messages = list(messages)
+        self.limit = limit
+        self.pinned = [msg for msg in messages if msg.role == 'system']
+        self.turns = deque((msg for msg in messages if msg.role != 'system'), maxlen=self._turn_capacity())
+
+    def _turn_capacity(self) -> int:
+        return max(self.limit - len(self.pinned), 0)
+
+    def append(self, message: Message):
+        if message.role == 'system':
+            # 系统消息很少出现，新增时按剩余容量重建 deque
+            self.pinned.append(message)
+            self.turns = deque(self.turns, maxlen=self._turn_capacity())
+        else:
+            self.turns.append(message)
+
+    def __iter__(self) -> Iterator[Message]:
+        return itertools.chain(self.pinned, self.turns)
+
+    def __len__(self) -> int:
+        return len(self.pinned) + len(self.turns)
+
+    def page(self, before: int = None, limit: int = None) -> Tuple[List[Message], bool]:
+        """按消息ID取 before 之前（不含）最新的 limit 条消息，返回 (按ID升序的消息, 是否还有更早的消息)"""
+        # 对话消息的ID随追加顺序递增；系统消息固定在前面，存在时需要按ID重新排序
+        messages = sorted(self, key=lambda msg: msg.id) if self.pinned else list(self.turns)
+        if before is not None:
+            messages = [msg for msg in messages if msg.id < before]
+        if limit is None or len(messages) <= limit:
+            return messages, False
+        return messages[-limit:], True
+
+
+# 每条消息除内容字符串外的开销（Message 对象及其在 deque 中的引用，见 bench_message_memory.py）
+MESSAGE_OVERHEAD_BYTES = 104
+
+
+def message_size(message: Message) -> int:
+    """一条消息在内存中的估算字节数"""
+    return MESSAGE_OVERHEAD_BYTES + sys.getsizeof(message.content)
+
+
+class MessageCache:
+    """已读入内存的会话消息的 LRU，按估算的总字节数淘汰最久未访问的会话"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.sizes: 'OrderedDict[str, int]' = OrderedDict()  # session_id -> 估算字节数，最近访问的在末尾
+        self.total = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def touch(self, session_id: str) -> bool:
+        """标记会话消息被访问，返回它是否已在缓存中"""
+        if session_id not in self.sizes:
+            return False
+        self.sizes.move_to_end(session_id)
+        self.hits += 1
+        return True
+
+    def put(self, session_id: str, size: int):
+        """登记（或重新登记）会话消息的大小"""
+        self.total += size - self.sizes.pop(session_id, 0)
+        self.sizes[session_id] = size
+
+    def grow(self, session_id: str, delta: int):
+        if session_id in self.sizes:
+            self.sizes[session_id] += delta
+            self.total += delta
+
+    def discard(self, session_id: str):
+        self.total -= self.sizes.pop(session_id, 0)
+
+    def evict(self, keep: str = None) -> List[str]:
+        """超出上限时从最久未访问的会话开始淘汰，返回被淘汰的会话ID（keep 不会被淘汰）"""
+        evicted = []
+        while self.total > self.max_bytes and len(self.sizes) > 1:
+            session_id, size = self.sizes.popitem(last=False)
+            if session_id == keep:
+                self.sizes[session_id] = size
+                continue
+            self.total -= size
+            evicted.append(session_id)
+        self.evictions += len(evicted)
+        return evicted
+
+    def get_stats(self) -> Dict:
+        return {
+            'cached_sessions': len(self.sizes),
+            'cached_bytes': self.total,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'loads': self.loads,
+            'evictions': self.evictions
+        }
+
+
+def json_default(obj):
+    """json.dumps 的 default：把 Message / MessageHistory 转换成可序列化的形式"""
+    if isinstance(obj, Message):
+        return obj.to_dict()
+    if isinstance(obj, MessageHistory):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -1,46 +1,320 @@
 import json
 import datetime
+import threading
 import uuid
-from typing import Dict, List, Optional
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from config import Config
+from services.session_store import create_session_store
+from services.session_archive import SessionArchive
+from services.context_builder import build_context, context_budget, message_tokens
+from services.summary_service import summarize_conversation
+from services.session_message import Message, MessageCache, MessageHistory, json_default, message_size, to_epoch, to_iso
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import heapq
 import os
+import time
 
 class SessionService:
     """会话管理服务，用于管理对话上下文和历史"""
     
-    def __init__(self):
+    def __init__(self, sessions_file: str = None, persistence: str = None):
         # 内存中的会话存储
         self.sessions: Dict[str, Dict] = {}
         
+        # 二级索引：按最后活动时间从旧到新排列的会话ID（最新的在末尾）
+        self._sessions_by_user: Dict[Optional[str], OrderedDict] = {}
+        self._sessions_by_user_character: Dict[Tuple[Optional[str], Optional[str]], OrderedDict] = {}
+        
+        # 过期调度：(过期时间戳, 会话ID) 小根堆。会话活跃时不更新堆，
+        # 出堆时发现实际过期时间已推后再重新入堆，因此堆大小始终等于会话数
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._evicted_count = 0
+        self._last_sweep_at = None
+        self._sweeper = None
+        
+        # 滚动摘要：后台线程池、正在摘要的会话以及统计
+        self.summarizer = summarize_conversation
+        self._summary_pool = None
+        self._summarizing = set()
+        self._summary_stats = {'runs': 0, 'failures': 0, 'last_duration_ms': None}
+        
         # 会话配置
-        self.max_messages_per_session = 50  # 每个会话最多保留的消息数
+        self.max_messages_per_session = Config.SESSION_MAX_MESSAGES  # 每个会话默认最多保留的消息数
         self.session_timeout = 3600 * 24  # 会话超时时间（24小时）
         
         # 会话存储文件路径（可选的持久化存储）
-        self.sessions_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'sessions.json')
+        self.sessions_file = sessions_file or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'sessions.json')
+        
+        # 变更记录的持久化方式（全量快照、追加日志或 SQLite）
+        self._lock = threading.RLock()
+        persistence = persistence or Config.SESSION_PERSISTENCE
+        options = {}
+        if persistence == 'journal':
+            options = {'compact_threshold': Config.SESSION_JOURNAL_COMPACT_THRESHOLD,
+                       'fsync': Config.SESSION_JOURNAL_FSYNC}
+        elif persistence == 'sqlite':
+            options = {'db_file': Config.SESSION_SQLITE_FILE}
+        self.store = create_session_store(persistence, self.sessions_file, self, **options)
+        
+        # 冷会话归档：空闲超过 archive_after 秒的会话移出热存储，按用户压缩保存
+        self.archive = None
+        self.archive_after = Config.SESSION_ARCHIVE_AFTER
+        if Config.SESSION_ARCHIVE_ENABLED:
+            archive_dir = Config.SESSION_ARCHIVE_DIR or os.path.join(os.path.dirname(self.sessions_file), 'session_archive')
+            self.archive = SessionArchive(archive_dir, Config.SESSION_ARCHIVE_COMPRESSION)
+        
+        # 消息可以随时从存储层重新读入时（SQLite），已读入的消息按内存上限做 LRU 淘汰
+        self._message_cache = None
+        if self.store.lazy:
+            self._message_cache = MessageCache(int(Config.SESSION_MESSAGE_CACHE_MB * 1024 * 1024))
         
         # 加载已有会话（如果存在）
         self._load_sessions()
     
     def _load_sessions(self):
-        """从文件加载会话数据"""
+        """从文件加载会话数据（快照 + 日志回放）"""
         try:
-            if os.path.exists(self.sessions_file):
-                with open(self.sessions_file, 'r', encoding='utf-8') as f:
-                    self.sessions = json.load(f)
-                print(f"[SessionService]: 已加载 {len(self.sessions)} 个会话")
+            if self._message_cache is not None:
+                self._message_cache = MessageCache(self._message_cache.max_bytes)
+            self.sessions, records = self.store.load()
+            for session in self.sessions.values():
+                self._decode_messages(session)
+            self._rebuild_indexes()
+            for record in records:
+                self._apply_record(record)
+            print(f"[SessionService]: 已加载 {len(self.sessions)} 个会话, 回放 {len(records)} 条日志")
         except Exception as e:
             print(f"[SessionService]: 加载会话文件失败: {str(e)}")
             self.sessions = {}
+            self._rebuild_indexes()
+    
+    def reload_if_changed(self):
+        """其他 worker 改写了会话文件（mtime 或大小变化）时同步内存，否则什么也不做"""
+        with self._lock:
+            try:
+                reload, records = self.store.poll()
+            except OSError as e:
+                print(f"[SessionService]: 检查会话文件失败: {str(e)}")
+                return
+            if reload:
+                print("[SessionService]: 会话文件已被其他进程修改，重新加载")
+                self._load_sessions()
+            for record in records:
+                self._apply_record(record)
     
-    def _save_sessions(self):
-        """保存会话数据到文件"""
+    def _rebuild_indexes(self):
+        """按最后活动时间重建用户索引"""
+        self._sessions_by_user = {}
+        self._sessions_by_user_character = {}
+        for session in sorted(self.sessions.values(), key=lambda x: x['last_activity']):
+            self._touch_index(session)
+        
+        self._expiry_heap = []
+        for session_id, session in self.sessions.items():
+            deadline = self._expiry_deadline(session)
+            if deadline is not None:
+                self._expiry_heap.append((deadline, session_id))
+        heapq.heapify(self._expiry_heap)
+    
+    def _touch_index(self, session: Dict):
+        """把会话移到索引末尾（最新活动）"""
+        user_id = session.get('user_id')
+        session_id = session['session_id']
+        for index, key in ((self._sessions_by_user, user_id),
+                           (self._sessions_by_user_character, (user_id, session.get('character_id')))):
+            bucket = index.get(key)
+            if bucket is None:
+                bucket = index[key] = OrderedDict()
+            bucket[session_id] = None
+            bucket.move_to_end(session_id)
+    
+    def _drop_index(self, session: Dict):
+        """从索引中移除会话"""
+        user_id = session.get('user_id')
+        session_id = session['session_id']
+        for index, key in ((self._sessions_by_user, user_id),
+                           (self._sessions_by_user_character, (user_id, session.get('character_id')))):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(session_id, None)
+                if not bucket:
+                    del index[key]
+    
+    def _insert_session(self, session: Dict):
+        self.sessions[session['session_id']] = session
+        self._touch_index(session)
+        deadline = self._expiry_deadline(session)
+        if deadline is not None:
+            heapq.heappush(self._expiry_heap, (deadline, session['session_id']))
+    
+    def _expiry_deadline(self, session: Dict) -> Optional[float]:
+        """会话的过期时间戳（last_activity + session_timeout）"""
         try:
-            with open(self.sessions_file, 'w', encoding='utf-8') as f:
-                json.dump(self.sessions, f, ensure_ascii=False, indent=2)
+            return datetime.datetime.fromisoformat(session['last_activity']).timestamp() + self.session_timeout
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    def _remove_session(self, session_id: str) -> Optional[Dict]:
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            self._drop_index(session)
+            if self._message_cache is not None:
+                self._message_cache.discard(session_id)
+        return session
+    
+    def _iter_recent_sessions(self, user_id: Optional[str], character_id: str = None):
+        """按最后活动时间从新到旧遍历用户未过期的会话（调用方需持有 _lock）
+        
+        索引按活动时间有序，遇到第一个过期会话即可停止，开销只与该用户的会话数有关。
+        """
+        if character_id:
+            bucket = self._sessions_by_user_character.get((user_id, character_id))
+        else:
+            bucket = self._sessions_by_user.get(user_id)
+        if not bucket:
+            return
+        
+        now = datetime.datetime.now()
+        for session_id in reversed(bucket):
+            session = self.sessions[session_id]
+            try:
+                last_activity = datetime.datetime.fromisoformat(session['last_activity'])
+            except (TypeError, ValueError):
+                continue
+            if (now - last_activity).total_seconds() > self.session_timeout:
+                return
+            yield session
+    
+    def _ensure_messages(self, session: Dict) -> MessageHistory:
+        """消息按需从存储层读入（SQLite 模式下启动时只加载会话元数据）
+        
+        启用消息缓存时，每次访问都会刷新会话在 LRU 中的位置，读入新会话后淘汰超出
+        内存上限的最久未访问会话。淘汰随时可能发生，需要修改消息的调用方应在持有
+        _lock 时通过本方法取得 MessageHistory。
+        """
+        cache = self._message_cache
+        if cache is None and 'messages' in session:
+            return session['messages']
+        with self._lock:
+            session_id = session['session_id']
+            if 'messages' not in session:
+                session['messages'] = self.store.load_messages(session_id)
+                session.pop('message_count', None)
+                self._decode_messages(session)
+                if cache is not None:
+                    cache.loads += 1
+                    self._cache_messages(session)
+            elif cache is not None and not cache.touch(session_id):
+                self._cache_messages(session)
+            return session['messages']
+    
+    def _cache_messages(self, session: Dict):
+        """按当前消息登记会话在 LRU 中的大小，并淘汰超出上限的其他会话（调用方需持有 _lock）"""
+        self._message_cache.put(session['session_id'], sum(message_size(msg) for msg in session['messages']))
+        self._evict_messages(session['session_id'])
+    
+    def _evict_messages(self, keep: str):
+        """把超出缓存上限的最久未访问会话的消息移出内存，只保留消息数（调用方需持有 _lock）"""
+        for session_id in self._message_cache.evict(keep=keep):
+            evicted = self.sessions.get(session_id)
+            if evicted is not None and 'messages' in evicted:
+                evicted['message_count'] = len(evicted.pop('messages'))
+    
+    def get_message_cache_stats(self) -> Optional[Dict]:
+        """消息缓存统计，未启用（消息全部常驻内存）时返回 None"""
+        with self._lock:
+            return self._message_cache.get_stats() if self._message_cache is not None else None
+    
+    def _decode_messages(self, session: Dict):
+        """把存储层读出的消息字典转换成按保留条数截断的 MessageHistory
+        
+        旧数据中的消息没有ID，按顺序从 1 开始补上（结果是确定的，下一次写快照时持久化）。
+        """
+        if 'messages' not in session:
+            return
+        messages = [Message.from_dict(msg) for msg in session['messages']]
+        last_id = 0
+        for msg in messages:
+            if msg.id is None:
+                msg.id = last_id + 1
+            last_id = max(last_id, msg.id)
+        session['last_message_id'] = max(session.get('last_message_id') or 0, last_id)
+        session['messages'] = MessageHistory(messages, self._retention_limit(session))
+    
+    def _retention_limit(self, session: Dict) -> int:
+        """会话保留的消息条数：按角色配置优先，其次按用户等级，最后使用默认值"""
+        limit = Config.SESSION_RETENTION_BY_CHARACTER.get(session.get('character_id'))
+        if limit is None and Config.SESSION_RETENTION_BY_TIER:
+            limit = Config.SESSION_RETENTION_BY_TIER.get(self._resolve_user_tier(session.get('user_id')))
+        return limit or self.max_messages_per_session
+    
+    def retention_limit(self, session_id: str) -> int:
+        """会话当前生效的保留条数（供存储层截断磁盘上的消息）"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return self.max_messages_per_session
+        messages = session.get('messages')
+        return messages.limit if isinstance(messages, MessageHistory) else self._retention_limit(session)
+    
+    def session_to_dict(self, session: Dict, limit: int = None) -> Dict:
+        """会话转换成可 JSON 序列化的字典（API 返回用），指定 limit 时只包含最新的 limit 条消息"""
+        with self._lock:
+            messages, has_more = self._ensure_messages(session).page(limit=limit)
+            data = dict(session, messages=[msg.to_dict() for msg in messages])
+        if limit is not None:
+            data['has_more_messages'] = has_more
+        return data
+    
+    def _dump_sessions(self) -> str:
+        """序列化全部会话（供存储层写快照）"""
+        with self._lock:
+            return json.dumps(self.sessions, ensure_ascii=False, indent=2, default=json_default)
+    
+    def _persist(self, record: Dict):
+        """持久化一条变更记录"""
+        try:
+            self.store.append(record)
         except Exception as e:
             print(f"[SessionService]: 保存会话文件失败: {str(e)}")
     
+    def _apply_record(self, record: Dict):
+        """把一条变更记录应用到内存（启动回放时使用）
+        
+        回放是幂等的：时间戳不晚于会话 last_activity 的记录已包含在快照中，直接跳过。
+        """
+        op = record.get('op')
+        if op == 'create':
+            session = record['session']
+            if session['session_id'] not in self.sessions:
+                self._decode_messages(session)
+                self._insert_session(session)
+        elif op == 'add_message':
+            session = self.sessions.get(record['session_id'])
+            if session and record['message']['timestamp'] > session['last_activity']:
+                message = Message.from_dict(record['message'])
+                self._ensure_messages(session)
+                if message.id is None:
+                    message.id = self._next_message_id(session)
+                session['last_message_id'] = max(session.get('last_message_id') or 0, message.id)
+                self._append_message(session, message)
+        elif op == 'clear':
+            session = self.sessions.get(record['session_id'])
+            if session and record['timestamp'] > session['last_activity']:
+                self._reset_messages(session, record['timestamp'])
+        elif op == 'summary':
+            session = self.sessions.get(record['session_id'])
+            until = to_epoch(record['summary_until'])
+            # 会话在摘要之后可能被清空，只有被摘要的消息仍在时才应用
+            if (session and until > (to_epoch(session.get('summary_until')) or 0)
+                    and any(msg.timestamp == until for msg in self._ensure_messages(session))):
+                session['context_summary'] = record['context_summary']
+                session['summary_until'] = record['summary_until']
+        elif op == 'delete':
+            for session_id in record['session_ids']:
+                self._remove_session(session_id)
+    
     def create_session(self, character_id: str = None, user_id: str = None, user_token: str = None) -> str:
         """创建新的会话"""
         session_id = str(uuid.uuid4())
@@ -54,21 +328,29 @@ class SessionService:
             'created_at': current_time,
             'last_activity': current_time,
             'messages': [],
-            'context_summary': ''  # 用于存储对话摘要（当消息过多时）
+            'context_summary': '',  # 用于存储对话摘要（当消息过多时）
+            'summary_until': None,  # 已折叠进摘要的最后一条消息的时间戳
+            'last_message_id': 0  # 最近分配的消息ID，清空会话后也不回退，保证ID不被复用
         }
+        record = {'op': 'create', 'session': dict(session_data)}
+        session_data['messages'] = MessageHistory(limit=self._retention_limit(session_data))
         
-        self.sessions[session_id] = session_data
-        self._save_sessions()
+        with self._lock:
+            self._insert_session(session_data)
+            self._persist(record)
         
         print(f"[SessionService]: 创建新会话 {session_id}, 角色: {character_id}")
         return session_id
     
     def get_session(self, session_id: str) -> Optional[Dict]:
-        """获取会话信息"""
-        if session_id not in self.sessions:
-            return None
-        
-        session = self.sessions[session_id]
+        """获取会话信息（已归档的会话会被恢复回热存储）"""
+        # 清理线程可能同时删除会话，在锁内取出会话对象
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            session = self._restore_session(session_id)
+            if session is None:
+                return None
         
         # 检查会话是否过期
         last_activity = datetime.datetime.fromisoformat(session['last_activity'])
@@ -76,6 +358,28 @@ class SessionService:
             print(f"[SessionService]: 会话 {session_id} 已过期")
             return None
         
+        self._ensure_messages(session)
+        return session
+    
+    def _restore_session(self, session_id: str) -> Optional[Dict]:
+        """从归档中恢复会话，并以 create 记录写回热存储；不在归档中时返回 None"""
+        if self.archive is None:
+            return None
+        with self._lock:
+            if session_id in self.sessions:
+                return self.sessions[session_id]
+            try:
+                session = self.archive.restore(session_id)
+            except Exception as e:
+                print(f"[SessionService]: 恢复归档会话 {session_id} 失败: {str(e)}")
+                return None
+            if session is None:
+                return None
+            record = {'op': 'create', 'session': dict(session)}
+            self._decode_messages(session)
+            self._insert_session(session)
+            self._persist(record)
+        print(f"[SessionService]: 已从归档恢复会话 {session_id}")
         return session
     
     def add_message(self, session_id: str, role: str, content: str, character_id: str = None) -> bool:
@@ -84,43 +388,80 @@ class SessionService:
         if not session:
             return False
         
-        message = {
-            'role': role,  # 'user' 或 'assistant'
-            'content': content,
-            'timestamp': datetime.datetime.now().isoformat(),
-            'character_id': character_id
-        }
-        
-        session['messages'].append(message)
-        session['last_activity'] = datetime.datetime.now().isoformat()
-        
-        # 如果消息数量超过限制，移除最早的消息（保留系统消息）
-        if len(session['messages']) > self.max_messages_per_session:
-            # 保留第一条系统消息（如果有的话）
-            system_messages = [msg for msg in session['messages'] if msg['role'] == 'system']
-            user_assistant_messages = [msg for msg in session['messages'] if msg['role'] in ['user', 'assistant']]
-            
-            # 只保留最新的消息
-            keep_count = self.max_messages_per_session - len(system_messages)
-            session['messages'] = system_messages + user_assistant_messages[-keep_count:]
+        # 时间戳取微秒精度，与持久化的 ISO 字符串可以无损互转
+        message = Message(role, content, datetime.datetime.now().timestamp(), character_id)  # role: 'user' 或 'assistant'
+        message_tokens(message)  # 估算一次并随消息持久化
         
-        self._save_sessions()
-        print(f"[SessionService]: 向会话 {session_id} 添加消息，当前消息数: {len(session['messages'])}")
+        with self._lock:
+            message.id = session['last_message_id'] = self._next_message_id(session)
+            self._append_message(session, message)
+            self._persist({'op': 'add_message', 'session_id': session_id, 'message': message.to_dict()})
+            self._maybe_schedule_summary(session)
+            message_count = len(session['messages'])
+        print(f"[SessionService]: 向会话 {session_id} 添加消息，当前消息数: {message_count}")
         return True
     
+    def _append_message(self, session: Dict, message: Message):
+        """追加消息，超过保留条数时由 MessageHistory 淘汰最早的对话消息（系统消息保留）"""
+        self._ensure_messages(session).append(message)
+        if self._message_cache is not None:
+            self._message_cache.grow(session['session_id'], message_size(message))
+            self._evict_messages(session['session_id'])
+        session['last_activity'] = to_iso(message.timestamp)
+        self._touch_index(session)
+    
+    def _next_message_id(self, session: Dict) -> int:
+        self._ensure_messages(session)
+        return (session.get('last_message_id') or 0) + 1
+    
+    def _reset_messages(self, session: Dict, timestamp: str):
+        session['messages'] = MessageHistory(limit=self._retention_limit(session))
+        session.pop('message_count', None)
+        if self._message_cache is not None:
+            self._message_cache.put(session['session_id'], 0)
+        session['context_summary'] = ''
+        session['summary_until'] = None
+        session['last_activity'] = timestamp
+        self._touch_index(session)
+    
     def get_messages(self, session_id: str) -> List[Dict]:
         """获取会话的所有消息"""
         session = self.get_session(session_id)
         if not session:
             return []
         
-        return session['messages']
+        with self._lock:
+            return [msg.to_dict() for msg in self._ensure_messages(session)]
     
-    def get_context_messages(self, session_id: str, character_name: str = None, character_description: str = None) -> List[Dict]:
+    def get_messages_page(self, session_id: str, before: int = None, limit: int = None) -> Optional[Dict]:
+        """按游标分页获取消息：返回消息ID小于 before 的最新 limit 条（按时间正序）
+        
+        结果中的 next_cursor 是本页最早一条消息的ID，作为下一页的 before；没有更早的消息时为 None。
+        会话不存在或已过期时返回 None。
+        """
+        session = self.get_session(session_id)
+        if not session:
+            return None
+        
+        with self._lock:
+            messages, has_more = self._ensure_messages(session).page(before, limit)
+            return {
+                'messages': [msg.to_dict() for msg in messages],
+                'has_more': has_more,
+                'next_cursor': messages[0].id if has_more else None
+            }
+    
+    def get_context_messages(self, session_id: str, character_name: str = None, character_description: str = None,
+                             model: str = None) -> List[Dict]:
         """获取用于AI对话的上下文消息列表"""
+        return self.build_context(session_id, character_name, character_description, model)[0]
+    
+    def build_context(self, session_id: str, character_name: str = None, character_description: str = None,
+                      model: str = None, budget: int = None) -> Tuple[List[Dict], int]:
+        """在模型的 token 预算内组装上下文，返回 (上下文消息, 估算的 token 数)"""
         session = self.get_session(session_id)
         if not session:
-            return []
+            return [], 0
         
         messages = []
         
@@ -136,15 +477,77 @@ class SessionService:
                 "content": f"你是{character_name}。{character_description}请始终保持这个角色的身份和特点进行对话。"
             })
         
-        # 添加历史消息
-        for msg in session['messages']:
-            if msg['role'] in ['user', 'assistant']:
+        # 较早的对话已折叠进摘要，只发送摘要之后的消息
+        with self._lock:
+            if session.get('context_summary'):
                 messages.append({
-                    "role": msg['role'],
-                    "content": msg['content']
+                    "role": "system",
+                    "content": f"以下是你们之前对话的摘要：\n{session['context_summary']}"
                 })
+            
+            # 添加历史消息（从新到旧取，直到用完预算）
+            history = self._unsummarized_messages(session)
+            return build_context(messages, history, budget or context_budget(model))
+    
+    def _unsummarized_messages(self, session: Dict) -> List[Message]:
+        """尚未折叠进摘要的对话消息"""
+        until = to_epoch(session.get('summary_until')) or 0
+        return [msg for msg in self._ensure_messages(session)
+                if msg.role in ['user', 'assistant'] and msg.timestamp > until]
+    
+    def _maybe_schedule_summary(self, session: Dict):
+        """未摘要的对话超过阈值时，把较早的部分交给后台折叠进 context_summary（调用方需持有 _lock）"""
+        if not Config.SESSION_SUMMARY_ENABLED or session['session_id'] in self._summarizing:
+            return
+        pending = self._unsummarized_messages(session)
+        if len(pending) <= Config.SESSION_SUMMARY_TRIGGER:
+            return
         
-        return messages
+        batch = pending[:len(pending) - Config.SESSION_SUMMARY_KEEP_RECENT]
+        self._summarizing.add(session['session_id'])
+        if self._summary_pool is None:
+            self._summary_pool = ThreadPoolExecutor(max_workers=Config.SESSION_SUMMARY_WORKERS,
+                                                    thread_name_prefix='session-summarizer')
+        self._summary_pool.submit(self._summarize_session, session['session_id'],
+                                  session.get('context_summary', ''), batch)
+    
+    def _summarize_session(self, session_id: str, previous_summary: str, batch: List[Message]):
+        """后台任务：生成新摘要并写回会话"""
+        started = time.time()
+        try:
+            summary = self.summarizer(previous_summary, batch)
+            with self._lock:
+                if not summary:
+                    self._summary_stats['failures'] += 1
+                    return
+                session = self.sessions.get(session_id)
+                until = batch[-1].timestamp
+                # 摘要期间会话可能被删除或清空，此时丢弃结果
+                if session is None or not any(msg.timestamp == until for msg in session.get('messages', ())):
+                    return
+                session['context_summary'] = summary
+                session['summary_until'] = until = to_iso(until)
+                self._persist({'op': 'summary', 'session_id': session_id,
+                               'context_summary': summary, 'summary_until': until})
+                self._summary_stats['runs'] += 1
+                self._summary_stats['last_duration_ms'] = round((time.time() - started) * 1000, 1)
+            print(f"[SessionService]: 会话 {session_id} 已将 {len(batch)} 条消息折叠进摘要")
+        except Exception as e:
+            with self._lock:
+                self._summary_stats['failures'] += 1
+            print(f"[SessionService]: 生成会话摘要失败: {str(e)}")
+        finally:
+            with self._lock:
+                self._summarizing.discard(session_id)
+    
+    def get_archive_stats(self) -> Optional[Dict]:
+        """归档统计，未启用归档时返回 None"""
+        return self.archive.get_stats() if self.archive is not None else None
+    
+    def get_summary_stats(self) -> Dict:
+        """滚动摘要统计"""
+        with self._lock:
+            return dict(self._summary_stats, in_progress=len(self._summarizing))
     
     def clear_session(self, session_id: str) -> bool:
         """清空会话消息"""
@@ -152,48 +555,48 @@ class SessionService:
         if not session:
             return False
         
-        session['messages'] = []
-        session['last_activity'] = datetime.datetime.now().isoformat()
-        self._save_sessions()
+        current_time = datetime.datetime.now().isoformat()
+        with self._lock:
+            self._reset_messages(session, current_time)
+            self._persist({'op': 'clear', 'session_id': session_id, 'timestamp': current_time})
         
         print(f"[SessionService]: 清空会话 {session_id}")
         return True
     
     def delete_session(self, session_id: str) -> bool:
         """删除会话"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            self._save_sessions()
-            print(f"[SessionService]: 删除会话 {session_id}")
-            return True
-        return False
+        with self._lock:
+            if self._remove_session(session_id) is None:
+                if self.archive is None or not self.archive.discard([session_id]):
+                    return False
+                print(f"[SessionService]: 删除归档会话 {session_id}")
+                return True
+            self._persist({'op': 'delete', 'session_ids': [session_id]})
+        print(f"[SessionService]: 删除会话 {session_id}")
+        return True
     
     def clear_all_user_sessions(self, user_token: str) -> bool:
         """清空用户的所有会话"""
         try:
-            from .user_service import get_user_service
-            
             # 获取用户ID
-            user_service = get_user_service()
-            user = user_service.get_user_by_token(user_token)
-            if not user:
+            user_id = self._resolve_user_id(user_token)
+            if not user_id:
                 return False
             
-            user_id = user['id']
-            
-            # 找到属于该用户的所有会话
-            user_sessions = []
-            for session_id, session_data in self.sessions.items():
-                if session_data.get('user_id') == user_id:
-                    user_sessions.append(session_id)
-            
             # 删除所有用户会话
-            for session_id in user_sessions:
-                if session_id in self.sessions:
-                    del self.sessions[session_id]
+            with self._lock:
+                user_sessions = list(self._sessions_by_user.get(user_id, ()))
+                for session_id in user_sessions:
+                    self._remove_session(session_id)
+                
+                if user_sessions:
+                    self._persist({'op': 'delete', 'session_ids': user_sessions})
+                if self.archive is not None:
+                    archived = [meta['session_id'] for meta in self.archive.user_sessions(user_id)]
+                    self.archive.discard(archived)
+                    user_sessions += archived
             
             if user_sessions:
-                self._save_sessions()
                 print(f"[SessionService]: 清空用户所有会话，共删除 {len(user_sessions)} 个会话")
             
             return True
@@ -201,102 +604,298 @@ class SessionService:
             print(f"[SessionService]: 清空用户会话失败: {str(e)}")
             return False
 
+    def count_user_messages(self, user_id: str, character_id: str) -> int:
+        """用户与角色各会话的消息数之和，包括已归档的会话（按 (用户, 角色) 索引和归档索引查找，不读入消息内容）"""
+        with self._lock:
+            bucket = self._sessions_by_user_character.get((user_id, character_id)) or ()
+            count = sum(self._session_summary(self.sessions[session_id])['message_count'] for session_id in bucket)
+        if self.archive is not None:
+            count += sum(meta['message_count'] or 0 for meta in self.archive.user_sessions(user_id, character_id)
+                         if meta['session_id'] not in self.sessions)
+        return count
+
     def get_all_sessions(self) -> Dict[str, Dict]:
-        """获取所有会话数据（用于统计）"""
-        return self.sessions.copy()
+        """获取热存储中的所有会话数据（会把尚未读入的消息全部读入；只需要消息数时用 get_message_stats）
+        
+        启用消息缓存时返回会话的浅拷贝，读入的消息不会因为随后的 LRU 淘汰而从结果中消失。
+        已归档的会话不在其中，见 get_archived_sessions。
+        """
+        with self._lock:
+            if self._message_cache is None:
+                for session in self.sessions.values():
+                    self._ensure_messages(session)
+                return self.sessions.copy()
+            return {session_id: dict(session, messages=self._ensure_messages(session))
+                    for session_id, session in self.sessions.items()}
     
-    def cleanup_expired_sessions(self):
-        """清理过期的会话"""
-        current_time = datetime.datetime.now()
+    def get_message_stats(self, since: float) -> List[Dict]:
+        """热存储中各会话的消息统计（用于统计，不读入消息内容，也不进入消息缓存）
+        
+        每个会话返回 session_id、user_id、character_id、消息数 message_count 以及时间戳不早于
+        since（epoch 秒）的消息数 recent_count。已读入内存的会话直接计数，其余会话（SQLite 模式）
+        由存储层按时间戳聚合。
+        """
+        with self._lock:
+            recent = self.store.count_messages_since(since) if self.store.lazy else {}
+            stats = []
+            for session_id, session in self.sessions.items():
+                messages = session.get('messages')
+                if messages is not None:
+                    message_count = len(messages)
+                    recent_count = sum(1 for message in messages if message.timestamp >= since)
+                else:
+                    message_count = session.get('message_count', 0)
+                    recent_count = recent.get(session_id, 0)
+                stats.append({'session_id': session_id, 'user_id': session.get('user_id'),
+                              'character_id': session.get('character_id'),
+                              'message_count': message_count, 'recent_count': recent_count})
+            return stats
+    
+    def get_archived_sessions(self) -> List[Dict]:
+        """已归档（不在热存储中）的会话元数据：消息数 message_count、按天的消息数 daily_message_counts 等"""
+        if self.archive is None:
+            return []
+        return [meta for meta in self.archive.all_sessions() if meta['session_id'] not in self.sessions]
+    
+    def sweep_expired_sessions(self, batch_size: int = None) -> int:
+        """从过期堆中取出到期的会话并删除，最多处理 batch_size 个；删除操作合并为一次写入
+        
+        启用归档时，空闲超过 archive_after 但尚未过期的会话在同一次扫描中被归档。
+        堆按过期时间排序，而归档时间 = 过期时间 - (session_timeout - archive_after)，
+        顺序相同，因此只需把出堆的截止时间相应提前。返回删除的过期会话数。
+        """
+        return self._sweep(batch_size or Config.SESSION_SWEEP_BATCH_SIZE)[0]
+    
+    def _sweep(self, batch_size: int) -> Tuple[int, int]:
+        """扫描一批到期的会话，返回 (删除的过期会话数, 归档的会话数)"""
+        now = time.time()
+        archive_cutoff = now
+        if self.archive is not None and self.archive_after < self.session_timeout:
+            archive_cutoff = now + self.session_timeout - self.archive_after
         expired_sessions = []
+        to_archive = []
+        skipped = []
         
-        for session_id, session in self.sessions.items():
-            last_activity = datetime.datetime.fromisoformat(session['last_activity'])
-            if (current_time - last_activity).total_seconds() > self.session_timeout:
-                expired_sessions.append(session_id)
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= archive_cutoff and len(expired_sessions) + len(to_archive) < batch_size:
+                _, session_id = heapq.heappop(heap)
+                session = self.sessions.get(session_id)
+                if session is None:
+                    continue  # 已被删除
+                deadline = self._expiry_deadline(session)
+                if deadline is None:
+                    continue
+                if deadline > archive_cutoff:
+                    # 入堆后会话又活跃过，按新的过期时间重新入堆
+                    heapq.heappush(heap, (deadline, session_id))
+                    continue
+                if deadline <= now:
+                    self._remove_session(session_id)
+                    expired_sessions.append(session_id)
+                elif session_id in self._summarizing:
+                    skipped.append((deadline, session_id))  # 摘要完成后的下一次扫描再归档
+                else:
+                    to_archive.append(self.session_to_dict(session))
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+            
+            if expired_sessions:
+                self._persist({'op': 'delete', 'session_ids': expired_sessions})
+                self._evicted_count += len(expired_sessions)
+            self._last_sweep_at = datetime.datetime.now().isoformat()
         
-        for session_id in expired_sessions:
-            del self.sessions[session_id]
+        archived = self._archive_sessions(to_archive) if to_archive else 0
+        if self.archive is not None:
+            # 归档中的会话同样在 session_timeout 后过期
+            try:
+                self.archive.purge_expired(now - self.session_timeout, batch_size)
+            except Exception as e:
+                print(f"[SessionService]: 清理过期归档失败: {str(e)}")
         
         if expired_sessions:
-            self._save_sessions()
             print(f"[SessionService]: 清理了 {len(expired_sessions)} 个过期会话")
+        return len(expired_sessions), archived
+    
+    def _archive_sessions(self, sessions: List[Dict]) -> int:
+        """把会话写进归档，再从热存储中移除；写归档期间又活跃过的会话留在热存储"""
+        try:
+            self.archive.archive(sessions)
+        except Exception as e:
+            print(f"[SessionService]: 归档会话失败: {str(e)}")
+            with self._lock:
+                for session in sessions:
+                    if session['session_id'] in self.sessions:
+                        heapq.heappush(self._expiry_heap, (self._expiry_deadline(session), session['session_id']))
+            return 0
         
-        return len(expired_sessions)
+        archived = []
+        reactivated = []
+        with self._lock:
+            for snapshot in sessions:
+                session_id = snapshot['session_id']
+                session = self.sessions.get(session_id)
+                if session is None:
+                    continue
+                if session['last_activity'] != snapshot['last_activity'] or session.get('context_summary') != snapshot.get('context_summary'):
+                    reactivated.append(session_id)
+                    deadline = self._expiry_deadline(session)
+                    if deadline is not None:
+                        heapq.heappush(self._expiry_heap, (deadline, session_id))
+                    continue
+                self._remove_session(session_id)
+                archived.append(session_id)
+            if archived:
+                self._persist({'op': 'delete', 'session_ids': archived})
+            if reactivated:
+                self.archive.discard(reactivated)
+        if archived:
+            print(f"[SessionService]: 归档了 {len(archived)} 个空闲会话")
+        return len(archived)
+    
+    def cleanup_expired_sessions(self):
+        """清理所有过期的会话并归档空闲会话（分批进行，每批一次写入），返回删除的过期会话数"""
+        total = 0
+        while True:
+            expired, archived = self._sweep(Config.SESSION_SWEEP_BATCH_SIZE)
+            total += expired
+            if expired + archived < Config.SESSION_SWEEP_BATCH_SIZE:
+                return total
+    
+    def start_expiry_sweeper(self, interval: float = None):
+        """启动后台过期清理线程"""
+        interval = interval or Config.SESSION_SWEEP_INTERVAL
+        if self._sweeper is not None:
+            return
+        
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.cleanup_expired_sessions()
+                except Exception as e:
+                    print(f"[SessionService]: 清理过期会话失败: {str(e)}")
+        
+        self._sweeper = threading.Thread(target=run, name='session-expiry-sweeper', daemon=True)
+        self._sweeper.start()
+    
+    def get_expiry_stats(self) -> Dict:
+        """过期清理统计"""
+        with self._lock:
+            return {
+                'live_sessions': len(self.sessions),
+                'evicted_sessions': self._evicted_count,
+                'scheduled_sessions': len(self._expiry_heap),
+                'last_sweep_at': self._last_sweep_at
+            }
     
     def get_session_list(self, user_id: str = None) -> List[Dict]:
         """获取会话列表"""
+        if user_id:
+            # 指定了用户ID时直接走用户索引，结果已按最后活动时间排序
+            with self._lock:
+                sessions = [self._session_summary(session) for session in self._iter_recent_sessions(user_id)]
+            return self._merge_archived(sessions, user_id)
+        
+        with self._lock:
+            snapshot = list(self.sessions.values())
+        
         sessions = []
-        for session_id, session in self.sessions.items():
-            # 如果指定了用户ID，只返回该用户的会话
-            if user_id and session.get('user_id') != user_id:
-                continue
-            
+        for session in snapshot:
             # 检查会话是否过期
             last_activity = datetime.datetime.fromisoformat(session['last_activity'])
             if (datetime.datetime.now() - last_activity).total_seconds() > self.session_timeout:
                 continue
             
-            session_info = {
-                'session_id': session_id,
-                'character_id': session.get('character_id'),
-                'created_at': session['created_at'],
-                'last_activity': session['last_activity'],
-                'message_count': len(session['messages'])
-            }
-            sessions.append(session_info)
+            sessions.append(self._session_summary(session))
         
         # 按最后活动时间排序
         sessions.sort(key=lambda x: x['last_activity'], reverse=True)
         return sessions
     
-    def get_user_sessions(self, user_token: str, character_id: str = None) -> List[Dict]:
-        """获取用户的会话列表"""
+    def _session_summary(self, session: Dict) -> Dict:
+        return {
+            'session_id': session['session_id'],
+            'character_id': session.get('character_id'),
+            'created_at': session['created_at'],
+            'last_activity': session['last_activity'],
+            'message_count': len(session['messages']) if 'messages' in session else session.get('message_count', 0)
+        }
+    
+    def _resolve_user_tier(self, user_id: Optional[str]) -> Optional[str]:
         from .user_service import get_user_service
         
-        # 获取用户ID
-        user_service = get_user_service()
-        user = user_service.get_user_by_token(user_token)
-        if not user:
+        return get_user_service().get_user_tier(user_id) if user_id else None
+    
+    def _resolve_user_id(self, user_token: str) -> Optional[str]:
+        from .user_service import get_user_service
+        
+        user = get_user_service().get_user_by_token(user_token)
+        return user['id'] if user else None
+    
+    def get_user_sessions(self, user_token: str, character_id: str = None) -> List[Dict]:
+        """获取用户的会话列表（按最后活动时间倒序）"""
+        # 获取用户ID（使用user_id而不是user_token匹配会话）
+        user_id = self._resolve_user_id(user_token)
+        if not user_id:
             return []
         
-        user_id = user['id']
         user_sessions = []
-        
-        for session_id, session in self.sessions.items():
-            # 检查是否是该用户的会话（使用user_id而不是user_token）
-            if session.get('user_id') != user_id:
-                continue
-            
-            # 如果指定了角色ID，只返回该角色的会话
-            if character_id and session.get('character_id') != character_id:
+        with self._lock:
+            for session in self._iter_recent_sessions(user_id, character_id):
+                session_info = self._session_summary(session)
+                session_info['context_summary'] = session.get('context_summary', '')
+                user_sessions.append(session_info)
+        return self._merge_archived(user_sessions, user_id, character_id, with_summary=True)
+    
+    def _merge_archived(self, sessions: List[Dict], user_id: str, character_id: str = None,
+                        with_summary: bool = False) -> List[Dict]:
+        """把用户未过期的归档会话（只用索引中的元数据，不解压）按最后活动时间合并进会话列表"""
+        if self.archive is None:
+            return sessions
+        now = datetime.datetime.now()
+        archived = []
+        for meta in self.archive.user_sessions(user_id, character_id):
+            if meta['session_id'] in self.sessions:
                 continue
-            
-            # 检查会话是否过期
-            try:
-                last_activity = datetime.datetime.fromisoformat(session['last_activity'])
-                if (datetime.datetime.now() - last_activity).total_seconds() > self.session_timeout:
-                    continue
-            except:
+            last_activity = datetime.datetime.fromisoformat(meta['last_activity'])
+            if (now - last_activity).total_seconds() > self.session_timeout:
                 continue
-            
-            session_info = {
-                'session_id': session_id,
-                'character_id': session.get('character_id'),
-                'created_at': session['created_at'],
-                'last_activity': session['last_activity'],
-                'message_count': len(session['messages']),
-                'context_summary': session.get('context_summary', '')
-            }
-            user_sessions.append(session_info)
-        
-        # 按最后活动时间排序
-        user_sessions.sort(key=lambda x: x['last_activity'], reverse=True)
-        return user_sessions
+            if not with_summary:
+                meta.pop('context_summary', None)
+            meta.pop('user_id', None)
+            meta.pop('daily_message_counts', None)
+            meta['archived'] = True
+            archived.append(meta)
+        if not archived:
+            return sessions
+        return sorted(sessions + archived, key=lambda x: x['last_activity'], reverse=True)
     
     def get_latest_user_session(self, user_token: str, character_id: str) -> Optional[str]:
         """获取用户与特定角色的最新会话ID"""
-        user_sessions = self.get_user_sessions(user_token, character_id)
-        if user_sessions:
-            return user_sessions[0]['session_id']
-        return None
+        user_id = self._resolve_user_id(user_token)
+        if not user_id:
+            return None
+        
+        with self._lock:
+            latest = next(self._iter_recent_sessions(user_id, character_id), None)
+        candidates = self._merge_archived([latest] if latest else [], user_id, character_id)
+        return candidates[0]['session_id'] if candidates else None
+
+
+# 全局会话服务实例
+_session_service_instance = None
+_session_service_lock = threading.Lock()
+
+def get_session_service() -> SessionService:
+    """获取进程内共享的会话服务，只在会话文件被其他 worker 改写时重新加载"""
+    global _session_service_instance
+    if _session_service_instance is None:
+        with _session_service_lock:
+            if _session_service_instance is None:
+                _session_service_instance = SessionService()
+                _session_service_instance.start_expiry_sweeper()
+                atexit.register(_session_service_instance.store.close)
+                return _session_service_instance
+    _session_service_instance.reload_if_changed()
+    return _session_service_instance
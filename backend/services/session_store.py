@@ -0,0 +1,624 @@
+"""
+会话持久化存储
+
+SessionService 的每一次变更都会被描述成一条记录（record），交给存储层持久化：
+- snapshot: 每次变更后重写整个 sessions.json，窗口期内的多次变更合并成一次写入；
+            其他 worker 改写过快照时按会话合并
+- journal:  变更以 JSON Lines 形式追加到日志文件，后台线程定期把日志压缩进快照，
+            启动时先加载快照再回放日志
+- sqlite:   会话和消息分表存入 SQLite（WAL 模式），变更按行写入；启动时只加载会话元数据，
+            消息在首次访问会话时按需读入
+
+多个 worker 进程共享同一组文件时，追加、日志轮转和快照写入都在 fcntl 文件锁内进行
+（见 services/file_lock.py）。
+"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from services.file_lock import file_lock
+from services.session_message import to_iso
+from services.write_behind import WriteBehind, atomic_write
+
+
+class SessionStore:
+    """会话存储接口，SessionService 只通过这些方法与存储层交互"""
+
+    # 消息能否随时通过 load_messages 重新读入；为 True 时 SessionService 会把不常用的消息移出内存
+    lazy = False
+
+    def load(self) -> Tuple[Dict[str, Dict], List[Dict]]:
+        """加载全部会话，返回 (会话字典, 需要回放的变更记录)
+
+        会话字典中可以省略 messages（此时需提供 message_count），由 load_messages 按需读入。
+        """
+        raise NotImplementedError
+
+    def poll(self) -> Tuple[bool, List[Dict]]:
+        """检查其他 worker 的写入，返回 (是否需要整体重新加载, 需要补放的记录)"""
+        raise NotImplementedError
+
+    def append(self, record: Dict):
+        """持久化一条变更记录（调用方需持有 owner._lock）"""
+        raise NotImplementedError
+
+    def compact(self):
+        """整理存储（写快照、合并日志等）"""
+        raise NotImplementedError
+
+    def load_messages(self, session_id: str) -> List[Dict]:
+        """读取单个会话的消息；全量加载的存储不会省略 messages，因此不会被调用"""
+        return []
+
+    def count_messages_since(self, since: float) -> Dict[str, int]:
+        """各会话中时间戳不早于 since（epoch 秒）的消息数，不读取消息内容；全量加载的存储不会被调用"""
+        return {}
+
+    def flush(self):
+        """立即写出尚未落盘的变更；每条记录都同步写入的存储无需处理"""
+
+    def close(self):
+        """释放文件句柄或连接"""
+
+
+class SnapshotSessionStore(SessionStore):
+    """全量快照存储：变更后重写 sessions.json，合并写入窗口内的多次变更只写一次"""
+
+    def __init__(self, sessions_file: str, owner):
+        self.sessions_file = sessions_file
+        self.owner = owner
+        self._signature = None  # 最近一次读写后快照文件的 (mtime, size)
+        self._dirty_sessions = set()  # 上次写快照以来变更过的会话
+        self._file_lock = file_lock(sessions_file)
+        self._writer = WriteBehind(sessions_file, self.compact)
+
+    def load(self) -> Tuple[Dict[str, Dict], List[Dict]]:
+        """加载快照，快照模式下没有待回放的日志"""
+        self._signature = _file_signature(self.sessions_file)
+        return _read_snapshot(self.sessions_file), []
+
+    def poll(self) -> Tuple[bool, List[Dict]]:
+        """检查文件是否被其他 worker 改写，返回 (是否需要整体重新加载, 需要补放的记录)
+
+        本进程还有未写出的变更时不重新加载：快照模式下最后写入者的快照生效，
+        重新加载只会丢掉这些变更。
+        """
+        if self._writer.dirty:
+            return False, []
+        return _file_signature(self.sessions_file) != self._signature, []
+
+    def append(self, record: Dict):
+        """记录一次变更（在合并写入窗口结束时重写整个快照）"""
+        self._dirty_sessions.update(_record_session_ids(record))
+        self._writer.mark_dirty()
+
+    def compact(self):
+        """把当前内存状态写成快照
+
+        快照在上次读写之后被其他 worker 改写过时，在文件锁内读取最新快照，只用本进程
+        变更过的会话覆盖它，其他会话保持对方写入的内容；下一次 poll 时再整体重新加载。
+        """
+        with self._file_lock:
+            with self.owner._lock:
+                dirty, self._dirty_sessions = self._dirty_sessions, set()
+                merge = _file_signature(self.sessions_file) != self._signature
+                if merge:
+                    sessions = _read_snapshot(self.sessions_file)
+                    for session_id in dirty:
+                        session = self.owner.sessions.get(session_id)
+                        if session is None:
+                            sessions.pop(session_id, None)
+                        else:
+                            sessions[session_id] = self.owner.session_to_dict(session)
+                    payload = json.dumps(sessions, ensure_ascii=False, indent=2)
+                else:
+                    payload = self.owner._dump_sessions()
+            try:
+                _write_snapshot(self.sessions_file, payload)
+            except Exception:
+                with self.owner._lock:
+                    self._dirty_sessions |= dirty
+                raise
+            self._signature = None if merge else _file_signature(self.sessions_file)
+
+    def flush(self):
+        """立即写出窗口期内尚未落盘的变更"""
+        self._writer.flush()
+
+    def close(self):
+        """写出尚未落盘的变更；快照模式没有需要关闭的句柄"""
+        self._writer.flush()
+
+
+class JournalSessionStore(SessionStore):
+    """追加日志存储：变更追加到 sessions.journal，后台压缩进 sessions.json"""
+
+    def __init__(self, sessions_file: str, owner, compact_threshold: int = 200, fsync: bool = False):
+        self.sessions_file = sessions_file
+        self.journal_file = os.path.splitext(sessions_file)[0] + '.journal'
+        # 压缩过程中被轮转出去的日志，快照写完后删除
+        self.rotated_file = self.journal_file + '.compacting'
+        self.owner = owner
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+
+        self._handle = None
+        self._pending = 0  # 自上次压缩以来追加的记录数
+        self._offset = 0  # 已读入内存的日志字节数
+        self._journal_id = None  # 当前日志文件的 (st_dev, st_ino)，用于发现被轮转
+        self._snapshot_signature = None
+        self._compacting = False
+        # 追加与轮转互斥；压缩（写快照）与加载互斥，同一时间只有一个进程在压缩
+        self._journal_lock = file_lock(self.journal_file)
+        self._snapshot_lock = file_lock(sessions_file)
+
+    def load(self) -> Tuple[Dict[str, Dict], List[Dict]]:
+        """加载快照以及快照之后的全部日志记录"""
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        # 其他进程可能正在写快照并删除轮转出去的日志，读取期间持有共享锁
+        with self._snapshot_lock.shared():
+            self._snapshot_signature = _file_signature(self.sessions_file)
+            sessions = _read_snapshot(self.sessions_file)
+            records = _read_journal(self.rotated_file)[0]
+            with self._journal_lock:
+                self._journal_id = _file_id(self.journal_file)
+                journal_records, self._offset = _read_journal(self.journal_file)
+        records.extend(journal_records)
+        self._pending = len(records)
+        return sessions, records
+
+    def poll(self) -> Tuple[bool, List[Dict]]:
+        """检查其他 worker 的写入，返回 (是否需要整体重新加载, 需要补放的记录)
+
+        快照被改写或日志被轮转时需要整体重新加载；日志只是变长时增量读入新记录即可。
+        """
+        if _file_signature(self.sessions_file) != self._snapshot_signature:
+            return True, []
+        journal_id = _file_id(self.journal_file)
+        if journal_id is None:
+            return self._offset > 0, []
+        if self._journal_id is not None and journal_id != self._journal_id:
+            return True, []
+        self._journal_id = journal_id
+        size = os.path.getsize(self.journal_file)
+        if size < self._offset:
+            return True, []
+        if size == self._offset:
+            return False, []
+        records, self._offset = _read_journal(self.journal_file, self._offset)
+        self._pending += len(records)
+        return False, records
+
+    def append(self, record: Dict):
+        """追加一条变更记录（调用方需持有 owner._lock）"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._journal_lock:
+            if self._handle is None or not self._handle_is_current():
+                self._open_journal()
+            # 先补放其他 worker 在我们上次读写之后追加的记录，保证 _offset 始终指向已处理的位置
+            self._catch_up()
+            self._handle.write(line)
+            self._handle.flush()
+            if self.fsync:
+                os.fsync(self._handle.fileno())
+            self._offset = self._handle.tell()
+        self._pending += 1
+
+        if self._pending >= self.compact_threshold:
+            self.compact_in_background()
+
+    def compact_in_background(self):
+        """在后台线程中压缩日志"""
+        if self._compacting:
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name='session-journal-compactor', daemon=True).start()
+
+    def compact(self):
+        """把当前内存状态写成新快照，并丢弃已被快照覆盖的日志
+
+        其他进程正在压缩时直接返回：它的快照同样包含轮转前的全部记录。
+        快照或日志在上次读取之后已被其他进程替换时也直接返回：内存中可能缺少被轮转走的记录，
+        不能用它覆盖快照，等下一次 poll 重新加载之后再压缩。
+        两种情况下都把待压缩计数清零，否则之后的每次追加都会再启动一个压缩线程。
+        """
+        self._compacting = True
+        locked = False
+        try:
+            with self.owner._lock:
+                self._pending = 0
+                locked = self._snapshot_lock.acquire(blocking=False)
+                if not locked:
+                    return
+                with self._journal_lock:
+                    if self._replaced_since_read():
+                        return
+                    # 其他实例（或其他进程）可能也在向同一份日志追加，先把它们的记录读进来
+                    self._catch_up()
+                    payload = self.owner._dump_sessions()
+                    self._rotate_journal()
+
+            # 序列化完成后，耗时的写盘在 owner._lock 外进行（仍持有快照锁）
+            _write_snapshot(self.sessions_file, payload)
+            self._snapshot_signature = _file_signature(self.sessions_file)
+            if os.path.exists(self.rotated_file):
+                os.remove(self.rotated_file)
+        except Exception as e:
+            print(f"[SessionService]: 压缩会话日志失败: {str(e)}")
+        finally:
+            if locked:
+                self._snapshot_lock.release()
+            self._compacting = False
+
+    def close(self):
+        """关闭日志文件句柄"""
+        with self.owner._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+    def _catch_up(self):
+        records, self._offset = _read_journal(self.journal_file, self._offset)
+        for record in records:
+            self.owner._apply_record(record)
+
+    def _replaced_since_read(self) -> bool:
+        """快照被改写、或日志在上次读取之后被其他实例轮转走"""
+        if _file_signature(self.sessions_file) != self._snapshot_signature:
+            return True
+        return self._journal_id is not None and _file_id(self.journal_file) != self._journal_id
+
+    def _open_journal(self):
+        if self._handle is not None:
+            self._handle.close()
+        self._handle = open(self.journal_file, 'a', encoding='utf-8')
+        journal_id = _file_id(self.journal_file)
+        if journal_id != self._journal_id:
+            # 日志已被其他实例轮转（或是新建的），_offset 对应的是旧文件，新文件里的记录要从头读起
+            self._offset = 0
+        self._journal_id = journal_id
+
+    def _handle_is_current(self) -> bool:
+        """检查打开的句柄是否仍指向 journal_file（可能已被其他实例轮转走）"""
+        try:
+            return os.path.samestat(os.fstat(self._handle.fileno()), os.stat(self.journal_file))
+        except OSError:
+            return False
+
+    def _rotate_journal(self):
+        """把当前日志轮转到 rotated_file，之后的追加写入新文件"""
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        if not os.path.exists(self.journal_file):
+            return
+        if os.path.exists(self.rotated_file):
+            # 上一次压缩失败留下的轮转文件还没被快照覆盖，接在它后面
+            with open(self.journal_file, 'rb') as src, open(self.rotated_file, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.journal_file)
+        else:
+            os.replace(self.journal_file, self.rotated_file)
+        self._offset = 0
+        self._journal_id = None
+
+
+class SqliteSessionStore(SessionStore):
+    """SQLite 存储：sessions / messages 两张表，每条变更记录对应一个小事务
+
+    数据库默认位于 sessions.json 同目录下的 sessions.db；首次打开时若存在旧的
+    sessions.json（及未压缩的日志），会一次性迁移进来。
+    """
+
+    lazy = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            character_id TEXT,
+            user_token TEXT,
+            created_at TEXT NOT NULL,
+            last_activity TEXT NOT NULL,
+            context_summary TEXT NOT NULL DEFAULT '',
+            summary_until TEXT,
+            last_message_id INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+            message_id INTEGER,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            character_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id, last_activity);
+        CREATE INDEX IF NOT EXISTS idx_sessions_character ON sessions(character_id, last_activity);
+        CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity);
+        CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+        CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp, session_id);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, sessions_file: str, owner, db_file: str = None):
+        self.sessions_file = sessions_file
+        self.db_file = db_file or os.path.splitext(sessions_file)[0] + '.db'
+        self.owner = owner
+        self._conn = None
+        self._data_version = None
+
+    def load(self) -> Tuple[Dict[str, Dict], List[Dict]]:
+        """只加载会话元数据和消息数，消息内容留在磁盘上"""
+        conn = self._connect()
+        if self._needs_migration():
+            migrate_json_to_sqlite(self.sessions_file, self)
+
+        sessions = {}
+        # 消息数单独按 idx_messages_session 聚合，比与 sessions 表 JOIN 后再 GROUP BY 快得多
+        counts = dict(conn.execute("SELECT session_id, COUNT(*) FROM messages GROUP BY session_id"))
+        rows = conn.execute(
+            """SELECT session_id, user_id, character_id, user_token, created_at,
+                      last_activity, context_summary, summary_until, last_message_id
+               FROM sessions"""
+        )
+        for (session_id, user_id, character_id, user_token, created_at,
+             last_activity, context_summary, summary_until, last_message_id) in rows:
+            sessions[session_id] = {
+                'session_id': session_id,
+                'character_id': character_id,
+                'user_id': user_id,
+                'user_token': user_token,
+                'created_at': created_at,
+                'last_activity': last_activity,
+                'context_summary': context_summary,
+                'summary_until': summary_until,
+                'last_message_id': last_message_id,
+                'message_count': counts.get(session_id, 0)
+            }
+        self._data_version = self._read_data_version()
+        return sessions, []
+
+    def poll(self) -> Tuple[bool, List[Dict]]:
+        """data_version 只在其他连接提交后变化，变化时整体重新加载（只涉及元数据）"""
+        if self._conn is None:
+            return True, []
+        return self._read_data_version() != self._data_version, []
+
+    def load_messages(self, session_id: str) -> List[Dict]:
+        rows = self._connect().execute(
+            "SELECT message_id, role, content, timestamp, character_id FROM messages WHERE session_id = ? ORDER BY id",
+            (session_id,)
+        )
+        return [{'id': message_id, 'role': role, 'content': content, 'timestamp': timestamp, 'character_id': character_id}
+                for message_id, role, content, timestamp, character_id in rows]
+
+    def count_messages_since(self, since: float) -> Dict[str, int]:
+        # 时间戳是本地时间的 ISO 字符串，按字符串比较即按时间比较；只扫描 idx_messages_timestamp
+        rows = self._connect().execute(
+            "SELECT session_id, COUNT(*) FROM messages WHERE timestamp >= ? GROUP BY session_id", (to_iso(since),)
+        )
+        return dict(rows)
+
+    def append(self, record: Dict):
+        """把一条变更记录写成一个事务"""
+        conn = self._connect()
+        op = record.get('op')
+        with conn:
+            if op == 'create':
+                self._insert_sessions(conn, [record['session']])
+            elif op == 'add_message':
+                session_id = record['session_id']
+                message = record['message']
+                self._insert_messages(conn, session_id, [message])
+                conn.execute(
+                    "UPDATE sessions SET last_activity = ?, last_message_id = MAX(last_message_id, ?) WHERE session_id = ?",
+                    (message['timestamp'], message.get('id') or 0, session_id)
+                )
+                self._trim_messages(conn, session_id)
+            elif op == 'clear':
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (record['session_id'],))
+                conn.execute(
+                    "UPDATE sessions SET last_activity = ?, context_summary = '', summary_until = NULL WHERE session_id = ?",
+                    (record['timestamp'], record['session_id'])
+                )
+            elif op == 'summary':
+                conn.execute("UPDATE sessions SET context_summary = ?, summary_until = ? WHERE session_id = ?",
+                             (record['context_summary'], record['summary_until'], record['session_id']))
+            elif op == 'delete':
+                conn.executemany("DELETE FROM sessions WHERE session_id = ?",
+                                 [(session_id,) for session_id in record['session_ids']])
+            else:
+                raise ValueError(f"未知的会话变更记录: {op}")
+
+    def compact(self):
+        """把 WAL 中的内容合并回主数据库文件"""
+        self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.owner._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def import_sessions(self, sessions: Dict[str, Dict]):
+        """批量写入完整的会话（含消息），已存在的会话保持不变"""
+        conn = self._connect()
+        with conn:
+            self._insert_sessions(conn, sessions.values())
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # 所有访问都在 owner._lock 内进行，允许跨线程共享连接
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(self.SCHEMA)
+            self._upgrade_schema(conn)
+            self._conn = conn
+        return self._conn
+
+    def _upgrade_schema(self, conn: sqlite3.Connection):
+        """给旧版本创建的数据库补上后来新增的列"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        with conn:
+            if 'summary_until' not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN summary_until TEXT")
+            if 'last_message_id' not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN last_message_id INTEGER NOT NULL DEFAULT 0")
+            if 'message_id' not in {row[1] for row in conn.execute("PRAGMA table_info(messages)")}:
+                # 给已有消息按会话内顺序补上消息ID
+                conn.execute("ALTER TABLE messages ADD COLUMN message_id INTEGER")
+                conn.execute("""UPDATE messages SET message_id = (
+                                    SELECT COUNT(*) FROM messages m2
+                                    WHERE m2.session_id = messages.session_id AND m2.id <= messages.id)""")
+                conn.execute("""UPDATE sessions SET last_message_id = COALESCE(
+                                    (SELECT MAX(message_id) FROM messages m WHERE m.session_id = sessions.session_id), 0)""")
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _needs_migration(self) -> bool:
+        if not os.path.exists(self.sessions_file):
+            return False
+        migrated = self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone()
+        return migrated is None
+
+    def _insert_sessions(self, conn: sqlite3.Connection, sessions):
+        for session in sessions:
+            cursor = conn.execute(
+                """INSERT OR IGNORE INTO sessions
+                   (session_id, user_id, character_id, user_token, created_at, last_activity,
+                    context_summary, summary_until, last_message_id)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (session['session_id'], session.get('user_id'), session.get('character_id'),
+                 session.get('user_token'), session['created_at'], session['last_activity'],
+                 session.get('context_summary', ''), session.get('summary_until'),
+                 session.get('last_message_id') or 0)
+            )
+            if cursor.rowcount:
+                self._insert_messages(conn, session['session_id'], session.get('messages', []))
+
+    def _insert_messages(self, conn: sqlite3.Connection, session_id: str, messages: List[Dict]):
+        conn.executemany(
+            "INSERT INTO messages (session_id, message_id, role, content, timestamp, character_id) VALUES (?, ?, ?, ?, ?, ?)",
+            [(session_id, msg.get('id'), msg['role'], msg['content'], msg['timestamp'], msg.get('character_id'))
+             for msg in messages]
+        )
+
+    def _trim_messages(self, conn: sqlite3.Connection, session_id: str):
+        """与内存中的截断规则一致：超过上限时保留系统消息和最新的对话消息"""
+        limit = self.owner.retention_limit(session_id)
+        total, system_count = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(role = 'system'), 0) FROM messages WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+        if total <= limit:
+            return
+        conn.execute(
+            """DELETE FROM messages WHERE session_id = ? AND role IN ('user', 'assistant') AND id NOT IN (
+                   SELECT id FROM messages WHERE session_id = ? AND role IN ('user', 'assistant')
+                   ORDER BY id DESC LIMIT ?)""",
+            (session_id, session_id, max(limit - system_count, 0))
+        )
+
+
+def migrate_json_to_sqlite(sessions_file: str, target: Optional[SqliteSessionStore] = None) -> int:
+    """把 sessions.json（及未压缩的追加日志）一次性迁移进 SQLite，返回迁移的会话数
+
+    旧文件保持原样作为备份；迁移完成后在 meta 表中记录来源，之后不再重复迁移。
+    """
+    # 借助日志模式的 SessionService 完成快照加载和日志回放
+    from services.session_service import SessionService
+
+    source = SessionService(sessions_file, persistence='journal')
+    try:
+        store = target or SqliteSessionStore(sessions_file, source)
+        store.import_sessions(json.loads(source._dump_sessions()))
+        with store._conn:
+            store._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)",
+                                (os.path.abspath(sessions_file),))
+        if target is None:
+            store.close()
+    finally:
+        source.store.close()
+    print(f"[SessionService]: 已将 {len(source.sessions)} 个会话从 {sessions_file} 迁移到 SQLite")
+    return len(source.sessions)
+
+
+def create_session_store(mode: str, sessions_file: str, owner, **options):
+    """根据持久化模式创建会话存储"""
+    if mode == 'sqlite':
+        return SqliteSessionStore(sessions_file, owner, **options)
+    if mode == 'journal':
+        return JournalSessionStore(sessions_file, owner, **options)
+    if mode == 'snapshot':
+        return SnapshotSessionStore(sessions_file, owner)
+    raise ValueError(f"未知的会话持久化模式: {mode}")
+
+
+def _file_signature(path: str):
+    """文件的 (mtime, size)，文件不存在时为 None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _record_session_ids(record: Dict) -> List[str]:
+    """变更记录涉及的会话ID"""
+    if record.get('op') == 'create':
+        return [record['session']['session_id']]
+    if 'session_ids' in record:
+        return list(record['session_ids'])
+    return [record['session_id']]
+
+
+def _file_id(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def _read_snapshot(path: str) -> Dict[str, Dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_snapshot(path: str, payload: str):
+    """先写临时文件再原子替换，避免写到一半的快照"""
+    atomic_write(path, payload)
+
+
+def _read_journal(path: str, offset: int = 0) -> Tuple[List[Dict], int]:
+    """从 offset 开始读取日志记录，返回记录列表和读到的位置
+
+    进程崩溃可能留下写了一半的最后一行，遇到无法解析的行即停止。
+    """
+    if not os.path.exists(path):
+        return [], 0
+    records = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(raw.decode('utf-8')))
+            except (ValueError, UnicodeDecodeError):
+                break
+            offset += len(raw)
+    return records, offset
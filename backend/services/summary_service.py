@@ -0,0 +1,38 @@
+"""
+对话滚动摘要
+
+会话中未摘要的对话过多时，SessionService 把较早的轮次连同已有摘要交给这里，
+用一个便宜的模型生成新的摘要，写回会话的 context_summary。调用发生在后台线程中，
+不占用请求路径。
+"""
+import datetime
+from typing import List, Optional
+from config import Config
+from services.session_message import Message
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你是对话记录整理助手。请把已有摘要和新的对话内容合并成一段新的摘要，"
+    "保留用户的身份信息、偏好、重要事件、双方的约定以及尚未结束的话题，"
+    "省略寒暄和重复内容。只输出摘要正文，不超过300字。"
+)
+
+
+def summarize_conversation(previous_summary: str, messages: List[Message], model: str = None) -> Optional[str]:
+    """把已有摘要和新的对话合并成新的摘要，失败时返回 None"""
+    from routes.ai_service import get_ai_service
+
+    current_time = datetime.datetime.now().strftime('%Y%m%d/%H:%M')
+    model = model or Config.SESSION_SUMMARY_MODEL
+    role_names = {'user': '用户', 'assistant': '角色'}
+    transcript = "\n".join(f"{role_names.get(msg.role, msg.role)}：{msg.content}" for msg in messages)
+    prompt = f"已有摘要：\n{previous_summary or '（无）'}\n\n新的对话：\n{transcript}"
+
+    result = get_ai_service().chat_completion(
+        [{"role": "system", "content": SUMMARY_SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+        model, max_tokens=Config.SESSION_SUMMARY_MAX_TOKENS
+    )
+    if not result:
+        print(f"[{current_time}--{model}-summarize_conversation-[Error]: 生成对话摘要失败")
+        return None
+    content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
+    return content.strip() or None
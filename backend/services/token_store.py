@@ -0,0 +1,247 @@
+"""
+登录令牌存储
+
+登录令牌原来保存在 users.json 的 user_sessions 中：每次登录、登出都要重写整个用户库，
+令牌也从不过期。这里把令牌移到单独的 tokens.jsonl：签发、续期、吊销都以 JSON Lines
+追加写入，启动时回放；失效记录过多时重写文件，只保留有效令牌。
+
+令牌签发后 ttl 秒过期；在有效期内被使用时滑动续期，同一令牌至少间隔 renew_interval 秒
+才追加一条续期记录。过期令牌在访问时顺带按 purge_interval 定期清理，不需要写记录
+（过期时间本身就在文件里）。多个 worker 共享文件时，追加和重写都在文件锁内进行，
+查找前先补放其他 worker 追加的记录。
+"""
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from services.file_lock import file_lock
+from services.write_behind import atomic_write
+
+
+class TokenStore:
+    """令牌 -> 用户ID，带过期时间和滑动续期"""
+
+    def __init__(self, path: str, ttl: float, renew_interval: float, purge_interval: float = 60):
+        self.path = path
+        self.ttl = ttl
+        self.renew_interval = min(renew_interval, ttl)
+        self.purge_interval = purge_interval
+        self.file_lock = file_lock(path)
+
+        self._lock = threading.RLock()
+        self._tokens: Dict[str, List] = {}  # token -> [user_id, 过期时间戳]
+        self._by_user: Dict[str, set] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []  # (过期时间戳, token)，续期后旧条目在弹出时跳过
+        self._offset = 0
+        self._file_id = None
+        self._dead_records = 0  # 文件中已失效的记录数，过多时重写文件
+        self._last_purge = 0.0
+        self._stats = {'issued': 0, 'renewed': 0, 'revoked': 0, 'expired': 0, 'rewrites': 0}
+        with self._lock, self.file_lock.shared():
+            self._load()
+
+    # ---- 文件 ----
+
+    def _load(self):
+        self._tokens = {}
+        self._by_user = {}
+        self._expiry_heap = []
+        self._offset = 0
+        self._dead_records = 0
+        self._file_id = _file_id(self.path)
+        self._replay()
+
+    def _replay(self):
+        """从 _offset 开始回放记录（包括其他 worker 追加的记录）"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(raw.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    break
+                self._offset += len(raw)
+                self._apply(record)
+
+    def _apply(self, record: Dict):
+        op = record.get('op')
+        if op == 'issue':
+            if self._drop(record['token']):
+                self._dead_records += 1
+            self._tokens[record['token']] = [record['user_id'], record['expires_at']]
+            self._by_user.setdefault(record['user_id'], set()).add(record['token'])
+            heapq.heappush(self._expiry_heap, (record['expires_at'], record['token']))
+        elif op == 'renew':
+            entry = self._tokens.get(record['token'])
+            if entry is not None:
+                entry[1] = record['expires_at']
+                heapq.heappush(self._expiry_heap, (record['expires_at'], record['token']))
+            self._dead_records += 1
+        elif op == 'revoke':
+            for token in record['tokens']:
+                if self._drop(token):
+                    self._dead_records += 1
+            self._dead_records += 1
+
+    def _drop(self, token: str) -> bool:
+        entry = self._tokens.pop(token, None)
+        if entry is None:
+            return False
+        bucket = self._by_user.get(entry[0])
+        if bucket is not None:
+            bucket.discard(token)
+            if not bucket:
+                del self._by_user[entry[0]]
+        return True
+
+    def refresh(self):
+        """读入其他 worker 追加的记录；文件被重写过时整体重新加载"""
+        with self._lock:
+            file_id = _file_id(self.path)
+            if file_id != self._file_id or (file_id is not None and os.path.getsize(self.path) < self._offset):
+                with self.file_lock.shared():
+                    self._load()
+            elif file_id is not None and os.path.getsize(self.path) > self._offset:
+                self._replay()
+
+    def _append(self, records: List[Dict]):
+        """在文件锁内追加记录：先补放其他 worker 的记录，再通过回放应用自己写入的记录"""
+        with self._lock, self.file_lock:
+            self.refresh()
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+            if self._file_id is None:
+                self._file_id = _file_id(self.path)
+            self._replay()
+            if self._dead_records > max(len(self._tokens), 1000):
+                self._rewrite()
+
+    def _rewrite(self):
+        """只保留有效令牌，重写文件（调用方需持有 _lock 和文件锁）"""
+        now = time.time()
+        payload = ''.join(
+            json.dumps({'op': 'issue', 'token': token, 'user_id': user_id, 'expires_at': expires_at},
+                       ensure_ascii=False) + '\n'
+            for token, (user_id, expires_at) in self._tokens.items() if expires_at > now
+        )
+        atomic_write(self.path, payload)
+        self._stats['rewrites'] += 1
+        self._load()
+
+    # ---- 对外接口 ----
+
+    def issue(self, user_id: str, token: str = None) -> str:
+        """签发令牌"""
+        token = token or str(uuid.uuid4())
+        self._append([{'op': 'issue', 'token': token, 'user_id': user_id,
+                       'expires_at': time.time() + self.ttl}])
+        self._stats['issued'] += 1
+        return token
+
+    def resolve(self, token: Optional[str], renew: bool = True) -> Optional[str]:
+        """令牌对应的用户ID，无效或已过期时返回 None；renew 为 True 时滑动续期"""
+        if not token:
+            return None
+        with self._lock:
+            self.refresh()
+            now = time.time()
+            self._maybe_purge(now)
+            entry = self._tokens.get(token)
+            if entry is None or entry[1] <= now:
+                return None
+            user_id, expires_at = entry
+            if renew and now - (expires_at - self.ttl) >= self.renew_interval:
+                self._append([{'op': 'renew', 'token': token, 'expires_at': now + self.ttl}])
+                self._stats['renewed'] += 1
+            return user_id
+
+    def revoke(self, token: str) -> bool:
+        """吊销令牌（登出）"""
+        with self._lock:
+            self.refresh()
+            if token not in self._tokens:
+                return False
+            self._append([{'op': 'revoke', 'tokens': [token]}])
+            self._stats['revoked'] += 1
+            return True
+
+    def revoke_user(self, user_id: str) -> int:
+        """吊销用户的全部令牌（删除用户时）"""
+        with self._lock:
+            self.refresh()
+            tokens = sorted(self._by_user.get(user_id, ()))
+            if tokens:
+                self._append([{'op': 'revoke', 'tokens': tokens}])
+                self._stats['revoked'] += len(tokens)
+            return len(tokens)
+
+    def import_tokens(self, tokens: Dict[str, str]) -> int:
+        """导入旧版 users.json 中的 user_sessions（token -> user_id），有效期从现在算起"""
+        with self._lock:
+            self.refresh()
+            expires_at = time.time() + self.ttl
+            records = [{'op': 'issue', 'token': token, 'user_id': user_id, 'expires_at': expires_at}
+                       for token, user_id in tokens.items() if token not in self._tokens]
+            if records:
+                self._append(records)
+            return len(records)
+
+    def _maybe_purge(self, now: float):
+        if now - self._last_purge >= self.purge_interval:
+            self.purge_expired(now)
+
+    def purge_expired(self, now: float = None) -> int:
+        """从内存中删除已过期的令牌；文件中的记录在下次重写时丢弃"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._last_purge = now
+            purged = 0
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, token = heapq.heappop(self._expiry_heap)
+                entry = self._tokens.get(token)
+                # 续期过的令牌以最新的过期时间为准
+                if entry is not None and entry[1] == expires_at and self._drop(token):
+                    self._dead_records += 1
+                    purged += 1
+            self._stats['expired'] += purged
+            return purged
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._tokens)
+
+    def get_stats(self) -> Dict:
+        """令牌统计：有效令牌数、签发 / 续期 / 吊销 / 过期数以及文件大小"""
+        with self._lock:
+            return dict(self._stats, active=len(self._tokens), users=len(self._by_user),
+                        file_bytes=self._offset, ttl=self.ttl)
+
+
+_stores: Dict[str, TokenStore] = {}
+_stores_lock = threading.Lock()
+
+
+def token_store(path: str, ttl: float, renew_interval: float) -> TokenStore:
+    """获取进程内按路径共享的令牌存储"""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = TokenStore(path, ttl, renew_interval)
+        return store
+
+
+def _file_id(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
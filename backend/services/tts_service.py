@@ -7,6 +7,7 @@ import logging
 import re
 from typing import Optional, Dict, Any
 from config import Config
+from services.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -237,11 +238,10 @@ class TTSService:
             logger.info(f"请求头: {headers}")
             logger.info(f"请求体: {json.dumps(payload, ensure_ascii=False)}")
             
-            response = requests.post(
+            response = get_http_client().post(
                 self.tts_url,
                 headers=headers,
-                data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
-                timeout=30
+                data=json.dumps(payload, ensure_ascii=False).encode("utf-8")
             )
             
             logger.info(f"TTS API响应状态码: {response.status_code}")
@@ -2,45 +2,261 @@
 用户管理服务
 """
 import uuid
+import bisect
 import hashlib
 import datetime
-import json
 import os
-from typing import Dict, List, Any, Optional
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+from config import Config
+from services.avatar_store import AvatarStore
+from services.intimacy_service import intimacy_counters
+from services.token_store import token_store
+from services.user_store import user_store
+
+
+class UserIndex:
+    """用户数据的哈希索引：id -> username、email -> user_id
+
+    按数据文件在进程内共享（多个 UserService 实例操作的是同一份内存视图），
+    本进程的修改由 UserService 增量维护；视图被整体替换或同步进其他 worker 的修改时
+    （UserStore.version 变化）整体重建。
+    """
 
-class UserService:
     def __init__(self):
-        self.users: Dict[str, Dict[str, Any]] = {}
-        self.user_sessions: Dict[str, str] = {}  # session_token -> user_id
-        self.data_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'users.json')
-        self.load_users()
-        self.ensure_admin_user()  # 确保管理员账户存在
+        self.by_id: Dict[str, str] = {}
+        self.by_email: Dict[str, str] = {}
+        self.version = None
+        self.sorted = UserSortIndex()
+
+    def rebuild(self, users: Dict[str, Dict[str, Any]], version: int):
+        by_id, by_email = {}, {}
+        for username, user_data in users.items():
+            by_id[user_data['id']] = username
+            if user_data.get('email'):
+                by_email[user_data['email']] = user_data['id']
+        self.by_id, self.by_email = by_id, by_email
+        self.version = version
+
+    def add(self, username: str, user_data: Dict[str, Any]):
+        self.by_id[user_data['id']] = username
+        if user_data.get('email'):
+            self.by_email[user_data['email']] = user_data['id']
+
+    def remove(self, user_data: Dict[str, Any]):
+        self.by_id.pop(user_data['id'], None)
+        self.set_email(user_data['id'], user_data.get('email'), None)
+
+    def set_email(self, user_id: str, old_email: Optional[str], new_email: Optional[str]):
+        if old_email and self.by_email.get(old_email) == user_id:
+            del self.by_email[old_email]
+        if new_email:
+            self.by_email[new_email] = user_id
+
+
+class UserSortIndex:
+    """管理员用户列表的有序索引：按注册时间、最后登录时间、对话数排序，按用户名 / 昵称前缀筛选
+
+    每个排序字段维护一个有序的 [(键, username)] 列表，翻页直接切片；前缀筛选在按小写
+    用户名 / 昵称排序的列表上二分查找出连续区间。只在第一次查询时建立，之后由
+    UserService 在每次保存用户时增量更新；UserStore.version 变化时下一次查询重新建立。
+    """
+
+    SORT_FIELDS = ('created_at', 'last_login', 'chat_count')
+
+    def __init__(self):
+        self.version = None
+        self._keys: Dict[str, Tuple] = {}  # username -> 各排序键及小写的用户名、昵称
+        self._lists: Dict[str, List[Tuple[Any, str]]] = {}
+        self._names: List[Tuple[str, str]] = []  # (小写的用户名或昵称, username)
+
+    @staticmethod
+    def _user_keys(username: str, user_data: Dict[str, Any]) -> Tuple:
+        return (user_data.get('created_at') or '',
+                user_data.get('last_login') or '',
+                len(user_data.get('chat_history') or {}),
+                username.lower(),
+                (user_data.get('nickname') or username).lower())
+
+    def rebuild(self, users: Dict[str, Dict[str, Any]], version: int):
+        self._keys = {username: self._user_keys(username, user_data) for username, user_data in users.items()}
+        self._lists = {
+            field: sorted((keys[i], username) for username, keys in self._keys.items())
+            for i, field in enumerate(self.SORT_FIELDS)
+        }
+        names = set()
+        for username, keys in self._keys.items():
+            names.add((keys[3], username))
+            names.add((keys[4], username))
+        self._names = sorted(names)
+        self.version = version
+
+    def update(self, username: str, user_data: Optional[Dict[str, Any]]):
+        """用户新增、修改或删除（user_data 为 None）后更新各列表"""
+        old = self._keys.pop(username, None)
+        new = self._user_keys(username, user_data) if user_data is not None else None
+        if old == new:
+            if new is not None:
+                self._keys[username] = new
+            return
+        for i, field in enumerate(self.SORT_FIELDS):
+            entries = self._lists.setdefault(field, [])
+            if old is not None:
+                _remove_sorted(entries, (old[i], username))
+            if new is not None:
+                bisect.insort(entries, (new[i], username))
+        old_names = {(old[3], username), (old[4], username)} if old is not None else set()
+        new_names = {(new[3], username), (new[4], username)} if new is not None else set()
+        for entry in old_names - new_names:
+            _remove_sorted(self._names, entry)
+        for entry in new_names - old_names:
+            bisect.insort(self._names, entry)
+        if new is not None:
+            self._keys[username] = new
+
+    def query(self, sort: str, descending: bool, offset: int, limit: int,
+              prefix: str = None) -> Tuple[List[str], int]:
+        """返回 (当前页的 username 列表, 符合条件的总数)"""
+        field = sort if sort in self.SORT_FIELDS else self.SORT_FIELDS[0]
+        if not prefix:
+            entries = self._lists.get(field, [])
+            total = len(entries)
+            if descending:
+                start = max(total - offset - limit, 0)
+                page = entries[start:max(total - offset, 0)][::-1]
+            else:
+                page = entries[offset:offset + limit]
+            return [username for _, username in page], total
+
+        prefix = prefix.lower()
+        lo = bisect.bisect_left(self._names, (prefix,))
+        hi = bisect.bisect_left(self._names, (prefix + '\uffff',))
+        matched = {username for _, username in self._names[lo:hi]}
+        index = self.SORT_FIELDS.index(field)
+        ordered = sorted(matched, key=lambda username: (self._keys[username][index], username), reverse=descending)
+        return ordered[offset:offset + limit], len(ordered)
+
+
+def _remove_sorted(entries: List[Tuple], entry: Tuple):
+    i = bisect.bisect_left(entries, entry)
+    if i < len(entries) and entries[i] == entry:
+        del entries[i]
+
+
+_indexes: Dict[str, UserIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _user_index(path: str) -> UserIndex:
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = UserIndex()
+        return _indexes[path]
+
+
+# 已完成旧数据迁移和管理员账户检查的用户文件：同一个文件只在第一次创建 UserService 时处理
+_prepared_files = set()
+_prepared_lock = threading.Lock()
+
+
+class UserService:
+    def __init__(self, data_file: str = None):
+        self.data_file = data_file or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'users.json')
+        # 用户数据按用户登记修改，sqlite 模式下只写被修改的用户（见 services/user_store.py）
+        self.store = user_store(self.data_file)
+        self.index = _user_index(self.data_file)
+        # 登录令牌单独保存，登录 / 登出不再重写 users.json
+        tokens_file = Config.USER_TOKEN_FILE or os.path.join(os.path.dirname(self.data_file), 'tokens.jsonl')
+        self.tokens = token_store(tokens_file, Config.USER_TOKEN_TTL, Config.USER_TOKEN_RENEW_INTERVAL)
+        # 头像按内容哈希保存成文件，用户记录里只保存 URL
+        self.avatars = AvatarStore(Config.AVATAR_STORE_DIR or os.path.join(os.path.dirname(self.data_file), 'avatars'))
+        # 迁移要扫描全部用户，每个文件只做一次；其他线程同时创建时等它完成
+        with _prepared_lock:
+            path = os.path.abspath(self.data_file)
+            if path not in _prepared_files:
+                self.load_users()
+                self.ensure_admin_user()  # 确保管理员账户存在
+                _prepared_files.add(path)
+
+    @property
+    def users(self) -> Dict[str, Dict[str, Any]]:
+        """username -> 用户数据"""
+        # 存储的内存字典；其他 worker 写入过时，读取前会先把它们的修改同步进来
+        return self.store.read()
 
     def load_users(self):
         """从文件加载用户数据"""
         try:
-            if os.path.exists(self.data_file):
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.users = data.get('users', {})
-                    self.user_sessions = data.get('user_sessions', {})
+            users = self.users
+            # 旧版把登录令牌保存在 users.json 的 user_sessions 中，迁移到令牌存储
+            legacy_tokens = self.store.pop_legacy('user_sessions')
+            if legacy_tokens is not None:
+                imported = self.tokens.import_tokens(legacy_tokens)
+                print(f"已迁移 {imported} 个登录令牌到 {self.tokens.path}")
+            # 旧版把头像以 data URL 保存在用户记录里，提取成文件
+            migrated = self.avatars.migrate_users(users)
+            for username in migrated:
+                self.save_users(username)
+            if migrated:
+                print(f"已迁移 {len(migrated)} 个用户头像到 {self.avatars.directory}")
         except Exception as e:
             print(f"加载用户数据失败: {str(e)}")
-            self.users = {}
-            self.user_sessions = {}
 
-    def save_users(self):
-        """保存用户数据到文件"""
+    def save_users(self, username: str = None):
+        """登记对一个用户的修改（合并写入，窗口结束时由后台写盘）；不指定用户时保存全部用户"""
         try:
-            data = {
-                'users': self.users,
-                'user_sessions': self.user_sessions
-            }
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            for name in ([username] if username is not None else list(self.users)):
+                self.store.mark_dirty(name)
+                if self.index.sorted.version == self.store.version:
+                    self.index.sorted.update(name, self.users.get(name))
         except Exception as e:
             print(f"保存用户数据失败: {str(e)}")
 
+    def _ensure_index(self):
+        """索引落后于内存视图时整体重建"""
+        users = self.users  # 读取时可能同步进其他 worker 的修改
+        if self.index.version != self.store.version:
+            self.index.rebuild(users, self.store.version)
+
+    def _find_user(self, user_id: Optional[str]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """按用户ID查找，返回 (username, 用户数据)，不存在时为 (None, None)"""
+        if user_id is None:
+            return None, None
+        self._ensure_index()
+        username = self.index.by_id.get(user_id)
+        if username is None:
+            return None, None
+        user_data = self.users.get(username)
+        if user_data is None or user_data.get('id') != user_id:
+            # 索引与数据不一致（数据被绕过 UserService 修改过），重建后再查一次
+            self.index.rebuild(self.users, self.store.version)
+            username = self.index.by_id.get(user_id)
+            if username is None:
+                return None, None
+            user_data = self.users[username]
+        return username, user_data
+
+    def _find_user_by_token(self, token: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """按会话令牌查找，返回 (username, 用户数据)"""
+        return self._find_user(self.tokens.resolve(token))
+
+    def _find_email_owner(self, email: str) -> Optional[str]:
+        """使用该邮箱的用户ID"""
+        self._ensure_index()
+        user_id = self.index.by_email.get(email)
+        user_data = self._find_user(user_id)[1]
+        if user_id is not None and (user_data is None or user_data.get('email') != email):
+            self.index.rebuild(self.users, self.store.version)
+            user_id = self.index.by_email.get(email)
+        return user_id
+
+    def _add_user(self, username: str, user_data: Dict[str, Any]):
+        self._ensure_index()
+        self.users[username] = user_data
+        self.index.add(username, user_data)
+        self.save_users(username)
+
     def _hash_password(self, password: str) -> str:
         """密码哈希"""
         return hashlib.sha256(password.encode()).hexdigest()
@@ -57,7 +273,7 @@ class UserService:
         if admin_username not in self.users:
             # 创建管理员账户
             user_id = str(uuid.uuid4())
-            self.users[admin_username] = {
+            self._add_user(admin_username, {
                 'id': user_id,
                 'username': admin_username,
                 'password': self._hash_password(admin_password),
@@ -74,8 +290,7 @@ class UserService:
                     'auto_play_voice': False
                 },
                 'intimacy': {}
-            }
-            self.save_users()
+            })
             print(f"管理员账户已创建: {admin_username}")
         
         # 确保测试用户存在
@@ -85,7 +300,7 @@ class UserService:
         if test_username not in self.users:
             # 创建测试用户
             user_id = str(uuid.uuid4())
-            self.users[test_username] = {
+            self._add_user(test_username, {
                 'id': user_id,
                 'username': test_username,
                 'password': self._hash_password(test_password),
@@ -102,28 +317,44 @@ class UserService:
                     'auto_play_voice': False
                 },
                 'intimacy': {}
-            }
-            self.save_users()
+            })
             print(f"测试用户已创建: {test_username}")
 
     def is_admin_user(self, token: str) -> bool:
         """检查用户是否为管理员"""
-        if token not in self.user_sessions:
-            return False
-        
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                return user_data.get('is_admin', False)
-        return False
+        user_data = self._find_user_by_token(token)[1]
+        return user_data.get('is_admin', False) if user_data else False
+
+    def get_user_tier(self, user_id: str) -> Optional[str]:
+        """用户等级（用于会话消息保留等配额），管理员为 admin，其余默认为 standard"""
+        user_data = self._find_user(user_id)[1]
+        if user_data is None:
+            return None
+        return 'admin' if user_data.get('is_admin', False) else user_data.get('tier', 'standard')
 
-    def get_all_users(self, token: str) -> Dict[str, Any]:
-        """获取所有用户（仅管理员）"""
+    def get_all_users(self, token: str, page: int = 1, page_size: int = None, sort: str = 'created_at',
+                      order: str = 'asc', prefix: str = None) -> Dict[str, Any]:
+        """分页获取用户列表（仅管理员）
+
+        sort 可选 created_at / last_login / chat_count，order 为 asc / desc；
+        prefix 按用户名或昵称前缀筛选（不区分大小写）。
+        """
         if not self.is_admin_user(token):
             return {'success': False, 'error': '权限不足'}
-        
+
+        page = max(int(page or 1), 1)
+        page_size = min(max(int(page_size or Config.ADMIN_USER_PAGE_SIZE), 1), Config.ADMIN_USER_PAGE_MAX)
+        if sort not in UserSortIndex.SORT_FIELDS:
+            sort = 'created_at'
+        users = self.users
+        if self.index.sorted.version != self.store.version:
+            self.index.sorted.rebuild(users, self.store.version)
+        usernames, total = self.index.sorted.query(sort, order == 'desc', (page - 1) * page_size, page_size,
+                                                   prefix=(prefix or '').strip())
+
         users_list = []
-        for username, user_data in self.users.items():
+        for username in usernames:
+            user_data = users[username]
             users_list.append({
                 'id': user_data['id'],
                 'username': username,
@@ -132,13 +363,18 @@ class UserService:
                 'avatar': user_data.get('avatar'),
                 'is_admin': user_data.get('is_admin', False),
                 'created_at': user_data.get('created_at'),
+                'last_login': user_data.get('last_login'),
                 'chat_sessions': len(user_data.get('chat_history', {}))
             })
-        
+
         return {
             'success': True,
             'users': users_list,
-            'total': len(users_list)
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            'sort': sort,
+            'order': 'desc' if order == 'desc' else 'asc'
         }
 
     def register_user(self, username: str, password: str, email: str = None, nickname: str = None) -> Dict[str, Any]:
@@ -156,7 +392,7 @@ class UserService:
         avatar_name = nickname if nickname else username
         try:
             from routes.avatar_service import create_user_avatar
-            avatar_data = create_user_avatar(avatar_name)
+            avatar_data = self.avatars.store_data_url(create_user_avatar(avatar_name))
         except Exception as e:
             print(f"生成头像失败: {str(e)}")
             avatar_data = '/user-avatar.svg'  # 默认头像
@@ -181,8 +417,7 @@ class UserService:
             'intimacy': {}  # character_id -> intimacy_value
         }
 
-        self.users[username] = user_data
-        self.save_users()
+        self._add_user(username, user_data)
 
         return {
             'success': True,
@@ -215,12 +450,11 @@ class UserService:
             }
 
         # 生成会话令牌
-        token = self._generate_token()
-        self.user_sessions[token] = user['id']
+        token = self.tokens.issue(user['id'], self._generate_token())
 
         # 更新最后登录时间
         user['last_login'] = datetime.datetime.now().isoformat()
-        self.save_users()
+        self.save_users(username)
 
         return {
             'success': True,
@@ -244,9 +478,7 @@ class UserService:
 
     def logout_user(self, token: str) -> Dict[str, Any]:
         """用户登出"""
-        if token in self.user_sessions:
-            del self.user_sessions[token]
-            self.save_users()
+        if self.tokens.revoke(token):
             return {
                 'success': True,
                 'message': '登出成功'
@@ -258,136 +490,121 @@ class UserService:
 
     def get_user_by_token(self, token: str) -> Optional[Dict[str, Any]]:
         """通过令牌获取用户信息"""
-        if token not in self.user_sessions:
+        user_data = self._find_user_by_token(token)[1]
+        if user_data is None:
             return None
+        return {
+            'id': user_data['id'],
+            'username': user_data['username'],
+            'email': user_data.get('email', ''),
+            'nickname': user_data.get('nickname', user_data['username']),
+            'avatar': user_data.get('avatar'),
+            'is_admin': user_data.get('is_admin', False),
+            'settings': user_data.get('settings', {
+                'theme': 'light',
+                'language': 'zh-CN',
+                'notifications': True,
+                'auto_play_voice': False
+            })
+        }
 
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                return {
-                    'id': user_data['id'],
-                    'username': user_data['username'],
-                    'email': user_data.get('email', ''),
-                    'nickname': user_data.get('nickname', user_data['username']),
-                    'avatar': user_data.get('avatar'),
-                    'is_admin': user_data.get('is_admin', False),
-                    'settings': user_data.get('settings', {
-                        'theme': 'light',
-                        'language': 'zh-CN',
-                        'notifications': True,
-                        'auto_play_voice': False
-                    })
-                }
-        return None
+    def get_public_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """按用户ID获取公开资料（排行榜等展示用），用户不存在时返回 None"""
+        username, user_data = self._find_user(user_id)
+        if user_data is None:
+            return None
+        return {
+            'id': user_id,
+            'username': username,
+            'nickname': user_data.get('nickname', username),
+            'avatar': user_data.get('avatar')
+        }
 
     def get_user_id_by_session(self, token: str) -> Optional[str]:
         """通过会话令牌获取用户ID"""
-        return self.user_sessions.get(token)
+        return self.tokens.resolve(token)
 
     def update_user_settings(self, token: str, settings: Dict[str, Any]) -> Dict[str, Any]:
         """更新用户设置"""
-        user = self.get_user_by_token(token)
-        if not user:
+        username, user_data = self._find_user_by_token(token)
+        if not user_data:
             return {
                 'success': False,
                 'error': '无效的会话令牌'
             }
 
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                user_data['settings'].update(settings)
-                self.save_users()
-                return {
-                    'success': True,
-                    'settings': user_data['settings'],
-                    'message': '设置更新成功'
-                }
-
+        user_data['settings'].update(settings)
+        self.save_users(username)
         return {
-            'success': False,
-            'error': '用户不存在'
+            'success': True,
+            'settings': user_data['settings'],
+            'message': '设置更新成功'
         }
 
     def add_chat_session(self, token: str, character_id: str, session_id: str) -> bool:
         """添加聊天会话到用户历史"""
-        if token not in self.user_sessions:
+        username, user_data = self._find_user_by_token(token)
+        if user_data is None:
             return False
 
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                if character_id not in user_data['chat_history']:
-                    user_data['chat_history'][character_id] = []
-                
-                # 避免重复添加
-                if session_id not in user_data['chat_history'][character_id]:
-                    user_data['chat_history'][character_id].append(session_id)
-                    self.save_users()
-                return True
-        return False
+        if character_id not in user_data['chat_history']:
+            user_data['chat_history'][character_id] = []
+
+        # 避免重复添加
+        if session_id not in user_data['chat_history'][character_id]:
+            user_data['chat_history'][character_id].append(session_id)
+            self.save_users(username)
+        return True
 
     def get_user_chat_sessions(self, token: str, character_id: str) -> List[str]:
         """获取用户与特定角色的聊天会话列表"""
-        if token not in self.user_sessions:
+        user_data = self._find_user_by_token(token)[1]
+        if user_data is None:
             return []
-
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                return user_data['chat_history'].get(character_id, [])
-        return []
+        return user_data['chat_history'].get(character_id, [])
 
     def remove_chat_session(self, token: str, character_id: str, session_id: str) -> bool:
         """从用户历史中移除指定的聊天会话"""
-        if token not in self.user_sessions:
+        username, user_data = self._find_user_by_token(token)
+        if user_data is None:
             return False
 
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                if character_id in user_data['chat_history']:
-                    if session_id in user_data['chat_history'][character_id]:
-                        user_data['chat_history'][character_id].remove(session_id)
-                        # 如果该角色的会话列表为空，删除该角色的记录
-                        if not user_data['chat_history'][character_id]:
-                            del user_data['chat_history'][character_id]
-                        self.save_users()
-                        return True
+        if character_id in user_data['chat_history']:
+            if session_id in user_data['chat_history'][character_id]:
+                user_data['chat_history'][character_id].remove(session_id)
+                # 如果该角色的会话列表为空，删除该角色的记录
+                if not user_data['chat_history'][character_id]:
+                    del user_data['chat_history'][character_id]
+                self.save_users(username)
+                return True
         return False
 
     def clear_all_chat_history(self, token: str) -> bool:
         """清空用户的所有聊天历史"""
-        if token not in self.user_sessions:
+        username, user_data = self._find_user_by_token(token)
+        if user_data is None:
             return False
 
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                user_data['chat_history'] = {}
-                self.save_users()
-                return True
-        return False
+        user_data['chat_history'] = {}
+        self.save_users(username)
+        return True
 
     def update_user_avatar(self, user_id_or_token: str, avatar_url: str) -> Dict[str, Any]:
         """更新用户头像（支持通过user_id或token）"""
-        # 判断是token还是user_id
-        if user_id_or_token in self.user_sessions:
-            # 是token
-            user_id = self.user_sessions[user_id_or_token]
-        else:
-            # 是user_id
-            user_id = user_id_or_token
-
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                user_data['avatar'] = avatar_url
-                self.save_users()
-                return {
-                    'success': True,
-                    'avatar': avatar_url,
-                    'message': '头像更新成功'
-                }
+        # 判断是token还是user_id：能解析成用户ID的是token
+        user_id = self.tokens.resolve(user_id_or_token) or user_id_or_token
+
+        username, user_data = self._find_user(user_id)
+        if user_data is not None:
+            # 上传的 data URL 保存成文件，用户记录里只保存 URL
+            avatar_url = self.avatars.store_data_url(avatar_url)
+            user_data['avatar'] = avatar_url
+            self.save_users(username)
+            return {
+                'success': True,
+                'avatar': avatar_url,
+                'message': '头像更新成功'
+            }
 
         return {
             'success': False,
@@ -396,34 +613,34 @@ class UserService:
 
     def update_user_nickname(self, token: str, nickname: str) -> Dict[str, Any]:
         """更新用户昵称"""
-        if token not in self.user_sessions:
+        user_id = self.tokens.resolve(token)
+        if user_id is None:
             return {
                 'success': False,
                 'error': '无效的会话令牌'
             }
 
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                # 更新昵称
-                old_nickname = user_data.get('nickname', username)
-                user_data['nickname'] = nickname
-                
-                # 重新生成头像（基于新昵称）
-                try:
-                    from routes.avatar_service import create_user_avatar
-                    avatar_data = create_user_avatar(nickname)
-                    user_data['avatar'] = avatar_data
-                except Exception as e:
-                    print(f"重新生成头像失败: {str(e)}")
-                
-                self.save_users()
-                return {
-                    'success': True,
-                    'nickname': nickname,
-                    'avatar': user_data.get('avatar'),
-                    'message': '昵称更新成功'
-                }
+        username, user_data = self._find_user(user_id)
+        if user_data is not None:
+            # 更新昵称
+            old_nickname = user_data.get('nickname', username)
+            user_data['nickname'] = nickname
+
+            # 重新生成头像（基于新昵称）
+            try:
+                from routes.avatar_service import create_user_avatar
+                avatar_data = create_user_avatar(nickname)
+                user_data['avatar'] = self.avatars.store_data_url(avatar_data)
+            except Exception as e:
+                print(f"重新生成头像失败: {str(e)}")
+
+            self.save_users(username)
+            return {
+                'success': True,
+                'nickname': nickname,
+                'avatar': user_data.get('avatar'),
+                'message': '昵称更新成功'
+            }
 
         return {
             'success': False,
@@ -432,84 +649,83 @@ class UserService:
 
     def update_user_email(self, token: str, email: str) -> Dict[str, Any]:
         """更新用户邮箱"""
-        if token not in self.user_sessions:
+        user_id = self.tokens.resolve(token)
+        if user_id is None:
             return {'success': False, 'error': '无效的会话令牌'}
-        
+
         # 检查邮箱是否已被其他用户使用
-        for username, user_data in self.users.items():
-            if user_data.get('email') == email and user_data['id'] != self.user_sessions[token]:
-                return {'success': False, 'error': '该邮箱已被其他用户使用'}
-        
-        user_id = self.user_sessions[token]
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                user_data['email'] = email
-                self.save_users()
-                return {
-                    'success': True,
-                    'email': email,
-                    'message': '邮箱更新成功'
-                }
-                return {'success': False, 'error': '用户不存在'}
+        owner = self._find_email_owner(email)
+        if owner is not None and owner != user_id:
+            return {'success': False, 'error': '该邮箱已被其他用户使用'}
+
+        if self._set_email(user_id, email):
+            return {
+                'success': True,
+                'email': email,
+                'message': '邮箱更新成功'
+            }
+        return {'success': False, 'error': '用户不存在'}
+
+    def _set_email(self, user_id: str, email: str) -> bool:
+        username, user_data = self._find_user(user_id)
+        if user_data is None:
+            return False
+        self.index.set_email(user_id, user_data.get('email'), email)
+        user_data['email'] = email
+        self.save_users(username)
+        return True
 
     def update_user_nickname_by_id(self, user_id: str, nickname: str) -> bool:
         """通过用户ID更新昵称"""
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                user_data['nickname'] = nickname
-                self.save_users()
-                return True
-        return False
+        username, user_data = self._find_user(user_id)
+        if user_data is None:
+            return False
+        user_data['nickname'] = nickname
+        self.save_users(username)
+        return True
 
     def update_user_email_by_id(self, user_id: str, email: str) -> bool:
         """通过用户ID更新邮箱"""
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                user_data['email'] = email
-                self.save_users()
-                return True
-        return False
+        return self._set_email(user_id, email)
 
     def update_user_password_by_id(self, user_id: str, password: str) -> bool:
         """通过用户ID更新密码"""
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                user_data['password'] = self._hash_password(password)
-                self.save_users()
-                return True
-        return False
+        username, user_data = self._find_user(user_id)
+        if user_data is None:
+            return False
+        user_data['password'] = self._hash_password(password)
+        self.save_users(username)
+        return True
 
     def set_admin_status(self, user_id: str, is_admin: bool) -> bool:
         """设置用户管理员状态"""
-        for username, user_data in self.users.items():
-            if user_data['id'] == user_id:
-                user_data['is_admin'] = is_admin
-                self.save_users()
-                return True
-        return False
+        username, user_data = self._find_user(user_id)
+        if user_data is None:
+            return False
+        user_data['is_admin'] = is_admin
+        self.save_users(username)
+        return True
 
     def delete_user(self, user_id: str) -> bool:
         """删除用户"""
-        for username, user_data in list(self.users.items()):
-            if user_data['id'] == user_id:
-                # 不能删除管理员账户
-                if user_data.get('is_admin', False) and username == 'admin':
-                    return False
-                
-                # 删除用户会话
-                sessions_to_remove = []
-                for token, session_user_id in self.user_sessions.items():
-                    if session_user_id == user_id:
-                        sessions_to_remove.append(token)
-                
-                for token in sessions_to_remove:
-                    del self.user_sessions[token]
-                
-                # 删除用户数据
-                del self.users[username]
-                self.save_users()
-                return True
-        return False
+        username, user_data = self._find_user(user_id)
+        if user_data is None:
+            return False
+
+        # 不能删除管理员账户
+        if user_data.get('is_admin', False) and username == 'admin':
+            return False
+
+        # 吊销用户的登录令牌
+        self.tokens.revoke_user(user_id)
+
+        # 删除用户数据
+        del self.users[username]
+        self.index.remove(user_data)
+        self.save_users(username)
+        # 从亲密度计数和排行榜中去掉
+        intimacy_counters(self.data_file).remove_user(user_id)
+        return True
 
     def get_all_users_data(self) -> Dict[str, Dict[str, Any]]:
         """获取所有用户的完整数据（用于统计）"""
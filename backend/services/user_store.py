@@ -0,0 +1,377 @@
+"""
+用户数据存储
+
+- json:   整个用户库保存在 users.json，经 JsonFileWriter 合并写入；任何一个用户的修改都会
+          在写盘时重写全部用户
+- sqlite: 每个用户是 users.db 中 users 表的一行；修改只把该用户标记为脏，合并写入窗口
+          结束时只写脏用户的行，写盘开销与用户总数无关。首次打开时从 users.json 迁移
+
+两种存储都在内存中保存完整的 username -> 用户数据 字典，读取不访问磁盘。
+多个 worker 共享数据库时，每行带一个递增的 seq：读取前按 PRAGMA data_version 判断
+其他连接是否提交过，只拉取 seq 更大的行；写入时发现行已被其他 worker 改过，
+则按字段把本进程的修改合并进最新内容（与 JsonFileWriter 的合并规则一致）。
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from config import Config
+from services.write_behind import WriteBehind, json_file_writer
+
+
+class UserStore:
+    """用户存储接口：内存中的 username -> 用户数据，修改后按用户登记"""
+
+    def read(self) -> Dict[str, Dict]:
+        """内存中的用户字典，调用方直接修改其中的记录，再调用 mark_dirty 登记"""
+        raise NotImplementedError
+
+    @property
+    def version(self) -> int:
+        """用户字典被整体替换、或同步进其他 worker 的修改时递增（UserIndex 据此重建）"""
+        raise NotImplementedError
+
+    def mark_dirty(self, username: str):
+        """登记对一个用户的修改（新增、修改，或已从字典中删除）"""
+        raise NotImplementedError
+
+    def update(self, username: str, fn: Callable[[Optional[Dict]], Optional[Dict]]):
+        """增量修改一个用户：立即作用于内存，写盘时在最新内容上重放（多个 worker 累加不丢失）
+
+        fn 只修改已有的记录，不新增或删除用户；调用方自己的修改不改变 version。
+        """
+        raise NotImplementedError
+
+    def pop_legacy(self, key: str):
+        """取出旧版 users.json 中除 users 以外的顶层数据（如 user_sessions），只返回一次"""
+        return None
+
+    def flush(self) -> bool:
+        return True
+
+    def get_stats(self) -> Dict:
+        return {}
+
+
+class JsonUserStore(UserStore):
+    """users.json 整文件存储"""
+
+    def __init__(self, users_file: str):
+        self.users_file = users_file
+        self.writer = json_file_writer(users_file)
+        self._own_updates = 0  # JsonFileWriter.update 每次都会递增 version，这里扣除本进程自己的修改
+
+    def _data(self) -> Dict:
+        data = self.writer.read(default={'users': {}})
+        if 'users' not in data:
+            data['users'] = {}
+        return data
+
+    def read(self) -> Dict[str, Dict]:
+        return self._data()['users']
+
+    @property
+    def version(self) -> int:
+        return self.writer.version - self._own_updates
+
+    def mark_dirty(self, username: str):
+        self.writer.write()
+
+    def update(self, username: str, fn: Callable[[Optional[Dict]], Optional[Dict]]):
+        self.writer.update('users', username, fn)
+        self._own_updates += 1
+
+    def pop_legacy(self, key: str):
+        data = self._data()
+        if key not in data:
+            return None
+        value = data.pop(key)
+        self.writer.write()
+        return value
+
+    def flush(self) -> bool:
+        return self.writer.flush()
+
+    def get_stats(self) -> Dict:
+        return dict(self.writer.write_behind.get_stats(), mode='json', users=len(self.read()))
+
+
+class SqliteUserStore(UserStore):
+    """SQLite 按用户存储，只写脏用户"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            user_id TEXT,
+            data TEXT,
+            seq INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_seq ON users(seq);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, users_file: str, db_file: str = None, window_ms: float = None):
+        self.users_file = users_file
+        self.db_file = db_file or os.path.splitext(users_file)[0] + '.db'
+        self._lock = threading.RLock()  # 保护连接、内存字典和同步状态
+        self._users: Dict[str, Dict] = {}
+        # 每个用户最近一次与数据库同步时的内容（JSON 文本）和行的 seq，用来找出本进程的修改
+        self._base: Dict[str, str] = {}
+        self._base_seq: Dict[str, int] = {}
+        self._dirty: Set[str] = set()
+        self._ops: List[Tuple[str, Callable]] = []
+        self._seq = 0  # 已同步的最大 seq
+        self._version = 0
+        self._legacy: Dict = {}
+        self._stats = {'rows_written': 0, 'merged': 0, 'pulled': 0}
+        self._conn = self._connect()
+        with self._lock:
+            self._migrate()
+            self._load()
+        self.write_behind = WriteBehind(self.db_file, self._flush, window_ms)
+
+    def _connect(self) -> sqlite3.Connection:
+        # 所有访问都在 _lock 内进行，允许跨线程共享连接
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    def _migrate(self):
+        """首次打开时把 users.json 导入数据库；旧文件保持原样作为备份"""
+        if self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone() is not None:
+            return
+        data = {}
+        if os.path.exists(self.users_file):
+            with open(self.users_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        users = data.pop('users', {})
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            # 其他 worker 可能已经抢先完成迁移
+            if self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone() is not None:
+                return
+            seq = self._next_seq()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO users (username, user_id, data, seq) VALUES (?, ?, ?, ?)",
+                [(username, user_data.get('id'), _dumps(user_data), seq) for username, user_data in users.items()]
+            )
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)",
+                               (os.path.abspath(self.users_file),))
+        self._legacy = data
+        if users:
+            print(f"已将 {len(users)} 个用户从 {self.users_file} 迁移到 {self.db_file}")
+
+    def _load(self):
+        self._users, self._base, self._base_seq = {}, {}, {}
+        self._seq = 0
+        self._data_version = self._read_data_version()
+        for username, data, seq in self._conn.execute(
+                "SELECT username, data, seq FROM users WHERE deleted = 0"):
+            self._users[username] = json.loads(data)
+            self._base[username] = data
+            self._base_seq[username] = seq
+        self._seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM users").fetchone()[0]
+        self._version += 1
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _next_seq(self) -> int:
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM users").fetchone()[0]
+
+    def _pull(self):
+        """拉取其他 worker 提交的行；本进程尚未写盘的用户保持内存中的内容，写盘时再合并"""
+        data_version = self._read_data_version()
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        changed = False
+        for username, data, seq, deleted in self._conn.execute(
+                "SELECT username, data, seq, deleted FROM users WHERE seq > ? ORDER BY seq", (self._seq,)):
+            self._seq = max(self._seq, seq)
+            if self._base_seq.get(username) == seq or username in self._dirty:
+                continue
+            self._apply_row(username, None if deleted else data, seq)
+            self._stats['pulled'] += 1
+            changed = True
+        if changed:
+            self._version += 1
+
+    def _apply_row(self, username: str, data: Optional[str], seq: int):
+        """把数据库中的行同步进内存（原地修改记录，调用方持有的引用保持有效）"""
+        self._base_seq[username] = seq
+        if data is None:
+            self._users.pop(username, None)
+            self._base.pop(username, None)
+            return
+        self._base[username] = data
+        record = self._users.get(username)
+        if record is None:
+            self._users[username] = json.loads(data)
+        else:
+            record.clear()
+            record.update(json.loads(data))
+
+    def read(self) -> Dict[str, Dict]:
+        with self._lock:
+            self._pull()
+            return self._users
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def mark_dirty(self, username: str):
+        with self._lock:
+            self._dirty.add(username)
+        self.write_behind.mark_dirty()
+
+    def update(self, username: str, fn: Callable[[Optional[Dict]], Optional[Dict]]):
+        with self._lock:
+            self._pull()
+            record = fn(self._users.get(username))
+            if record is not None:
+                self._users[username] = record
+            # 基线同样应用这次修改：合并时它不算作本进程的字段修改，而是在最新内容上重放
+            if username in self._base:
+                base = fn(json.loads(self._base[username]))
+                if base is not None:
+                    self._base[username] = _dumps(base)
+            self._ops.append((username, fn))
+            self._dirty.add(username)
+        self.write_behind.mark_dirty()
+
+    def pop_legacy(self, key: str):
+        with self._lock:
+            return self._legacy.pop(key, None)
+
+    def flush(self) -> bool:
+        return self.write_behind.flush()
+
+    def _flush(self):
+        with self._lock:
+            self._pull()
+            dirty, self._dirty = self._dirty, set()
+            ops, self._ops = self._ops, []
+            try:
+                self._write(dirty, ops)
+            except Exception:
+                self._dirty |= dirty
+                self._ops = ops + self._ops
+                raise
+
+    def _write(self, dirty: Set[str], ops: List[Tuple[str, Callable]]):
+        """在一个事务中写入脏用户；行在上次同步之后被其他 worker 改过时按字段合并"""
+        ops_by_user: Dict[str, List[Callable]] = {}
+        for username, fn in ops:
+            ops_by_user.setdefault(username, []).append(fn)
+
+        written = {}
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            seq = self._next_seq()
+            for username in sorted(dirty):
+                local = self._users.get(username)
+                row = self._conn.execute("SELECT data, seq, deleted FROM users WHERE username = ?",
+                                         (username,)).fetchone()
+                disk_seq = row[1] if row else None
+                if disk_seq == self._base_seq.get(username):
+                    record = local
+                else:
+                    # 其他 worker 改过这一行：把本进程相对基线的修改合并进最新内容，再重放增量修改
+                    self._stats['merged'] += 1
+                    disk = json.loads(row[0]) if row and not row[2] else None
+                    base = json.loads(self._base[username]) if username in self._base else None
+                    record = _merge_record(base, local, disk)
+                    for fn in ops_by_user.get(username, ()):
+                        record = fn(record) or record
+                data = _dumps(record) if record is not None else None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO users (username, user_id, data, seq, deleted) VALUES (?, ?, ?, ?, ?)",
+                    (username, record.get('id') if record else None, data, seq, 0 if record is not None else 1)
+                )
+                written[username] = (data, record is not local)
+        self._data_version = self._read_data_version()
+        self._stats['rows_written'] += len(written)
+
+        merged = False
+        for username, (data, replaced) in written.items():
+            self._base_seq[username] = seq
+            if data is None:
+                self._base.pop(username, None)
+                continue
+            self._base[username] = data
+            if replaced and username not in self._dirty:
+                self._apply_row(username, data, seq)
+                merged = True
+        if merged:
+            self._version += 1
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.write_behind.get_stats(), mode='sqlite', users=len(self._users),
+                        dirty_users=len(self._dirty), **self._stats)
+
+
+_stores: Dict[str, UserStore] = {}
+_stores_lock = threading.Lock()
+
+
+def create_user_store(mode: str, users_file: str) -> UserStore:
+    """根据持久化模式创建用户存储"""
+    if mode == 'sqlite':
+        return SqliteUserStore(users_file, Config.USER_SQLITE_FILE)
+    if mode == 'json':
+        return JsonUserStore(users_file)
+    raise ValueError(f"未知的用户持久化模式: {mode}")
+
+
+def user_store(users_file: str) -> UserStore:
+    """获取进程内按路径共享的用户存储（模式由 Config.USER_PERSISTENCE 指定）"""
+    path = os.path.abspath(users_file)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = create_user_store(Config.USER_PERSISTENCE, path)
+        return store
+
+
+def _merge_record(base: Optional[Dict], local: Optional[Dict], disk: Optional[Dict]) -> Optional[Dict]:
+    """把本进程相对基线的修改按字段合并进数据库中的最新内容
+
+    本进程删除了用户时结果为删除；用户已被其他 worker 删除而本进程只改了部分字段时，
+    删除优先；本进程新建的用户（没有基线）整体覆盖。
+    """
+    if local is None:
+        return None
+    if base is None:
+        return local
+    if disk is None:
+        return None
+    merged = dict(disk)
+    for field in set(base) | set(local):
+        if field not in local:
+            if field in base:
+                merged.pop(field, None)
+        elif base.get(field, _MISSING) != local[field]:
+            merged[field] = local[field]
+    return merged
+
+
+_MISSING = object()
+
+
+def _dumps(record: Dict) -> str:
+    return json.dumps(record, ensure_ascii=False)
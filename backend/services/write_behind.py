@@ -0,0 +1,390 @@
+"""
+合并写入（group commit）持久化层
+
+UserService、IntimacyService 以及快照模式的会话存储都把整份数据保存成一个 JSON 文件，
+原来每次修改都在请求线程里同步重写整个文件。这里改为只把数据标记为脏：同一文件在
+一个时间窗口（Config.PERSIST_WRITE_BEHIND_MS）内的多次修改合并成一次写入，由后台
+定时器完成；写入先写临时文件再 os.replace，不会留下写了一半的文件。进程退出时把
+尚未落盘的修改全部写出。窗口为 0 时退化为同步写入。
+
+多个 worker 进程共享同一个 JSON 文件时，JsonFileWriter 在文件锁内“读取最新内容 -
+合并本进程的修改 - 原子替换”，不会用自己的旧视图覆盖其他进程的写入。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import Config
+from services.file_lock import file_lock
+
+
+def atomic_write(path: str, payload: str, fsync: bool = True):
+    """先写临时文件再原子替换，避免写到一半的文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(payload)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class WriteBehind:
+    """把窗口期内的多次 mark_dirty 合并成一次 flush_fn 调用"""
+
+    def __init__(self, name: str, flush_fn: Callable[[], None], window_ms: float = None):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.window = (Config.PERSIST_WRITE_BEHIND_MS if window_ms is None else window_ms) / 1000
+
+        self._lock = threading.Lock()  # 保护脏标记、定时器和统计
+        self._flush_lock = threading.Lock()  # 同一时间只有一个线程在写
+        self._dirty = False
+        self._timer = None
+        self._marks = 0  # 自上次写入以来的修改次数
+        self._stats = {'writes': 0, 'flushes': 0, 'coalesced': 0, 'failures': 0,
+                       'last_flush_ms': None, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0}
+        _instances.add(self)
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    def mark_dirty(self):
+        """登记一次修改，窗口结束时统一写入"""
+        with self._lock:
+            self._dirty = True
+            self._marks += 1
+            if self.window > 0:
+                self._schedule()
+        if self.window <= 0:
+            self.flush()
+
+    def _schedule(self):
+        """启动窗口定时器（调用方需持有 _lock）"""
+        if self._timer is None:
+            self._timer = threading.Timer(self.window, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def flush(self) -> bool:
+        """立即写出尚未落盘的修改，没有修改时什么也不做"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return True
+                self._dirty = False
+                marks, self._marks = self._marks, 0
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            started = time.perf_counter()
+            try:
+                self.flush_fn()
+            except Exception as e:
+                print(f"[WriteBehind]: 写入 {self.name} 失败: {str(e)}")
+                with self._lock:
+                    # 保留脏标记，下一个窗口重试
+                    self._dirty = True
+                    self._marks += marks
+                    self._stats['failures'] += 1
+                    if self.window > 0:
+                        self._schedule()
+                return False
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                stats = self._stats
+                stats['writes'] += marks
+                stats['flushes'] += 1
+                stats['coalesced'] += marks - 1
+                stats['last_flush_ms'] = round(elapsed_ms, 3)
+                stats['max_flush_ms'] = round(max(stats['max_flush_ms'], elapsed_ms), 3)
+                stats['total_flush_ms'] += elapsed_ms
+            return True
+
+    def get_stats(self) -> Dict:
+        """写入统计：修改次数、实际写盘次数、被合并掉的写入次数以及写盘耗时"""
+        with self._lock:
+            stats = dict(self._stats, pending=self._marks, window_ms=self.window * 1000)
+        total = stats.pop('total_flush_ms')
+        stats['avg_flush_ms'] = round(total / stats['flushes'], 3) if stats['flushes'] else None
+        return stats
+
+
+class JsonFileWriter:
+    """一个 JSON 文件的合并写入器，进程内按路径共享（见 json_file_writer）
+
+    文件内容是“集合 -> {键 -> 记录}”两层结构（如 users.json 的 users / user_sessions）。
+    调用方直接修改 read() 返回的内存视图，再调用 write() 登记。写盘时在文件锁内重新读取
+    文件，只把自上次同步以来本进程改动过的记录（记录是字典时精确到字段）合并进去，
+    其他 worker 写入的记录保持不变；随后把其他 worker 的修改同步回内存视图。
+    计数器一类的增量修改用 update() 登记，写盘时在最新的文件内容上重放，
+    多个进程同时累加也不会丢失。
+    """
+
+    def __init__(self, path: str, window_ms: float = None):
+        self.path = path
+        self._lock = threading.RLock()  # 保护内存视图、同步基线和待重放的增量
+        self._view = None  # 内存视图，调用方直接修改
+        self._base = None  # 上次与文件同步时的内容（独立副本），用来找出本进程的修改
+        self._ops: List[Tuple[str, str, Callable]] = []  # 尚未写盘的增量修改 (集合, 键, 函数)
+        self._signature = None  # 上次同步后文件的 (inode, mtime_ns, size)
+        # 内存视图被整体替换、或同步进其他进程的修改时递增，调用方据此判断自己的派生索引是否过时
+        self.version = 0
+        self.file_lock = file_lock(path)
+        self.write_behind = WriteBehind(path, self._write, window_ms)
+
+    def read(self, default: Any = None) -> Optional[Any]:
+        """内存视图；文件被其他进程改写过时先把那些修改同步进来
+
+        文件不存在且从未写入时，以 default 的副本作为初始视图（default 为 None 时返回 None）。
+        """
+        with self._lock:
+            if self._view is None or _file_signature(self.path) != self._signature:
+                self._sync(write=False)
+            if self._view is None and default is not None:
+                self._view = _copy(default)
+                self._base = {}
+                self.version += 1
+            return self._view
+
+    def write(self, data: Any = None):
+        """登记对内存视图的修改，稍后合并写入；data 不是当前视图时以它作为新的视图"""
+        with self._lock:
+            if data is not None and data is not self._view:
+                self._view = data
+                if self._base is None:
+                    self._base = {}
+                self.version += 1
+        self.write_behind.mark_dirty()
+
+    def update(self, collection: str, key: str, fn: Callable[[Optional[Dict]], Optional[Dict]]):
+        """登记一次增量修改：fn 接收记录（不存在时为 None），原地修改或返回新记录
+
+        修改立即作用于内存视图，写盘时在文件的最新内容上重放。
+        """
+        with self._lock:
+            if self._view is None:
+                self._sync(write=False)
+            if self._view is None:
+                self._view, self._base = {}, {}
+            for doc in (self._view, self._base):
+                _apply_op(doc, collection, key, fn)
+            self._ops.append((collection, key, fn))
+            self.version += 1
+        self.write_behind.mark_dirty()
+
+    def flush(self) -> bool:
+        return self.write_behind.flush()
+
+    def _write(self):
+        with self._lock:
+            self._sync(write=True)
+
+    def _sync(self, write: bool):
+        """与文件同步（调用方需持有 _lock）
+
+        write 为 True 时在排他锁内把本进程的修改合并进文件并写回；否则只读取文件，
+        把其他进程的修改同步进内存视图，本进程尚未写盘的修改保留在视图中。
+        """
+        with (self.file_lock if write else self.file_lock.shared()):
+            disk = self._read_file()
+            if disk != (self._base or {}):
+                self.version += 1  # 文件中有其他进程写入的内容
+            snapshot = _copy(self._view) if self._view is not None else None
+            changes = _diff(self._base or {}, snapshot) if snapshot is not None else {}
+            ops = self._ops
+            if write:
+                _apply_changes(disk, changes)
+                for collection, key, fn in ops:
+                    _apply_op(disk, collection, key, fn)
+                self._ops = ops = []
+                if snapshot is not None or disk:
+                    atomic_write(self.path, self._dumps(disk))
+                changes = {}
+            self._signature = _file_signature(self.path)
+
+        base = _copy(disk)
+        for collection, key, fn in ops:
+            _apply_op(base, collection, key, fn)
+        self._base = base
+        if self._view is None:
+            self._view = _copy(base) if disk else None
+            return
+        _refresh_view(self._view, snapshot, base, changes)
+
+    def _read_file(self) -> Dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except ValueError as e:
+            print(f"[WriteBehind]: 解析 {self.path} 失败，按空文件处理: {str(e)}")
+            return {}
+
+    @staticmethod
+    def _dumps(data: Any, indent: int = 2) -> str:
+        # 数据可能是调用方正在使用的字典，其他线程恰好修改时重新序列化
+        for _ in range(3):
+            try:
+                return json.dumps(data, ensure_ascii=False, indent=indent)
+            except RuntimeError:
+                continue
+        return json.dumps(data, ensure_ascii=False, indent=indent)
+
+
+_MISSING = object()
+
+
+class _Fields(dict):
+    """记录级修改中只涉及部分字段的情况：{字段: 新值 | _MISSING}"""
+
+
+def _copy(data: Any) -> Any:
+    """深拷贝可 JSON 序列化的数据"""
+    return json.loads(JsonFileWriter._dumps(data, indent=None))
+
+
+def _file_signature(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _diff(base: Dict, current: Dict) -> Dict:
+    """找出 current 相对 base 的修改：{(集合, 键): 新记录 | _MISSING | _Fields}"""
+    changes = {}
+    for collection in set(base) | set(current):
+        old_records = base.get(collection, _MISSING)
+        new_records = current.get(collection, _MISSING)
+        if not isinstance(old_records, dict) and old_records is not _MISSING \
+                or not isinstance(new_records, dict):
+            # 不是“键 -> 记录”结构的顶层值整体比较
+            if old_records != new_records:
+                changes[(collection, None)] = new_records
+            continue
+        old_records = old_records if old_records is not _MISSING else {}
+        for key in set(old_records) | set(new_records):
+            old = old_records.get(key, _MISSING)
+            new = new_records.get(key, _MISSING)
+            if old == new:
+                continue
+            if isinstance(old, dict) and isinstance(new, dict):
+                changes[(collection, key)] = _Fields(
+                    (field, new.get(field, _MISSING)) for field in set(old) | set(new)
+                    if old.get(field, _MISSING) != new.get(field, _MISSING)
+                )
+            else:
+                changes[(collection, key)] = new
+    return changes
+
+
+def _apply_changes(doc: Dict, changes: Dict):
+    """把 _diff 得到的修改合并进 doc（文件的最新内容）"""
+    for (collection, key), change in changes.items():
+        if key is None:
+            if change is _MISSING:
+                doc.pop(collection, None)
+            else:
+                doc[collection] = change
+            continue
+        records = doc.setdefault(collection, {})
+        if change is _MISSING:
+            records.pop(key, None)
+        elif isinstance(change, _Fields):
+            record = records.get(key)
+            if not isinstance(record, dict):
+                continue  # 记录已被其他进程删除，删除优先
+            for field, value in change.items():
+                if value is _MISSING:
+                    record.pop(field, None)
+                else:
+                    record[field] = value
+        else:
+            records[key] = change
+
+
+def _apply_op(doc: Dict, collection: str, key: str, fn: Callable):
+    records = doc.setdefault(collection, {})
+    record = fn(records.get(key))
+    if record is not None:
+        records[key] = record
+
+
+def _refresh_view(view: Dict, snapshot: Dict, base: Dict, changes: Dict):
+    """把文件中的最新内容同步进内存视图（原地修改，调用方持有的集合引用保持有效）
+
+    同步期间又被本进程修改过的记录（与 snapshot 不同）保持不动，留给下一次写盘；
+    尚未写盘的记录只同步本进程没有改过的字段。
+    """
+    for collection in set(view) | set(base):
+        new_records = base.get(collection, _MISSING)
+        records = view.get(collection, _MISSING)
+        if not isinstance(records, dict) or not isinstance(new_records, dict):
+            if (collection, None) not in changes and records == snapshot.get(collection, _MISSING):
+                if new_records is _MISSING:
+                    view.pop(collection, None)
+                else:
+                    view[collection] = new_records
+            continue
+        seen = snapshot.get(collection, {})
+        for key in set(records) | set(new_records):
+            current = records.get(key, _MISSING)
+            if current != seen.get(key, _MISSING):
+                continue
+            new = new_records.get(key, _MISSING)
+            change = changes.get((collection, key), _MISSING)
+            if change is _MISSING:
+                if new is _MISSING:
+                    records.pop(key, None)
+                else:
+                    records[key] = new
+            elif isinstance(change, _Fields) and isinstance(current, dict) and isinstance(new, dict):
+                for field in set(current) | set(new):
+                    if field not in change:
+                        if field in new:
+                            current[field] = new[field]
+                        else:
+                            current.pop(field, None)
+
+
+_instances = weakref.WeakSet()
+_json_writers: Dict[str, JsonFileWriter] = {}
+_json_writers_lock = threading.Lock()
+
+
+def json_file_writer(path: str) -> JsonFileWriter:
+    """获取进程内共享的 JSON 文件写入器"""
+    path = os.path.abspath(path)
+    with _json_writers_lock:
+        writer = _json_writers.get(path)
+        if writer is None:
+            writer = _json_writers[path] = JsonFileWriter(path)
+        return writer
+
+
+def flush_all():
+    """写出所有尚未落盘的修改（进程退出时调用）"""
+    for instance in list(_instances):
+        instance.flush()
+
+
+def get_write_behind_stats() -> Dict[str, Dict]:
+    """按文件路径汇总的写入统计"""
+    return {instance.name: instance.get_stats() for instance in list(_instances)}
+
+
+atexit.register(flush_all)
@@ -174,9 +174,11 @@ export const apiService = {
     return apiClient.get(`/sessions/${sessionId}`)
   },
 
-  // 获取会话消息历史
-  getSessionMessages(sessionId) {
-    return apiClient.get(`/sessions/${sessionId}/messages`)
+  // 获取会话消息历史（可选分页：limit 为条数，before 为上一页返回的 next_cursor）
+  getSessionMessages(sessionId, { before, limit } = {}) {
+    return apiClient.get(`/sessions/${sessionId}/messages`, {
+      params: { before, limit }
+    })
   },
 
   // 清空会话消息
@@ -184,42 +186,90 @@ export const apiService = {
     return apiClient.post(`/sessions/${sessionId}/clear`)
   },
 
-  // 流式响应处理
-  streamChat(characterName, characterDescription, userQuery, onChunk, onComplete, onError) {
-    const eventSource = new EventSource(`/api/character_chat?character_name=${encodeURIComponent(characterName)}&character_description=${encodeURIComponent(characterDescription)}&user_query=${encodeURIComponent(userQuery)}&stream=true`)
+  // 流式角色聊天：以 POST 请求 /character_chat（stream=true），逐段回调模型生成的文本
+  // options: { characterId, sessionId, model }；onComplete 收到完整回复及亲密度等信息；返回取消函数
+  streamChat(characterName, characterDescription, userQuery, onChunk, onComplete, onError, options = {}) {
+    const controller = new AbortController()
+    const token = localStorage.getItem('auth_token')
+    const headers = { 'Content-Type': 'application/json' }
+    if (token) {
+      headers.Authorization = `Bearer ${token}`
+    }
     
-    eventSource.onmessage = (event) => {
-      try {
-        const data = JSON.parse(event.data)
-        if (data.content) {
-          onChunk(data.content)
+    const handleEvent = (block) => {
+      let event = 'message'
+      let data = ''
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) {
+          event = line.slice(6).trim()
+        } else if (line.startsWith('data:')) {
+          data += line.slice(5).trim()
         }
-      } catch (error) {
-        console.error('解析流式响应失败:', error)
+      }
+      if (!data) {
+        return
+      }
+      const payload = JSON.parse(data)
+      if (event === 'done') {
+        if (onComplete) {
+          onComplete(payload)
+        }
+      } else if (event === 'error') {
+        if (onError) {
+          onError(new Error(payload.error || '流式响应中断'))
+        }
+      } else if (payload.content) {
+        onChunk(payload.content)
       }
     }
     
-    eventSource.onopen = () => {
-      console.log('流式连接已建立')
-    }
-    
-    eventSource.onerror = (error) => {
+    fetch(`${apiBaseURL}/character_chat`, {
+      method: 'POST',
+      headers,
+      signal: controller.signal,
+      body: JSON.stringify({
+        character_id: options.characterId,
+        character_name: characterName,
+        character_description: characterDescription,
+        user_query: userQuery,
+        session_id: options.sessionId,
+        model: options.model,
+        stream: true
+      })
+    }).then(async (response) => {
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}))
+        throw new Error(body.error || `流式请求失败: ${response.status}`)
+      }
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      for (;;) {
+        const { done, value } = await reader.read()
+        if (done) {
+          break
+        }
+        buffer += decoder.decode(value, { stream: true })
+        // 事件之间以空行分隔，最后一段可能还不完整，留到下次
+        const blocks = buffer.split('\n\n')
+        buffer = blocks.pop()
+        blocks.forEach(handleEvent)
+      }
+      if (buffer.trim()) {
+        handleEvent(buffer)
+      }
+    }).catch((error) => {
+      if (error.name === 'AbortError') {
+        return
+      }
       console.error('流式连接错误:', error)
-      eventSource.close()
       if (onError) {
         onError(error)
       }
-    }
-    
-    eventSource.onclose = () => {
-      console.log('流式连接已关闭')
-      if (onComplete) {
-        onComplete()
-      }
-    }
+    })
     
     return () => {
-      eventSource.close()
+      controller.abort()
     }
   },
 
@@ -329,9 +379,11 @@ export const apiService = {
 
   // 管理员API
   // 获取所有用户
-  getAllUsers() {
+  // params: { page, page_size, sort: created_at|last_login|chat_count, order: asc|desc, q: 用户名/昵称前缀 }
+  getAllUsers(params = {}) {
     const token = localStorage.getItem('auth_token')
     return apiClient.get('/admin/users', {
+      params,
       headers: {
         'Authorization': `Bearer ${token}`
       }
@@ -410,9 +462,22 @@ export const apiService = {
   },
 
   // 获取角色用户统计数据
-  getCharacterUserStats(characterId) {
+  // params: { page, page_size }，按亲密度从高到低分页
+  getCharacterUserStats(characterId, params = {}) {
     const token = localStorage.getItem('auth_token')
     return apiClient.get(`/admin/character-user-stats/${characterId}`, {
+      params,
+      headers: {
+        'Authorization': `Bearer ${token}`
+      }
+    })
+  },
+
+  // 获取亲密度趋势（params: start / end 为 YYYY-MM-DD，character_id 可选）
+  getIntimacyTrends(params = {}) {
+    const token = localStorage.getItem('auth_token')
+    return apiClient.get('/admin/intimacy-trends', {
+      params,
       headers: {
         'Authorization': `Bearer ${token}`
       }
@@ -475,6 +540,11 @@ export const apiService = {
   // 获取所有角色的亲密度
   async getAllIntimacy() {
     return await apiClient.get('/intimacy/all')
+  },
+
+  // 角色亲密度排行榜，params: { page, page_size }
+  async getIntimacyLeaderboard(characterId, params = {}) {
+    return await apiClient.get(`/intimacy/${characterId}/leaderboard`, { params })
   }
 }
 
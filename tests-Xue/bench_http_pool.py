@@ -0,0 +1,126 @@
+"""
+上游 HTTP 连接池基准：比较每次请求直接调用 requests.post（原实现，每次新建连接）和
+HttpClient 连接池（保持连接、复用）在本机桩服务器上的单次请求耗时
+
+桩服务器模拟一个 OpenAI 兼容的 /chat/completions 接口，分三种情况测量：
+- http：本机 TCP，握手几乎不花时间，差别主要是建连接和 Session 的开销；
+- https：本机 TLS（需要 openssl 生成自签名证书），包含真实的 TLS 握手；
+- https + 模拟往返：每个新连接额外等待 握手延迟ms，模拟到远端上游的 TCP/TLS 握手往返。
+
+用法（在仓库根目录）：
+    PYTHONPATH=backend python tests-Xue/bench_http_pool.py [请求数] [握手延迟ms]
+"""
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.http_client import HttpClient
+
+REPLY = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': '你好'}}]}).encode('utf-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # 新连接：模拟握手往返
+        if self.server.handshake_delay:
+            time.sleep(self.server.handshake_delay)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(REPLY)))
+        self.end_headers()
+        self.wfile.write(REPLY)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(handshake_delay: float, cert_file: str = None):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    httpd.daemon_threads = True
+    httpd.handshake_delay = handshake_delay
+    scheme = 'http'
+    if cert_file:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file)
+        # 握手放到连接线程里（setup 时）做，不阻塞 accept
+        httpd.socket = context.wrap_socket(httpd.socket, server_side=True, do_handshake_on_connect=False)
+        scheme = 'https'
+    threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True).start()
+    return httpd, f'{scheme}://127.0.0.1:{httpd.server_address[1]}'
+
+
+def make_cert(workdir: str):
+    """用 openssl 生成 127.0.0.1 的自签名证书，没有 openssl 时返回 None"""
+    if shutil.which('openssl') is None:
+        return None
+    cert_file = os.path.join(workdir, 'stub.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', cert_file, '-out', cert_file],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_file
+
+
+def run(post, url, verify, request_count):
+    payload = {'model': 'stub', 'messages': [{'role': 'user', 'content': '你好'}], 'max_tokens': 16}
+    latencies = []
+    for _ in range(request_count):
+        began = time.perf_counter()
+        response = post(f'{url}/chat/completions', json=payload, timeout=10, verify=verify)
+        response.json()
+        latencies.append((time.perf_counter() - began) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], sum(latencies) / len(latencies)
+
+
+def main():
+    request_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    handshake_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cert_file = make_cert(workdir)
+        cases = [('http', 0, None)]
+        if cert_file:
+            cases += [('https', 0, cert_file), (f'https + 握手往返 {handshake_ms:g}ms', handshake_ms / 1000, cert_file)]
+        else:
+            print("未找到 openssl，跳过 https 测量")
+            cases.append((f'http + 握手往返 {handshake_ms:g}ms', handshake_ms / 1000, None))
+
+        for name, delay, cert in cases:
+            httpd, url = start_server(delay, cert)
+            verify = cert or True
+            client = HttpClient(retries=0)
+            client.post(f'{url}/chat/completions', json={}, verify=verify)  # 预热：连接池中已有一个连接
+
+            bare = run(requests.post, url, verify, request_count)
+            pooled = run(client.post, url, verify, request_count)
+            connections = client.get_stats()[url]['connections']
+            print(f"[{name}]")
+            print(f"  requests.post: p50 {bare[0]:8.3f}ms, p99 {bare[1]:8.3f}ms, 平均 {bare[2]:8.3f}ms ({request_count} 个连接)")
+            print(f"  连接池:        p50 {pooled[0]:8.3f}ms, p99 {pooled[1]:8.3f}ms, 平均 {pooled[2]:8.3f}ms ({connections} 个连接)")
+            print(f"  每次请求节省约 {bare[2] - pooled[2]:.3f}ms")
+            client.close()
+            httpd.shutdown()
+            httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
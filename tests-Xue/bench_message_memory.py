@@ -0,0 +1,68 @@
+"""
+会话消息内存基准：比较 1M 条消息在原字典布局和 Message 布局下每条消息占用的字节数
+
+用法（在仓库根目录）：
+    PYTHONPATH=backend python tests-Xue/bench_message_memory.py [消息数]
+"""
+import datetime
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from services.session_message import Message
+
+ROLES = ['user', 'assistant']
+CHARACTERS = [f'character-{i}' for i in range(24)]
+
+
+def _contents(count):
+    # 内容字符串两种布局共用，只比较结构本身的开销
+    return [f'消息内容{i}' for i in range(count)]
+
+
+def build_dicts(contents, start):
+    return [{
+        'role': ROLES[i % 2],
+        'content': content,
+        'timestamp': datetime.datetime.fromtimestamp(start + i).isoformat(),
+        'character_id': CHARACTERS[i % len(CHARACTERS)]
+    } for i, content in enumerate(contents)]
+
+
+def build_messages(contents, start):
+    return [Message(ROLES[i % 2], content, start + i, CHARACTERS[i % len(CHARACTERS)])
+            for i, content in enumerate(contents)]
+
+
+def measure(builder, contents, start):
+    gc.collect()
+    tracemalloc.start()
+    began = time.perf_counter()
+    built = builder(contents, start)
+    elapsed = time.perf_counter() - began
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del built
+    return size, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    contents = _contents(count)
+    start = time.time() - count
+
+    print(f"消息数: {count}")
+    results = {}
+    for name, builder in (('dict', build_dicts), ('Message', build_messages)):
+        size, elapsed = measure(builder, contents, start)
+        results[name] = size
+        print(f"{name:>8}: {size / count:7.1f} 字节/条, 共 {size / 1024 / 1024:8.1f} MiB, 构建耗时 {elapsed:.2f}s")
+    print(f"节省: {(1 - results['Message'] / results['dict']) * 100:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
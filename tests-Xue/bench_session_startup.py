@@ -0,0 +1,119 @@
+"""
+会话服务冷启动基准：比较 journal（全量解析 sessions.json）和 sqlite（只加载会话索引，
+消息按需读入）两种模式在大量会话下的启动耗时和常驻内存
+
+每种模式在独立的子进程中启动，测量 SessionService 构造耗时、启动后 RSS 的增量，
+以及随后读取一个会话消息（首次从磁盘读入）的耗时。
+
+用法（在仓库根目录）：
+    PYTHONPATH=backend python tests-Xue/bench_session_startup.py [会话数] [每个会话的消息数]
+"""
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+ROLES = ['user', 'assistant']
+
+
+def _rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build_snapshot(path: str, session_count: int, messages_per_session: int):
+    """生成 sessions.json：会话分布在 1000 个用户和 20 个角色上，最近 1 小时内活跃"""
+    now = time.time()
+    sessions = {}
+    for i in range(session_count):
+        session_id = f'session-{i:07d}'
+        start = now - 3600 + i * 3600 / session_count
+        messages = [{
+            'id': j + 1,
+            'role': ROLES[j % 2],
+            'content': f'第{j}条消息，来自会话{i}，内容长度接近一条普通的聊天回复。' * 2,
+            'timestamp': datetime.datetime.fromtimestamp(start + j * 0.001).isoformat(),
+            'character_id': f'character-{i % 20}'
+        } for j in range(messages_per_session)]
+        created = datetime.datetime.fromtimestamp(start).isoformat()
+        sessions[session_id] = {
+            'session_id': session_id,
+            'character_id': f'character-{i % 20}',
+            'user_id': f'user-{i % 1000}',
+            'user_token': None,
+            'created_at': created,
+            'last_activity': messages[-1]['timestamp'] if messages else created,
+            'messages': messages,
+            'context_summary': '',
+            'summary_until': None,
+            'last_message_id': messages_per_session
+        }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(sessions, f, ensure_ascii=False)
+
+
+def run_child(mode: str, sessions_file: str):
+    """子进程：冷启动一次并输出 JSON 结果"""
+    # 先导入依赖，只把 SessionService 构造计入启动耗时
+    from config import Config
+    from services.session_service import SessionService
+    Config.SESSION_SUMMARY_ENABLED = False
+
+    rss_before = _rss_mb()
+    began = time.perf_counter()
+    service = SessionService(sessions_file, persistence=mode)
+    startup = time.perf_counter() - began
+    rss_after = _rss_mb()
+
+    session_id = next(iter(service.sessions))
+    began = time.perf_counter()
+    messages = service.get_messages(session_id)
+    first_access = time.perf_counter() - began
+    service.store.close()
+
+    print(json.dumps({
+        'sessions': len(service.sessions),
+        'startup_s': startup,
+        'rss_mb': rss_after - rss_before,
+        'first_access_ms': first_access * 1000,
+        'messages': len(messages)
+    }))
+
+
+def main():
+    session_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    messages_per_session = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    with tempfile.TemporaryDirectory() as workdir:
+        sessions_file = os.path.join(workdir, 'sessions.json')
+        print(f"生成 {session_count} 个会话，每个 {messages_per_session} 条消息 ...")
+        build_snapshot(sessions_file, session_count, messages_per_session)
+        print(f"sessions.json: {os.path.getsize(sessions_file) / 1024 / 1024:.1f} MiB")
+
+        # 第一次以 sqlite 模式启动时会迁移 sessions.json，迁移本身不计入冷启动
+        print("迁移到 SQLite ...")
+        subprocess.run([sys.executable, __file__, '--child', 'sqlite', sessions_file],
+                       check=True, capture_output=True)
+
+        for mode in ('journal', 'sqlite'):
+            result = subprocess.run([sys.executable, __file__, '--child', mode, sessions_file],
+                                    check=True, capture_output=True, text=True)
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{mode:>8}: 启动 {stats['startup_s']:6.2f}s, 常驻内存 +{stats['rss_mb']:7.1f} MiB, "
+                  f"首次读取会话消息 {stats['first_access_ms']:6.2f}ms ({stats['sessions']} 个会话)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,115 @@
+"""
+用户查找基准：比较按用户ID线性扫描 users（原实现）和 id / email 哈希索引在大量用户下
+一次已登录请求的耗时
+
+一次“已登录请求”按聊天接口的调用顺序模拟：is_admin_user、get_user_by_token、
+add_chat_session，外加一次邮箱唯一性检查。
+
+用法（在仓库根目录）：
+    PYTHONPATH=backend python tests-Xue/bench_user_lookup.py [用户数] [请求数]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from config import Config
+from services.user_service import UserService
+
+
+def build_users(path: str, user_count: int):
+    users, sessions = {}, {}
+    for i in range(user_count):
+        username = f'user{i:06d}'
+        users[username] = {
+            'id': f'id-{i:06d}',
+            'username': username,
+            'password': '',
+            'email': f'{username}@example.com',
+            'nickname': username,
+            'avatar': None,
+            'is_admin': False,
+            'created_at': '2025-01-01T00:00:00',
+            'settings': {'theme': 'light'},
+            'chat_history': {},
+            'intimacy': {}
+        }
+        sessions[f'token-{i:06d}'] = f'id-{i:06d}'
+    # 令牌按旧格式写在 user_sessions 中，UserService 启动时迁移到令牌存储
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'users': users, 'user_sessions': sessions}, f)
+
+
+class LinearScan:
+    """原实现：每次按用户ID遍历全部用户"""
+
+    def __init__(self, service: UserService):
+        self.service = service
+
+    def _user(self, token):
+        user_id = self.service.tokens.resolve(token)
+        for username, user_data in self.service.users.items():
+            if user_data['id'] == user_id:
+                return user_data
+        return None
+
+    def request(self, token, email):
+        user_id = self.service.tokens.resolve(token)
+        self._user(token).get('is_admin', False)
+        self._user(token)
+        self._user(token)['chat_history'].setdefault('character-1', [])
+        for user_data in self.service.users.values():
+            if user_data.get('email') == email and user_data['id'] != user_id:
+                break
+
+
+class Indexed:
+    def __init__(self, service: UserService):
+        self.service = service
+
+    def request(self, token, email):
+        self.service.is_admin_user(token)
+        self.service.get_user_by_token(token)
+        self.service.add_chat_session(token, 'character-1', 'session-1')
+        self.service._find_email_owner(email)
+
+
+def run(impl, tokens, emails):
+    latencies = []
+    for token, email in zip(tokens, emails):
+        began = time.perf_counter()
+        impl.request(token, email)
+        latencies.append((time.perf_counter() - began) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    request_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    Config.PERSIST_WRITE_BEHIND_MS = 60_000  # 基准只测查找，不让后台写盘干扰
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'users.json')
+        print(f"生成 {user_count} 个用户 ...")
+        build_users(path, user_count)
+        service = UserService(path)
+        service._ensure_index()  # 首次建立索引的耗时不计入单次请求
+
+        rng = random.Random(0)
+        picks = [rng.randrange(user_count) for _ in range(request_count)]
+        tokens = [f'token-{i:06d}' for i in picks]
+        emails = [f'user{rng.randrange(user_count):06d}@example.com' for _ in picks]
+
+        for name, impl in (('线性扫描', LinearScan(service)), ('哈希索引', Indexed(service))):
+            p50, p99 = run(impl, tokens, emails)
+            print(f"{name}: p50 {p50:8.3f}ms, p99 {p99:8.3f}ms ({request_count} 次请求)")
+        service.store.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import pytest
+from config import Config
+from services.user_service import UserService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 10000)
+    return UserService(str(tmp_path / "users.json"))
+
+
+@pytest.fixture
+def admin_token(service):
+    # 只保留默认管理员，去掉默认创建的测试用户
+    service.delete_user(service.users["123"]["id"])
+    return service.login_user("admin", "123")["token"]
+
+
+def _names(result):
+    return [user["username"] for user in result["users"]]
+
+
+def _register(service, *usernames):
+    for username in usernames:
+        assert service.register_user(username, "pw")["success"]
+
+
+def test_pages_follow_sort_order(service, admin_token):
+    _register(service, "u1", "u2", "u3", "u4")
+    for username, count in (("u3", 3), ("u1", 1), ("u4", 2)):
+        token = service.login_user(username, "pw")["token"]
+        for i in range(count):
+            service.add_chat_session(token, f"char{i}", f"session{i}")
+
+    first = service.get_all_users(admin_token, page=1, page_size=2)
+    assert first["total"] == 5
+    assert _names(first) == ["admin", "u1"]
+    assert _names(service.get_all_users(admin_token, page=3, page_size=2)) == ["u4"]
+    assert _names(service.get_all_users(admin_token, page_size=2, order="desc")) == ["u4", "u3"]
+
+    by_chats = service.get_all_users(admin_token, sort="chat_count", order="desc")
+    assert _names(by_chats)[:3] == ["u3", "u4", "u1"]
+    by_login = service.get_all_users(admin_token, sort="last_login", order="desc")
+    assert _names(by_login)[:4] == ["u4", "u1", "u3", "admin"]
+    assert by_login["users"][0]["last_login"]
+
+
+def test_page_size_is_clamped(service, admin_token, monkeypatch):
+    monkeypatch.setattr(Config, "ADMIN_USER_PAGE_MAX", 2)
+    _register(service, "u1", "u2", "u3")
+    result = service.get_all_users(admin_token, page_size=100)
+    assert result["page_size"] == 2 and len(result["users"]) == 2 and result["total"] == 4
+
+
+def test_prefix_matches_username_or_nickname(service, admin_token):
+    service.register_user("alice", "pw", nickname="Wonder")
+    service.register_user("alfred", "pw", nickname="Butler")
+    service.register_user("bob", "pw", nickname="Alpha")
+
+    assert _names(service.get_all_users(admin_token, prefix="AL")) == ["alice", "alfred", "bob"]
+    assert _names(service.get_all_users(admin_token, prefix="won")) == ["alice"]
+    assert service.get_all_users(admin_token, prefix="zz")["total"] == 0
+
+
+def test_index_follows_changes(service, admin_token):
+    _register(service, "alice", "bob")
+    assert service.get_all_users(admin_token)["total"] == 3
+
+    bob = service.login_user("bob", "pw")
+    service.update_user_nickname(bob["token"], "Zed")
+    assert _names(service.get_all_users(admin_token, prefix="zed")) == ["bob"]
+    assert _names(service.get_all_users(admin_token, sort="last_login", order="desc"))[0] == "bob"
+
+    service.register_user("carol", "pw")
+    assert service.delete_user(bob["user"]["id"])
+    assert _names(service.get_all_users(admin_token)) == ["admin", "alice", "carol"]
+    assert service.get_all_users(admin_token, prefix="zed")["total"] == 0
+    # 增量维护的结果与重新建立的一致
+    incremental = service.get_all_users(admin_token, sort="last_login")
+    service.index.sorted.version = None
+    assert service.get_all_users(admin_token, sort="last_login") == incremental
+
+
+def test_requires_admin(service):
+    _register(service, "alice")
+    token = service.login_user("alice", "pw")["token"]
+    assert service.get_all_users(token)["success"] is False
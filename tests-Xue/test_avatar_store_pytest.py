@@ -0,0 +1,71 @@
+import base64
+import json
+import pytest
+import services.user_service as user_service_module
+from config import Config
+from services.avatar_store import AvatarStore
+from services.user_store import SqliteUserStore
+from services.user_service import UserService
+
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+DATA_URL = "data:image/png;base64," + base64.b64encode(PNG).decode()
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 0)
+    monkeypatch.setattr(Config, "AVATAR_STORE_DIR", None)
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({
+        "users": {"alice": {"id": "u1", "username": "alice", "avatar": DATA_URL, "settings": {}, "chat_history": {}}}
+    }), encoding="utf-8")
+    service = UserService(str(path))
+    monkeypatch.setattr(user_service_module, "_user_service_instance", service)
+    return service
+
+
+def test_same_content_gets_same_url(tmp_path):
+    store = AvatarStore(str(tmp_path / "avatars"))
+    url = store.store_data_url(DATA_URL)
+    assert url.startswith("/api/avatars/") and url.endswith(".png")
+    assert store.store_data_url(DATA_URL) == url
+    assert store.get_stats() == {"stored": 1, "deduplicated": 1, "bytes_stored": len(PNG)}
+    # 普通 URL 和无法解析的 data URL 原样保留
+    assert store.store_data_url("/user-avatar.svg") == "/user-avatar.svg"
+    assert store.store_data_url("data:image/png;base64,@@") == "data:image/png;base64,@@"
+    assert store.resolve("../../users.json") is None
+
+
+def test_migration_extracts_data_urls(service):
+    service.store.flush()
+    avatar = SqliteUserStore(service.data_file).read()["alice"]["avatar"]
+    assert avatar.startswith("/api/avatars/")
+    path, content_type = service.avatars.resolve(avatar.rsplit("/", 1)[1])
+    assert content_type == "image/png"
+    with open(path, "rb") as f:
+        assert f.read() == PNG
+
+    result = service.update_user_avatar("u1", DATA_URL)
+    assert result["avatar"] == avatar
+
+
+def test_avatar_served_with_immutable_cache_headers(service, client):
+    avatar = service.users["alice"]["avatar"]
+    resp = client.get(avatar)
+    assert resp.status_code == 200
+    assert resp.data == PNG
+    assert resp.mimetype == "image/png"
+    assert "immutable" in resp.headers["Cache-Control"]
+
+    assert client.get(avatar, headers={"If-None-Match": resp.headers["ETag"]}).status_code == 304
+    assert client.get("/api/avatars/" + "0" * 64 + ".png").status_code == 404
+
+
+def test_migration_runs_once_per_users_file(service, monkeypatch):
+    scans = []
+    monkeypatch.setattr(AvatarStore, "migrate_users", lambda self, users: scans.append(len(users)) or [])
+    # 同一个文件再次创建 UserService（例如按请求创建）不再扫描全部用户
+    UserService(service.data_file)
+    assert scans == []
@@ -0,0 +1,143 @@
+import threading
+import time
+import pytest
+from config import Config
+from routes import ai_routes, session_routes
+from routes.ai_service import AIService
+from services import background_tasks
+from services.background_tasks import KeyedExecutor
+from services.session_service import SessionService
+
+
+def test_tasks_of_one_key_run_in_order_while_other_keys_proceed():
+    executor = KeyedExecutor("test", workers=4, max_pending=100)
+    release = threading.Event()
+    order = []
+
+    def task(key, i):
+        if key == "a" and i == 0:
+            release.wait(5)
+        order.append((key, i))
+
+    for i in range(5):
+        executor.submit("a", task, "a", i)
+    executor.submit("b", task, "b", 0)
+    # "a" 的第一个任务被卡住，"b" 不受影响
+    assert executor.wait("b", timeout=5)
+    assert order == [("b", 0)]
+    assert executor.get_stats()["depth"] == 4
+
+    release.set()
+    assert executor.wait("a", timeout=5)
+    assert [i for key, i in order if key == "a"] == [0, 1, 2, 3, 4]
+    stats = executor.get_stats()
+    assert stats["completed"] == 6 and stats["depth"] == 0 and stats["running"] == 0
+    assert stats["max_lag_ms"] > 0
+    executor.shutdown(5)
+
+
+def test_submit_blocks_when_queue_is_full():
+    executor = KeyedExecutor("test", workers=1, max_pending=2)
+    release = threading.Event()
+    executor.submit("a", release.wait, 5)
+    while executor.get_stats()["running"] == 0:
+        time.sleep(0.001)
+    for key in ("b", "c"):
+        executor.submit(key, lambda: None)
+
+    submitted = threading.Event()
+    producer = threading.Thread(target=lambda: (executor.submit("d", lambda: None), submitted.set()))
+    producer.start()
+    assert not submitted.wait(0.1)
+    assert executor.get_stats()["blocked"] == 1
+
+    release.set()
+    assert submitted.wait(5)
+    producer.join(5)
+    executor.shutdown(5)
+    stats = executor.get_stats()
+    assert stats["completed"] == 4 and stats["blocked_ms"] > 0
+
+
+def test_failures_are_counted_and_shutdown_runs_inline():
+    executor = KeyedExecutor("test", workers=1, max_pending=10)
+    executor.submit("a", lambda: 1 / 0)
+    executor.shutdown(5)
+    ran = []
+    executor.submit("a", ran.append, 1)
+    assert ran == [1]
+    assert executor.get_stats()["failures"] == 1
+
+    inline = KeyedExecutor("test", workers=0)
+    inline.submit("a", ran.append, 2)
+    assert ran == [1, 2] and inline.get_stats()["completed"] == 1
+
+
+def test_reserved_slot_orders_later_tasks_without_occupying_a_worker():
+    executor = KeyedExecutor("test", workers=1, max_pending=10)
+    order = []
+    first = executor.reserve("a")
+    executor.submit("a", order.append, "second")
+    executor.submit("b", order.append, "other")
+    # 预留位置不占用工作线程，其他 key 照常执行；同一 key 之后的任务排在预留位置后面
+    assert executor.wait("b", timeout=5)
+    assert not executor.wait("a", timeout=0.05)
+    assert order == ["other"] and executor.get_stats()["reserved"] == 1
+
+    first.submit(order.append, "first")
+    first.cancel()  # 已填入的预留位置不能再取消
+    assert executor.wait("a", timeout=5)
+    assert order == ["other", "first", "second"]
+
+    # 取消预留后，排在后面的任务继续执行
+    cancelled = executor.reserve("a")
+    executor.submit("a", order.append, "after cancel")
+    cancelled.cancel()
+    assert executor.wait("a", timeout=5)
+    assert order[-1] == "after cancel"
+    stats = executor.get_stats()
+    assert stats["reserved"] == 0 and stats["depth"] == 0 and stats["completed"] == 4
+    executor.shutdown(5)
+
+    inline = KeyedExecutor("test", workers=0)
+    inline.reserve("a").submit(order.append, "inline")
+    assert order[-1] == "inline"
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_SUMMARY_ENABLED", False)
+    monkeypatch.setattr(background_tasks, "_post_response_executor", KeyedExecutor("post-response", workers=2))
+    service = SessionService(str(tmp_path / "sessions.json"))
+    monkeypatch.setattr(ai_routes, "get_session_service", lambda: service)
+    monkeypatch.setattr(session_routes, "get_session_service", lambda: service)
+    return service
+
+
+def test_reply_is_returned_before_bookkeeping(client, sessions, monkeypatch):
+    monkeypatch.setattr(AIService, "character_chat_with_intimacy",
+                        lambda self, messages, *args, **kwargs: {"choices": [{"message": {"content": f"回复{len(messages)}"}}]})
+    release = threading.Event()
+    add_message = sessions.add_message
+
+    def slow_add_message(session_id, role, content, character_id=None):
+        if role == "assistant":
+            release.wait(5)
+        return add_message(session_id, role, content, character_id)
+
+    monkeypatch.setattr(sessions, "add_message", slow_add_message)
+    session_id = sessions.create_session(character_id="charA")
+    body = {"character_name": "测试角色", "user_query": "你好", "session_id": session_id}
+
+    began = time.perf_counter()
+    assert client.post("/api/character_chat", json=body).get_json()["success"]
+    assert time.perf_counter() - began < 4
+    assert [m["role"] for m in sessions.get_messages(session_id)] == ["user"]
+    stats = background_tasks.get_post_response_executor().get_stats()
+    assert stats["running"] + stats["depth"] == 1
+
+    # 下一轮和读取消息都会等上一轮的助手消息保存完
+    threading.Timer(0.1, release.set).start()
+    assert client.post("/api/character_chat", json=body).get_json()["success"]
+    messages = client.get(f"/api/sessions/{session_id}/messages").get_json()["messages"]
+    assert [m["role"] for m in messages] == ["user", "assistant", "user", "assistant"]
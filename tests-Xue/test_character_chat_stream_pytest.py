@@ -0,0 +1,184 @@
+import json
+import threading
+import pytest
+from config import Config
+from routes import ai_routes
+from routes.ai_service import AIService
+from services import background_tasks
+from services.background_tasks import KeyedExecutor
+from services.http_client import HttpClient
+from services.session_service import SessionService
+
+
+class FakeStreamResponse:
+    """按行返回 SSE 数据的上游响应"""
+
+    def __init__(self, lines, status_code=200):
+        self.lines = lines
+        self.status_code = status_code
+        self.text = "error"
+        self.closed = False
+
+    def iter_lines(self):
+        yield from self.lines
+
+    def close(self):
+        self.closed = True
+
+
+def _chunk(content):
+    return b"data: " + json.dumps({"choices": [{"delta": {"content": content}}]}).encode("utf-8")
+
+
+def _events(body):
+    """解析 SSE 响应体：[(事件名, 数据)]"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = "message", None
+        for line in block.split("\n"):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        events.append((event, data))
+    return events
+
+
+def test_upstream_chunks_are_parsed_incrementally(monkeypatch):
+    upstream = FakeStreamResponse([b": keep-alive", _chunk("你"), b"", _chunk("好"),
+                                   b'data: {"choices": []}', b"data: [DONE]", _chunk("多余")])
+    requests_made = []
+
+    def fake_post(self, url, **kwargs):
+        requests_made.append(kwargs)
+        return upstream
+
+    monkeypatch.setattr(HttpClient, "post", fake_post)
+    deltas = AIService().chat_completion([{"role": "user", "content": "你好"}], stream=True)
+
+    assert requests_made[0]["stream"] is True and requests_made[0]["json"]["stream"] is True
+    assert next(deltas) == "你"
+    assert not upstream.closed
+    assert list(deltas) == ["好"]
+    assert upstream.closed
+
+
+def test_failed_upstream_returns_none(monkeypatch):
+    upstream = FakeStreamResponse([], status_code=502)
+    monkeypatch.setattr(HttpClient, "post", lambda self, url, **kwargs: upstream)
+    assert AIService().chat_completion_stream([{"role": "user", "content": "你好"}]) is None
+    assert upstream.closed
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_SUMMARY_ENABLED", False)
+    monkeypatch.setattr(background_tasks, "_post_response_executor", KeyedExecutor("post-response", workers=2))
+    service = SessionService(str(tmp_path / "sessions.json"))
+    monkeypatch.setattr(ai_routes, "get_session_service", lambda: service)
+    return service
+
+
+def test_stream_forwards_chunks_and_saves_reply(client, sessions, monkeypatch):
+    release = threading.Event()
+
+    def fake_chat(self, messages, character_name=None, character_description=None, intimacy_level=0,
+                  intimacy_name="陌生人", is_first_message=False, model=None, stream=False, **kwargs):
+        assert stream is True
+
+        def deltas():
+            yield "你好，"
+            release.wait(5)
+            yield "旅人。"
+        return deltas()
+
+    monkeypatch.setattr(AIService, "character_chat_with_intimacy", fake_chat)
+    session_id = sessions.create_session(character_id="charA")
+    resp = client.post("/api/character_chat", json={"character_name": "测试角色", "user_query": "你好",
+                                                    "session_id": session_id, "stream": True})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+
+    # 第一段在整个回复生成完之前就已送达
+    chunks = iter(resp.response)
+    first = next(chunks)
+    assert _events(first.decode("utf-8")) == [("message", {"content": "你好，"})]
+    release.set()
+    events = _events(b"".join(chunks).decode("utf-8"))
+    assert events[0] == ("message", {"content": "旅人。"})
+    assert events[-1][0] == "done"
+    assert events[-1][1]["content"] == "你好，旅人。" and events[-1][1]["session_id"] == session_id
+    resp.close()
+
+    assert background_tasks.get_post_response_executor().wait(session_id, timeout=5)
+    messages = sessions.get_messages(session_id)
+    assert [(m["role"], m["content"]) for m in messages] == [("user", "你好"), ("assistant", "你好，旅人。")]
+
+
+def test_next_turn_waits_for_streaming_reply(client, sessions, monkeypatch):
+    release = threading.Event()
+    histories = []
+
+    def fake_chat(self, messages, *args, **kwargs):
+        histories.append([m["content"] for m in messages if m["role"] != "system"])
+
+        def deltas():
+            yield "第一轮"
+            release.wait(5)
+            yield "回复"
+        return deltas()
+
+    monkeypatch.setattr(AIService, "character_chat_with_intimacy", fake_chat)
+    session_id = sessions.create_session(character_id="charA")
+    body = {"character_name": "测试角色", "session_id": session_id, "stream": True}
+    first = client.post("/api/character_chat", json=dict(body, user_query="第一问"))
+    chunks = iter(first.response)
+    next(chunks)
+
+    # 第一轮回复还在生成：第二轮请求等它保存完之后才读取上下文
+    second = {}
+    thread = threading.Thread(target=lambda: second.update(resp=client.post(
+        "/api/character_chat", json=dict(body, user_query="第二问"))))
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive() and len(histories) == 1
+
+    release.set()
+    b"".join(chunks)
+    first.close()
+    thread.join(5)
+    assert histories[1] == ["第一问", "第一轮回复", "第二问"]
+    second["resp"].close()
+
+
+def test_disconnect_saves_partial_reply(client, sessions, monkeypatch):
+    closed = threading.Event()
+
+    def deltas():
+        try:
+            yield "第一段"
+            yield "第二段"
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(AIService, "character_chat_with_intimacy", lambda self, messages, *args, **kwargs: deltas())
+    session_id = sessions.create_session(character_id="charA")
+    resp = client.post("/api/character_chat", json={"character_name": "测试角色", "user_query": "你好",
+                                                    "session_id": session_id, "stream": True})
+    next(iter(resp.response))
+    resp.close()  # 客户端断开
+
+    assert closed.is_set()
+    assert background_tasks.get_post_response_executor().wait(session_id, timeout=5)
+    assert [m["content"] for m in sessions.get_messages(session_id)] == ["你好", "第一段"]
+
+
+def test_upstream_error_mid_stream(client, sessions, monkeypatch):
+    def deltas():
+        yield "半句"
+        raise ConnectionError("upstream reset")
+
+    monkeypatch.setattr(AIService, "character_chat_with_intimacy", lambda self, messages, *args, **kwargs: deltas())
+    resp = client.post("/api/character_chat", json={"character_name": "测试角色", "user_query": "你好", "stream": True})
+    events = _events(resp.get_data(as_text=True))
+    assert events == [("message", {"content": "半句"}), ("error", {"success": False, "error": "AI服务响应中断"})]
@@ -0,0 +1,63 @@
+import pytest
+from config import Config
+from services.context_builder import build_context, completion_budget, estimate_tokens, message_tokens
+from services.session_message import Message
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    service = SessionService(str(tmp_path / "sessions.json"))
+    yield service
+    service.store.close()
+
+
+def test_estimate_counts_cjk_per_char():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("abcdefgh") == 2
+
+
+def test_estimate_is_cached_on_message():
+    message = Message("user", "你好", 0.0)
+    assert message_tokens(message) == message.tokens
+    message.content = "变长了很多很多很多"
+    assert message_tokens(message) == message.tokens
+    assert "tokens" not in message.to_dict()
+
+
+def test_build_context_keeps_newest_messages_within_budget():
+    system = [{"role": "system", "content": "系统"}]
+    history = [Message("user", "一" * 100, 1.0),
+               Message("assistant", "二" * 10, 2.0),
+               Message("user", "三" * 10, 3.0)]
+    messages, used = build_context(system, history, budget=40)
+    assert [m["content"] for m in messages] == ["系统", "二" * 10, "三" * 10]
+    assert used == message_tokens(system[0]) + sum(m.tokens for m in history[1:])
+
+    # 最新一条即使超出预算也保留
+    messages, _ = build_context([], history[:1], budget=10)
+    assert len(messages) == 1
+
+
+def test_session_context_respects_budget(service):
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(session_id, "user", "很长的旧消息" * 50, "charA")
+    service.add_message(session_id, "assistant", "好的", "charA")
+    service.add_message(session_id, "user", "新问题", "charA")
+
+    messages, used = service.build_context(session_id, "测试角色", "描述。", budget=100)
+    assert messages[0]["role"] == "system"
+    assert [m["content"] for m in messages[1:]] == ["好的", "新问题"]
+    assert 0 < used <= 100
+    assert service.get_context_messages(session_id, "测试角色", "描述。")[-1]["content"] == "新问题"
+    # 估算缓存不出现在返回的消息中，无论 build_context 是否已经处理过
+    assert not any("tokens" in m for m in service.get_messages(session_id))
+
+
+def test_completion_budget_fits_context_window(monkeypatch):
+    monkeypatch.setattr(Config, "MODEL_CONTEXT_WINDOWS", {"small": 5000})
+    assert completion_budget("small", 1000, 4096) == 4000
+    assert completion_budget("small", 100, 4096) == 4096
+    assert completion_budget("small", 4990, 4096) == Config.MIN_COMPLETION_TOKENS
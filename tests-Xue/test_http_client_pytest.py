@@ -0,0 +1,137 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from config import Config
+from services.http_client import HttpClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持连接
+    disable_nagle_algorithm = True
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            hits = server.hits[self.path]
+        if self.path == "/slow":
+            time.sleep(0.5)
+        status = 503 if self.path == "/flaky" and hits < 3 else 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    httpd.daemon_threads = True
+    httpd.hits, httpd.lock = {}, threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connections_are_reused(server):
+    httpd, base = server
+    client = HttpClient(retries=0)
+    for _ in range(5):
+        assert client.post(f"{base}/chat", json={"q": 1}).json() == {"ok": True}
+    stats = client.get_stats()[base]
+    assert stats["requests"] == 5 and stats["connections"] == 1
+    client.close()
+
+
+def test_pool_is_shared_between_threads(server):
+    httpd, base = server
+    client = HttpClient(pool_maxsize=4, retries=0)
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(10):
+                client.post(f"{base}/chat", data=b"x").raise_for_status()
+        except Exception as e:  # pragma: no cover - 失败时在主线程断言
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not errors
+    stats = client.get_stats()[base]
+    assert stats["requests"] == 40 and stats["connections"] <= 4
+    client.close()
+
+
+def test_only_idempotent_requests_retry_on_status(server):
+    httpd, base = server
+    client = HttpClient(retries=3, backoff=0)
+    assert client.get(f"{base}/flaky").status_code == 200
+    assert httpd.hits["/flaky"] == 3
+
+    httpd.hits.clear()
+    assert client.post(f"{base}/flaky").status_code == 503  # POST 不重复提交
+    assert httpd.hits["/flaky"] == 1
+    client.close()
+
+
+def test_per_host_timeout(server, monkeypatch):
+    httpd, base = server
+    client = HttpClient(retries=0)
+    monkeypatch.setattr(Config, "HTTP_HOST_TIMEOUTS", {"127.0.0.1": (1, 0.1)})
+    with pytest.raises(requests.exceptions.Timeout):
+        client.post(f"{base}/slow", timeout=5)
+    assert client.get_stats()[base]["failures"] == 1
+
+    monkeypatch.setattr(Config, "HTTP_HOST_TIMEOUTS", {})
+    assert client.post(f"{base}/slow", timeout=5).status_code == 200
+    client.close()
+
+
+def test_upstream_services_use_configured_timeouts(monkeypatch):
+    from routes.ai_service import AIService
+    from services.asr_service import ASRService
+
+    timeouts = []
+
+    class FakeResponse:
+        status_code = 200
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"access_token": "token", "choices": [{"message": {"content": "你好"}}]}
+
+        def close(self):
+            pass
+
+    def fake_request(self, method, url, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        return FakeResponse()
+
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    monkeypatch.setattr(Config, "HTTP_CONNECT_TIMEOUT", 2)
+    monkeypatch.setattr(Config, "HTTP_READ_TIMEOUT", 45)
+    messages = [{"role": "user", "content": "你好"}]
+    AIService().chat_completion(messages)
+    AIService().chat_completion_stream(messages)
+    ASRService().get_access_token()
+    assert timeouts == [(2, 45)] * 3
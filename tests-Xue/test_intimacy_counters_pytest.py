@@ -0,0 +1,102 @@
+import builtins
+import pytest
+from config import Config
+from services.intimacy_service import IntimacyService
+from services.user_service import UserService
+from services.user_store import create_user_store
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def services(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 10000)
+    monkeypatch.setattr(Config, "USER_PERSISTENCE", request.param)
+    user_service = UserService(str(tmp_path / "users.json"))
+    intimacy_service = IntimacyService()
+    intimacy_service.users_file = user_service.data_file
+    return user_service, intimacy_service
+
+
+def _login(user_service, username):
+    user_service.register_user(username, "pw")
+    return user_service.login_user(username, "pw")
+
+
+def test_counts_are_shared_with_user_service(services):
+    user_service, intimacy_service = services
+    alice = _login(user_service, "alice")
+    user_id = alice["user"]["id"]
+
+    assert intimacy_service.get_intimacy(user_id, "charA") == 0
+    assert intimacy_service.increase_intimacy(user_id, "charA")["intimacy"] == 1
+    assert intimacy_service.increase_intimacy(user_id, "charA")["intimacy"] == 2
+    assert user_service.users["alice"]["intimacy"] == {"charA": 2}
+
+    # UserService 随后保存自己的修改不会覆盖亲密度
+    user_service.update_user_nickname(alice["token"], "Alice")
+    user_service.store.flush()
+    reloaded = create_user_store(Config.USER_PERSISTENCE, user_service.data_file).read()
+    assert reloaded["alice"]["intimacy"] == {"charA": 2}
+    assert reloaded["alice"]["nickname"] == "Alice"
+
+
+def test_hot_path_does_not_touch_files(services, monkeypatch):
+    user_service, intimacy_service = services
+    user_id = _login(user_service, "alice")["user"]["id"]
+    intimacy_service.get_intimacy(user_id, "charA")
+    counters = intimacy_service.counters
+    version = counters.version
+
+    def no_open(*args, **kwargs):
+        raise AssertionError("热路径不应读写文件")
+
+    monkeypatch.setattr(builtins, "open", no_open)
+    for _ in range(5):
+        assert intimacy_service.increase_intimacy(user_id, "charA")["success"]
+        intimacy_service.get_intimacy(user_id, "charA")
+    assert intimacy_service.get_all_intimacy(user_id) == {"charA": 5}
+    # 自己的累加不会让计数表重建
+    assert counters.version == version
+    monkeypatch.undo()
+
+
+def test_users_registered_later_and_missing_users(services):
+    user_service, intimacy_service = services
+    alice = _login(user_service, "alice")["user"]["id"]
+    intimacy_service.increase_intimacy(alice, "charA")
+
+    bob = _login(user_service, "bob")["user"]["id"]
+    assert intimacy_service.increase_intimacy(bob, "charB")["intimacy"] == 1
+    assert intimacy_service.get_all_intimacy(bob) == {"charB": 1}
+
+    assert intimacy_service.increase_intimacy("missing", "charA") == {"success": False, "error": "用户不存在"}
+    assert intimacy_service.get_all_intimacy("missing") == {}
+    assert user_service.delete_user(bob)
+    assert intimacy_service.increase_intimacy(bob, "charB")["success"] is False
+
+
+def test_unknown_ids_do_not_rescan_users(services):
+    user_service, intimacy_service = services
+    _login(user_service, "alice")
+    counters = intimacy_service.counters
+    assert intimacy_service.get_intimacy("missing", "charA") == 0
+
+    class CountingUsers(dict):
+        scans = 0
+
+        def items(self):
+            CountingUsers.scans += 1
+            return super().items()
+
+    read = counters.store.read
+    counters.store.read = lambda: CountingUsers(read())
+    try:
+        for _ in range(3):
+            assert intimacy_service.get_intimacy("missing", "charA") == 0
+        assert CountingUsers.scans == 0
+    finally:
+        counters.store.read = read
+
+    # 删除后再注册，用户数不变，新用户仍能被找到
+    assert user_service.delete_user(user_service.users["alice"]["id"])
+    carol = _login(user_service, "carol")["user"]["id"]
+    assert intimacy_service.increase_intimacy(carol, "charA")["intimacy"] == 1
@@ -0,0 +1,141 @@
+import os
+import time
+from datetime import date, datetime, timedelta
+import pytest
+from config import Config
+from services import intimacy_events
+from services.intimacy_events import IntimacyEventLog
+from services.intimacy_service import IntimacyService
+from services.user_service import UserService
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 10000)
+    user_service = UserService(str(tmp_path / "users.json"))
+    intimacy_service = IntimacyService()
+    intimacy_service.users_file = user_service.data_file
+    return user_service, intimacy_service
+
+
+def _timestamp(day: date, hour: int = 12) -> float:
+    return datetime(day.year, day.month, day.day, hour).timestamp()
+
+
+def test_increments_are_folded_into_daily_aggregates(services):
+    user_service, intimacy_service = services
+    for username, count in (("alice", 5), ("bob", 2)):
+        user_service.register_user(username, "pw")
+        user_id = user_service.users[username]["id"]
+        for _ in range(count):
+            intimacy_service.increase_intimacy(user_id, "charA")
+    intimacy_service.increase_intimacy(user_id, "charB")
+
+    today = datetime.now().date()
+    trends = intimacy_service.get_trends(today - timedelta(days=1), today)
+    assert trends["daily"][0] == {"date": (today - timedelta(days=1)).isoformat(),
+                                  "increments": 0, "active_users": 0, "level_ups": 0}
+    # alice: 陌生人 -> 初次相识 -> 聊得火热，bob 与 charB 各升级一次
+    assert trends["daily"][1] == {"date": today.isoformat(), "increments": 8, "active_users": 2, "level_ups": 4}
+    assert trends["characters"] == {"charA": {"increments": 7, "active_users": 2, "level_ups": 3},
+                                    "charB": {"increments": 1, "active_users": 1, "level_ups": 1}}
+
+    level_ups = intimacy_service.get_trends(today, today, "charA")["level_ups"]
+    # 从新到旧：bob 升级、alice 第二次升级、alice 第一次升级
+    assert [(event["level_name"], event["intimacy"]) for event in level_ups] == [
+        ("初次相识", 1), ("聊得火热", 5), ("初次相识", 1)]
+    assert intimacy_service.events.totals()["charA"] == {"increments": 7, "level_ups": 3}
+
+
+def test_ranges_follow_event_timestamps(tmp_path):
+    log = IntimacyEventLog(str(tmp_path / "events.jsonl"), IntimacyService().get_level_name, window_ms=0)
+    monday = date(2024, 1, 1)
+    log.record("u1", "charA", 1, 1, _timestamp(monday))
+    log.record("u1", "charA", 1, 2, _timestamp(monday, 23))
+    log.record("u2", "charA", 1, 1, _timestamp(monday + timedelta(days=2)))
+
+    daily = log.daily(monday, monday + timedelta(days=2))
+    assert [day["increments"] for day in daily] == [2, 0, 1]
+    assert log.by_character(monday + timedelta(days=1), monday + timedelta(days=6)) == {
+        "charA": {"increments": 1, "active_users": 1, "level_ups": 1}}
+    week = log.level_ups(_timestamp(monday, 0), _timestamp(monday + timedelta(days=7), 0))
+    assert [event["user_id"] for event in week] == ["u2", "u1"]
+    assert log.level_ups(_timestamp(monday, 0), _timestamp(monday, 0) + 60) == []
+
+
+def test_events_are_shared_through_the_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "events.jsonl")
+    level_of = IntimacyService().get_level_name
+    writer = IntimacyEventLog(path, level_of, window_ms=10000)
+    other = IntimacyEventLog(path, level_of, window_ms=10000)
+    day = datetime.now().date()
+
+    writer.record("u1", "charA", 1, 1, _timestamp(day))
+    assert other.daily(day, day)[0]["increments"] == 0  # 还在合并写入窗口内
+    other.record("u2", "charA", 1, 1, _timestamp(day))
+    writer.flush()
+    other.flush()
+
+    # 双方都看到对方的事件，自己的事件不会被重复计入
+    for log in (writer, other):
+        assert log.daily(day, day)[0] == {"date": day.isoformat(), "increments": 2, "active_users": 2, "level_ups": 2}
+    reloaded = IntimacyEventLog(path, level_of)
+    assert reloaded.totals() == {"charA": {"increments": 2, "level_ups": 2}}
+    assert reloaded.get_stats()["events"] == 2
+
+
+def test_compaction_bounds_the_journal_and_history(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    level_of = IntimacyService().get_level_name
+    log = IntimacyEventLog(path, level_of, window_ms=0, compact_threshold=5, retention_days=30)
+    today = datetime.now().date()
+    old_day = today - timedelta(days=60)
+    log.record("u1", "charA", 1, 1, _timestamp(old_day))
+    for value in range(1, 7):
+        log.record("u2", "charA", 1, value, _timestamp(today, 0))
+
+    # 第 5 条事件写盘后压缩：汇总进快照，日志清空；超出保留天数的按天汇总和升级事件被丢弃
+    assert os.path.exists(log.snapshot_file)
+    stats = log.get_stats()
+    assert stats["journal_events"] == 2 and stats["events"] == 7
+    assert log.daily(old_day, old_day)[0]["increments"] == 0
+    assert [event["user_id"] for event in log.level_ups(0, time.time() + 60)] == ["u2", "u2"]
+    assert log.totals() == {"charA": {"increments": 7, "level_ups": 3}}
+
+    # 重新启动：读快照，只回放快照之后的事件
+    reloaded = IntimacyEventLog(path, level_of, compact_threshold=5, retention_days=30)
+    assert reloaded.get_stats()["journal_events"] == 2
+    assert reloaded.daily(today, today)[0] == {"date": today.isoformat(), "increments": 6,
+                                              "active_users": 1, "level_ups": 2}
+    assert reloaded.totals() == log.totals()
+
+
+def test_snapshot_written_before_journal_was_cleared_is_not_double_counted(tmp_path, monkeypatch):
+    path = str(tmp_path / "events.jsonl")
+    level_of = IntimacyService().get_level_name
+    log = IntimacyEventLog(path, level_of, window_ms=0, compact_threshold=3)
+    writes = []
+    real_write = intimacy_events.atomic_write
+
+    def crash_before_clearing(target, payload):
+        if target == path:
+            raise OSError("crash")
+        writes.append(target)
+        real_write(target, payload)
+
+    monkeypatch.setattr(intimacy_events, "atomic_write", crash_before_clearing)
+    for value in range(1, 4):
+        log.record("u1", "charA", 1, value, _timestamp(datetime.now().date()))
+    assert writes == [log.snapshot_file]
+
+    reloaded = IntimacyEventLog(path, level_of)
+    assert reloaded.totals() == {"charA": {"increments": 3, "level_ups": 1}}
+    assert reloaded.get_stats()["events"] == 3
+
+
+def test_level_progress_uses_level_table():
+    service = IntimacyService()
+    assert service.get_level_progress(7) == {"current_level": "聊得火热", "next_level": "相见恨晚",
+                                             "current_threshold": 5, "next_threshold": 10, "progress": 40.0}
+    assert service.get_level_progress(100)["next_level"] is None
+    assert service.get_level_progress(1)["current_level"] == "初次相识"
@@ -0,0 +1,66 @@
+import pytest
+from config import Config
+from services.intimacy_service import IntimacyService
+from services.user_service import UserService
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 10000)
+    user_service = UserService(str(tmp_path / "users.json"))
+    intimacy_service = IntimacyService()
+    intimacy_service.users_file = user_service.data_file
+    return user_service, intimacy_service
+
+
+def _chat(user_service, intimacy_service, counts, character_id="charA"):
+    """按 {用户名: 次数} 注册用户并累加亲密度，返回 {用户名: 用户ID}"""
+    ids = {}
+    for username, count in counts.items():
+        user_service.register_user(username, "pw")
+        ids[username] = user_service.users[username]["id"]
+        for _ in range(count):
+            intimacy_service.increase_intimacy(ids[username], character_id)
+    return ids
+
+
+def _board(intimacy_service, character_id="charA", offset=0, limit=10):
+    result = intimacy_service.get_leaderboard(character_id, offset, limit)
+    return [(entry["user_id"], entry["intimacy"]) for entry in result["entries"]], result["total"]
+
+
+def test_leaderboard_follows_increments(services):
+    user_service, intimacy_service = services
+    ids = _chat(user_service, intimacy_service, {"alice": 3, "bob": 5, "carol": 1})
+    ids.update(_chat(user_service, intimacy_service, {"dave": 2}, character_id="charB"))
+
+    assert _board(intimacy_service) == ([(ids["bob"], 5), (ids["alice"], 3), (ids["carol"], 1)], 3)
+    assert _board(intimacy_service, offset=1, limit=1) == ([(ids["alice"], 3)], 3)
+    assert intimacy_service.get_character_totals() == {"charA": 9, "charB": 2}
+
+    # carol 追上 alice，名次随之变化
+    for _ in range(3):
+        intimacy_service.increase_intimacy(ids["carol"], "charA")
+    assert intimacy_service.get_user_rank(ids["carol"], "charA") == 2
+    assert intimacy_service.get_user_rank(ids["alice"], "charA") in (2, 3)
+    assert intimacy_service.get_user_rank(ids["dave"], "charA") is None
+    entries = intimacy_service.get_leaderboard("charA")["entries"]
+    assert [entry["rank"] for entry in entries] == [1, 2, 3]
+    assert entries[0]["level_name"] == intimacy_service.get_level_name(5)
+
+
+def test_deleted_users_leave_the_leaderboard(services):
+    user_service, intimacy_service = services
+    ids = _chat(user_service, intimacy_service, {"alice": 3, "bob": 5})
+    assert user_service.delete_user(ids["bob"])
+    assert _board(intimacy_service) == ([(ids["alice"], 3)], 1)
+    assert intimacy_service.get_character_totals() == {"charA": 3}
+
+
+def test_incremental_board_matches_rebuild(services):
+    user_service, intimacy_service = services
+    _chat(user_service, intimacy_service, {"alice": 4, "bob": 4, "carol": 2, "dave": 7})
+    incremental = _board(intimacy_service), intimacy_service.get_character_totals()
+
+    intimacy_service.counters.version = None
+    assert (_board(intimacy_service), intimacy_service.get_character_totals()) == incremental
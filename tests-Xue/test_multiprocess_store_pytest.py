@@ -0,0 +1,99 @@
+import json
+import multiprocessing
+import pytest
+from config import Config
+from services.intimacy_service import IntimacyService
+from services.session_archive import SessionArchive
+from services.session_service import SessionService
+from services.user_store import create_user_store, user_store
+
+WORKERS = 4
+ROUNDS = 25
+
+# 子进程需要继承 monkeypatch 后的 Config，只能用 fork
+pytestmark = pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="需要 fork")
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 5)
+    monkeypatch.setattr(Config, "SESSION_SUMMARY_ENABLED", False)
+
+
+def _run(target, *args):
+    processes = [multiprocessing.get_context("fork").Process(target=target, args=(worker, *args)) for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert [process.exitcode for process in processes] == [0] * WORKERS
+
+
+def _intimacy_worker(worker, users_file):
+    service = IntimacyService()
+    service.users_file = users_file
+    store = user_store(users_file)
+    # 同时注册一个新用户，其他进程的写入不能把它覆盖掉
+    store.read()[f"worker{worker}"] = {"id": f"w{worker}"}
+    store.mark_dirty(f"worker{worker}")
+    for _ in range(ROUNDS):
+        assert service.increase_intimacy("u1", "charA")["success"]
+    store.flush()
+
+
+@pytest.mark.parametrize("persistence", ["sqlite", "json"])
+def test_concurrent_intimacy_increments_are_not_lost(tmp_path, monkeypatch, persistence):
+    monkeypatch.setattr(Config, "USER_PERSISTENCE", persistence)
+    users_file = str(tmp_path / "users.json")
+    with open(users_file, "w", encoding="utf-8") as f:
+        json.dump({"users": {"alice": {"id": "u1"}}, "user_sessions": {}}, f)
+
+    _run(_intimacy_worker, users_file)
+
+    users = create_user_store(persistence, users_file).read()
+    assert users["alice"]["intimacy"]["charA"] == WORKERS * ROUNDS
+    assert {f"worker{worker}" for worker in range(WORKERS)} <= set(users)
+
+
+def _session_worker(worker, sessions_file, persistence):
+    service = SessionService(sessions_file, persistence=persistence)
+    session_id = service.create_session(character_id="charA", user_id=f"u{worker}")
+    for i in range(ROUNDS):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+        if persistence == "journal" and i == ROUNDS // 2:
+            service.store.compact()
+    service.store.close()
+
+
+@pytest.mark.parametrize("persistence", ["journal", "snapshot"])
+def test_concurrent_session_writers_keep_all_messages(tmp_path, persistence):
+    sessions_file = str(tmp_path / "sessions.json")
+    _run(_session_worker, sessions_file, persistence)
+
+    reloaded = SessionService(sessions_file, persistence=persistence)
+    assert sorted(s["user_id"] for s in reloaded.sessions.values()) == [f"u{w}" for w in range(WORKERS)]
+    for session_id in list(reloaded.sessions):
+        assert len(reloaded.get_messages(session_id)) == ROUNDS
+    reloaded.store.close()
+
+
+def _archive_worker(worker, directory):
+    archive = SessionArchive(directory)
+    for i in range(ROUNDS):
+        # 所有进程归档同一个用户的会话，并恢复其中一部分
+        session_id = f"w{worker}-{i}"
+        archive.archive([{"session_id": session_id, "user_id": "u1", "character_id": "charA",
+                          "created_at": "2024-01-01T00:00:00", "last_activity": "2024-01-01T00:00:00",
+                          "messages": [{"role": "user", "content": session_id}]}])
+        if i % 5 == 0:
+            assert archive.restore(session_id)["messages"][0]["content"] == session_id
+
+
+def test_concurrent_archive_writers_keep_all_sessions(tmp_path):
+    directory = str(tmp_path / "session_archive")
+    _run(_archive_worker, directory)
+
+    expected = {f"w{worker}-{i}" for worker in range(WORKERS) for i in range(ROUNDS) if i % 5}
+    archive = SessionArchive(directory)
+    assert {meta["session_id"] for meta in archive.user_sessions("u1")} == expected
+    assert set(archive._read_user("u1")) == expected
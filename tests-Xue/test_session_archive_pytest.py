@@ -0,0 +1,118 @@
+import datetime
+import os
+import pytest
+from config import Config
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    monkeypatch.setattr(Config, "SESSION_ARCHIVE_ENABLED", True)
+    monkeypatch.setattr(Config, "SESSION_ARCHIVE_AFTER", 3600)
+    service = SessionService(str(tmp_path / "sessions.json"))
+    monkeypatch.setattr(service, "_resolve_user_id", lambda token: {"token-1": "u1"}.get(token))
+    yield service
+    service.store.close()
+
+
+def _age(service, session_id, seconds):
+    """把会话的最后活动时间往前推，并重建过期堆让修改生效"""
+    past = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+    service.sessions[session_id]["last_activity"] = past.isoformat()
+    service._rebuild_indexes()
+
+
+def test_idle_session_is_archived_and_restored_on_access(service):
+    idle = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(idle, "user", "很久以前的消息", "charA")
+    live = service.create_session(character_id="charA", user_id="u1")
+    _age(service, idle, 7200)
+
+    assert service.cleanup_expired_sessions() == 0
+    assert idle not in service.sessions
+    assert live in service.sessions
+    assert os.path.exists(os.path.join(service.archive.directory, "u1.json.gz"))
+
+    # 列表直接使用归档索引中的元数据，不恢复会话
+    listed = service.get_user_sessions("token-1", "charA")
+    assert [s["session_id"] for s in listed] == [live, idle]
+    assert listed[1]["archived"] is True
+    assert listed[1]["message_count"] == 1
+    assert idle not in service.sessions
+
+    # 打开会话时透明恢复
+    assert [m["content"] for m in service.get_messages(idle)] == ["很久以前的消息"]
+    assert idle in service.sessions
+    assert not service.archive.contains(idle)
+    stats = service.get_archive_stats()
+    assert stats["archived"] == 1 and stats["restored"] == 1
+    assert stats["archived_sessions"] == 0
+
+    # 归档和恢复都记录在热存储的日志中，重启后状态一致
+    service.store.close()
+    reloaded = SessionService(service.sessions_file)
+    assert [m["content"] for m in reloaded.get_messages(idle)] == ["很久以前的消息"]
+    reloaded.store.close()
+
+
+def test_archive_survives_restart_and_supports_lzma(service, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_ARCHIVE_COMPRESSION", "lzma")
+    service.store.close()
+    service = SessionService(service.sessions_file)
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(session_id, "user", "压缩保存", "charA")
+    _age(service, session_id, 7200)
+    service.cleanup_expired_sessions()
+    assert os.path.exists(os.path.join(service.archive.directory, "u1.json.xz"))
+    service.store.close()
+
+    reloaded = SessionService(service.sessions_file)
+    assert session_id not in reloaded.sessions
+    assert [s["session_id"] for s in reloaded.get_session_list("u1")] == [session_id]
+    assert reloaded.get_session(session_id)["session_id"] == session_id
+    reloaded.store.close()
+
+
+def test_expired_and_deleted_archives_are_dropped(service):
+    expired = service.create_session(character_id="charA", user_id="u1")
+    kept = service.create_session(character_id="charA", user_id="u1")
+    _age(service, expired, 7200)
+    _age(service, kept, 5000)
+    service.cleanup_expired_sessions()
+    assert service.archive.contains(expired) and service.archive.contains(kept)
+
+    # 归档中的会话同样在 session_timeout 后过期
+    meta = service.archive._index[expired]
+    service.archive.purge_expired(datetime.datetime.fromisoformat(meta["last_activity"]).timestamp() + 1)
+    assert not service.archive.contains(expired)
+    assert service.get_session(expired) is None
+
+    assert service.delete_session(kept) is True
+    assert not service.archive.contains(kept)
+    assert not os.path.exists(os.path.join(service.archive.directory, "u1.json.gz"))
+
+
+def test_statistics_include_archived_sessions(service):
+    idle = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(idle, "user", "第一条", "charA")
+    service.add_message(idle, "assistant", "第二条", "charA")
+    live = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(live, "user", "第三条", "charA")
+    _age(service, idle, 7200)
+    service.cleanup_expired_sessions()
+    assert idle not in service.sessions
+
+    # 统计只读归档索引中的元数据，不恢复会话
+    assert service.count_user_messages("u1", "charA") == 3
+    assert idle not in service.sessions
+    assert list(service.get_all_sessions()) == [live]
+    archived = service.get_archived_sessions()
+    assert [meta["session_id"] for meta in archived] == [idle]
+    assert archived[0]["message_count"] == 2
+    assert sum(archived[0]["daily_message_counts"].values()) == 2
+
+    # 恢复后不重复统计
+    service.get_session(idle)
+    assert service.get_archived_sessions() == []
+    assert service.count_user_messages("u1", "charA") == 3
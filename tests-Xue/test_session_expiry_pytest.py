@@ -0,0 +1,55 @@
+import datetime
+import time
+import json
+import pytest
+from config import Config
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    service = SessionService(str(tmp_path / "sessions.json"))
+    yield service
+    service.store.close()
+
+
+def _age(service, session_id, seconds):
+    """把会话的最后活动时间往前推"""
+    past = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+    service.sessions[session_id]["last_activity"] = past.isoformat()
+
+
+def test_sweep_evicts_due_sessions_in_bounded_batches(service):
+    expired = [service.create_session(character_id="charA", user_id="u1") for _ in range(5)]
+    live = service.create_session(character_id="charA", user_id="u1")
+    for session_id in expired:
+        _age(service, session_id, service.session_timeout + 60)
+    # 堆中的过期时间是创建时算的，重建一次让测试中修改的时间生效
+    service._rebuild_indexes()
+
+    assert service.sweep_expired_sessions(batch_size=3) == 3
+    assert service.sweep_expired_sessions(batch_size=3) == 2
+    assert service.sweep_expired_sessions(batch_size=3) == 0
+    assert list(service.sessions) == [live]
+
+    # 每一批只产生一条删除记录
+    with open(service.store.journal_file, encoding="utf-8") as f:
+        deletes = [r for r in map(json.loads, f) if r["op"] == "delete"]
+    assert [len(r["session_ids"]) for r in deletes] == [3, 2]
+
+    stats = service.get_expiry_stats()
+    assert stats["live_sessions"] == 1
+    assert stats["evicted_sessions"] == 5
+    assert stats["scheduled_sessions"] == 1
+
+
+def test_active_session_is_rescheduled_not_evicted(service):
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(session_id, "user", "还在", "charA")
+
+    # 堆里记录的是较早的过期时间（会话之后又活跃过）：出堆时发现未到期，重新入堆
+    service._expiry_heap = [(time.time() - 1, session_id)]
+    assert service.cleanup_expired_sessions() == 0
+    assert session_id in service.sessions
+    assert service.get_expiry_stats()["scheduled_sessions"] == 1
@@ -0,0 +1,57 @@
+import datetime
+import pytest
+from config import Config
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    service = SessionService(str(tmp_path / "sessions.json"))
+    monkeypatch.setattr(service, "_resolve_user_id", lambda token: {"token-1": "u1"}.get(token))
+    yield service
+    service.store.close()
+
+
+def test_user_sessions_ordered_by_last_activity(service):
+    first = service.create_session(character_id="charA", user_id="u1")
+    second = service.create_session(character_id="charB", user_id="u1")
+    service.create_session(character_id="charA", user_id="u2")
+
+    # 给较早的会话发消息后，它应排到最前面
+    service.add_message(first, "user", "你好", "charA")
+
+    assert [s["session_id"] for s in service.get_user_sessions("token-1")] == [first, second]
+    assert [s["session_id"] for s in service.get_session_list("u1")] == [first, second]
+    assert [s["session_id"] for s in service.get_user_sessions("token-1", "charB")] == [second]
+    assert service.get_latest_user_session("token-1", "charA") == first
+    assert service.get_user_sessions("unknown-token") == []
+
+
+def test_index_follows_delete_and_expiry(service):
+    old = service.create_session(character_id="charA", user_id="u1")
+    new = service.create_session(character_id="charA", user_id="u1")
+
+    service.delete_session(new)
+    assert service.get_latest_user_session("token-1", "charA") == old
+
+    expired_time = (datetime.datetime.now() - datetime.timedelta(seconds=service.session_timeout + 60)).isoformat()
+    service.sessions[old]["last_activity"] = expired_time
+    assert service.get_latest_user_session("token-1", "charA") is None
+
+    other = service.create_session(character_id="charA", user_id="u2")
+    assert service.clear_all_user_sessions("token-1") is True
+    assert list(service.sessions) == [other]
+    assert "u1" not in service._sessions_by_user
+    assert ("u1", "charA") not in service._sessions_by_user_character
+
+
+def test_indexes_rebuilt_on_reload(service):
+    first = service.create_session(character_id="charA", user_id="u1")
+    second = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(first, "user", "你好", "charA")
+    service.store.compact()
+
+    reloaded = SessionService(service.sessions_file)
+    assert list(reloaded._sessions_by_user_character[("u1", "charA")]) == [second, first]
+    reloaded.store.close()
@@ -0,0 +1,140 @@
+import json
+import os
+import pytest
+from config import Config
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def sessions_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    monkeypatch.setattr(Config, "SESSION_JOURNAL_COMPACT_THRESHOLD", 1000)
+    return str(tmp_path / "sessions.json")
+
+
+def test_journal_appends_and_replays(sessions_file):
+    service = SessionService(sessions_file)
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(session_id, "user", "你好", "charA")
+    service.add_message(session_id, "assistant", "你好。", "charA")
+
+    # 变更只写入日志，快照尚未生成
+    assert not os.path.exists(sessions_file)
+    with open(service.store.journal_file, encoding="utf-8") as f:
+        ops = [json.loads(line)["op"] for line in f]
+    assert ops == ["create", "add_message", "add_message"]
+    service.store.close()
+
+    # 重新启动：快照 + 日志回放
+    reloaded = SessionService(sessions_file)
+    messages = reloaded.get_messages(session_id)
+    assert [m["content"] for m in messages] == ["你好", "你好。"]
+    reloaded.store.close()
+
+
+def test_compaction_writes_snapshot_and_replay_is_idempotent(sessions_file):
+    service = SessionService(sessions_file)
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(session_id, "user", "第一条", "charA")
+    other_id = service.create_session(character_id="charB", user_id="u1")
+    service.delete_session(other_id)
+
+    journal_file = service.store.journal_file
+    with open(journal_file, "rb") as f:
+        journal = f.read()
+
+    service.store.compact()
+    with open(sessions_file, encoding="utf-8") as f:
+        snapshot = json.load(f)
+    assert list(snapshot) == [session_id]
+    assert not os.path.exists(journal_file)
+
+    # 模拟快照写完但旧日志尚未删除时崩溃：再次回放不能重复追加消息
+    with open(service.store.rotated_file, "wb") as f:
+        f.write(journal)
+    service.store.close()
+
+    reloaded = SessionService(sessions_file)
+    assert list(reloaded.sessions) == [session_id]
+    assert [m["content"] for m in reloaded.get_messages(session_id)] == ["第一条"]
+    reloaded.store.close()
+
+
+def test_torn_journal_tail_is_ignored(sessions_file):
+    service = SessionService(sessions_file)
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    service.store.close()
+
+    with open(service.store.journal_file, "a", encoding="utf-8") as f:
+        f.write('{"op": "add_message", "session_id": "')
+
+    reloaded = SessionService(sessions_file)
+    assert session_id in reloaded.sessions
+    assert reloaded.get_messages(session_id) == []
+    reloaded.store.close()
+
+
+def test_reload_picks_up_other_worker_writes(sessions_file):
+    worker_a = SessionService(sessions_file)
+    worker_b = SessionService(sessions_file)
+
+    session_id = worker_a.create_session(character_id="charA", user_id="u1")
+    worker_a.add_message(session_id, "user", "来自A", "charA")
+
+    # 日志变长：增量补放
+    worker_b.reload_if_changed()
+    assert [m["content"] for m in worker_b.get_messages(session_id)] == ["来自A"]
+
+    # B 追加时 A 的记录已被补放，A 随后也能看到 B 的写入
+    worker_b.add_message(session_id, "assistant", "来自B", "charA")
+    worker_a.reload_if_changed()
+    assert [m["content"] for m in worker_a.get_messages(session_id)] == ["来自A", "来自B"]
+
+    # A 压缩后快照改变、日志被轮转：B 整体重新加载
+    worker_a.store.compact()
+    worker_b.reload_if_changed()
+    assert [m["content"] for m in worker_b.get_messages(session_id)] == ["来自A", "来自B"]
+
+    worker_a.store.close()
+    worker_b.store.close()
+
+
+def test_snapshot_mode_reloads_on_mtime_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "snapshot")
+    path = str(tmp_path / "sessions.json")
+    worker_a = SessionService(path)
+    worker_b = SessionService(path)
+
+    session_id = worker_a.create_session(character_id="charA", user_id="u1")
+    assert session_id not in worker_b.sessions
+    # 快照在合并写入窗口结束后才落盘
+    worker_a.store.flush()
+    worker_b.reload_if_changed()
+    assert session_id in worker_b.sessions
+
+    # 文件未变化时不重新加载
+    marker = worker_b.sessions
+    worker_b.reload_if_changed()
+    assert worker_b.sessions is marker
+
+
+def test_skipped_compaction_does_not_retrigger_on_every_append(sessions_file, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_JOURNAL_COMPACT_THRESHOLD", 3)
+    worker_a = SessionService(sessions_file)
+    worker_b = SessionService(sessions_file)
+    session_id = worker_a.create_session(character_id="charA", user_id="u1")
+    worker_b.reload_if_changed()
+
+    # A 压缩之后 B 尚未重新加载：B 的压缩被跳过，计数清零，不会每次追加都再启动压缩线程
+    worker_a.store.compact()
+    started = []
+    monkeypatch.setattr(worker_b.store, "compact_in_background", lambda: started.append(1))
+    worker_b.store._pending = 5
+    worker_b.store.compact()
+    assert worker_b.store._pending == 0
+    worker_b.add_message(session_id, "user", "来自B", "charA")
+    assert started == []
+    assert [m["content"] for m in worker_b.get_messages(session_id)] == ["来自B"]
+
+    worker_a.store.close()
+    worker_b.store.close()
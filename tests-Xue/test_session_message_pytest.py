@@ -0,0 +1,25 @@
+import datetime
+import json
+from services.session_message import Message
+
+
+def test_round_trip_keeps_iso_timestamp():
+    now = datetime.datetime.now().isoformat()
+    data = {"id": 7, "role": "user", "content": "你好", "timestamp": now, "character_id": "charA"}
+    message = Message.from_dict(data)
+    assert isinstance(message.timestamp, float)
+    assert message.to_dict() == data
+
+
+def test_role_and_character_are_interned():
+    a = Message("".join(["assi", "stant"]), "一", 1.0, "".join(["char", "A"]))
+    b = Message("assistant", "二", 2.0, "charA")
+    assert a.role is b.role
+    assert a.character_id is b.character_id
+    assert not hasattr(a, "__dict__")
+
+
+def test_json_edge_serialization():
+    message = Message("user", "你好", datetime.datetime(2024, 1, 1, 12, 0, 0, 5).timestamp())
+    payload = json.loads(json.dumps({"messages": [message]}, default=Message.to_dict))
+    assert payload["messages"][0]["timestamp"] == "2024-01-01T12:00:00.000005"
@@ -0,0 +1,80 @@
+import pytest
+from config import Config
+from routes import session_routes
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    monkeypatch.setattr(Config, "SESSION_SUMMARY_ENABLED", False)
+    service = SessionService(str(tmp_path / "sessions.json"))
+    yield service
+    service.store.close()
+
+
+def _fill(service, count):
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    for i in range(count):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    return session_id
+
+
+def test_cursor_walks_history_backwards(service):
+    session_id = _fill(service, 7)
+
+    page = service.get_messages_page(session_id, limit=3)
+    assert [m["content"] for m in page["messages"]] == ["消息4", "消息5", "消息6"]
+    assert page["has_more"] is True
+
+    page = service.get_messages_page(session_id, before=page["next_cursor"], limit=3)
+    assert [m["content"] for m in page["messages"]] == ["消息1", "消息2", "消息3"]
+
+    page = service.get_messages_page(session_id, before=page["next_cursor"], limit=3)
+    assert [m["content"] for m in page["messages"]] == ["消息0"]
+    assert page["has_more"] is False and page["next_cursor"] is None
+
+
+def test_message_ids_are_stable_across_eviction_clear_and_reload(service):
+    service.max_messages_per_session = 3
+    session_id = _fill(service, 5)
+    assert [m["id"] for m in service.get_messages(session_id)] == [3, 4, 5]
+
+    service.clear_session(session_id)
+    service.add_message(session_id, "user", "清空后", "charA")
+    assert service.get_messages(session_id)[0]["id"] == 6
+
+    reloaded = SessionService(service.sessions_file)
+    reloaded.add_message(session_id, "user", "重启后", "charA")
+    assert [m["id"] for m in reloaded.get_messages(session_id)] == [6, 7]
+    reloaded.store.close()
+
+
+def test_legacy_messages_get_sequential_ids(service):
+    session_id = _fill(service, 2)
+    for message in service.sessions[session_id]["messages"]:
+        message.id = None
+    service.sessions[session_id]["last_message_id"] = None
+    service.store.compact()
+
+    reloaded = SessionService(service.sessions_file)
+    assert [m["id"] for m in reloaded.get_messages(session_id)] == [1, 2]
+    reloaded.store.close()
+
+
+def test_messages_route_paginates(client, service, monkeypatch):
+    monkeypatch.setattr(session_routes, "get_session_service", lambda: service)
+    session_id = _fill(service, 4)
+
+    data = client.get(f"/api/sessions/{session_id}/messages?limit=2").get_json()
+    assert [m["content"] for m in data["messages"]] == ["消息2", "消息3"]
+    data = client.get(f"/api/sessions/{session_id}/messages?limit=2&before={data['next_cursor']}").get_json()
+    assert [m["content"] for m in data["messages"]] == ["消息0", "消息1"]
+    assert data["has_more"] is False
+
+    assert len(client.get(f"/api/sessions/{session_id}/messages").get_json()["messages"]) == 4
+    assert client.get(f"/api/sessions/{session_id}/messages?limit=abc").status_code == 400
+
+    session = client.get(f"/api/sessions/{session_id}?limit=1").get_json()["session"]
+    assert [m["content"] for m in session["messages"]] == ["消息3"]
+    assert session["has_more_messages"] is True
@@ -0,0 +1,60 @@
+import json
+import pytest
+from config import Config
+from services.session_message import Message, MessageHistory
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    monkeypatch.setattr(Config, "SESSION_SUMMARY_ENABLED", False)
+    service = SessionService(str(tmp_path / "sessions.json"))
+    yield service
+    service.store.close()
+
+
+def test_history_evicts_oldest_turns_and_pins_system():
+    history = MessageHistory(limit=3)
+    history.append(Message("system", "设定", 0.0))
+    for i in range(5):
+        history.append(Message("user", f"消息{i}", float(i + 1)))
+    assert [m.content for m in history] == ["设定", "消息3", "消息4"]
+    assert len(history) == 3
+
+
+def test_retention_limit_by_character_and_tier(service, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_RETENTION_BY_CHARACTER", {"charLong": 4})
+    monkeypatch.setattr(Config, "SESSION_RETENTION_BY_TIER", {"vip": 3})
+    monkeypatch.setattr(service, "_resolve_user_tier", lambda user_id: {"u-vip": "vip"}.get(user_id))
+    service.max_messages_per_session = 2
+
+    by_character = service.create_session(character_id="charLong", user_id="u-vip")
+    by_tier = service.create_session(character_id="charA", user_id="u-vip")
+    default = service.create_session(character_id="charA", user_id="u1")
+    for session_id in (by_character, by_tier, default):
+        for i in range(6):
+            service.add_message(session_id, "user", f"消息{i}", "charA")
+
+    assert len(service.get_messages(by_character)) == 4
+    assert len(service.get_messages(by_tier)) == 3
+    assert [m["content"] for m in service.get_messages(default)] == ["消息4", "消息5"]
+
+
+def test_snapshot_and_replay_stay_compatible(service):
+    service.max_messages_per_session = 3
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    for i in range(5):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    service.store.compact()
+
+    with open(service.sessions_file, encoding="utf-8") as f:
+        snapshot = json.load(f)
+    assert [m["content"] for m in snapshot[session_id]["messages"]] == ["消息2", "消息3", "消息4"]
+
+    service.add_message(session_id, "user", "消息5", "charA")
+    reloaded = SessionService(service.sessions_file)
+    reloaded.max_messages_per_session = 3
+    reloaded._load_sessions()
+    assert [m["content"] for m in reloaded.get_messages(session_id)] == ["消息3", "消息4", "消息5"]
+    reloaded.store.close()
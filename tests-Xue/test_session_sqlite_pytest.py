@@ -0,0 +1,168 @@
+import datetime
+import json
+import sqlite3
+import pytest
+from config import Config
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def sessions_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "sqlite")
+    monkeypatch.setattr(Config, "SESSION_SQLITE_FILE", None)
+    return str(tmp_path / "sessions.json")
+
+
+def test_messages_persist_and_are_paged_in_on_demand(sessions_file):
+    service = SessionService(sessions_file)
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(session_id, "user", "你好", "charA")
+    service.add_message(session_id, "assistant", "你好。", "charA")
+    service.store.close()
+
+    reloaded = SessionService(sessions_file)
+    session = reloaded.sessions[session_id]
+    # 启动时只有元数据
+    assert "messages" not in session
+    assert reloaded.get_session_list("u1")[0]["message_count"] == 2
+
+    assert [m["content"] for m in reloaded.get_messages(session_id)] == ["你好", "你好。"]
+    assert "message_count" not in session
+    reloaded.store.close()
+
+
+def test_wal_mode_and_trimming_match_memory(sessions_file):
+    service = SessionService(sessions_file)
+    service.max_messages_per_session = 3
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    for i in range(5):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    service.store.close()
+
+    conn = sqlite3.connect(service.store.db_file)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    rows = conn.execute("SELECT content FROM messages WHERE session_id = ? ORDER BY id", (session_id,)).fetchall()
+    conn.close()
+    assert [r[0] for r in rows] == ["消息2", "消息3", "消息4"]
+    assert [m["content"] for m in service.get_messages(session_id)] == ["消息2", "消息3", "消息4"]
+
+
+def test_delete_and_clear(sessions_file):
+    service = SessionService(sessions_file)
+    kept = service.create_session(character_id="charA", user_id="u1")
+    dropped = service.create_session(character_id="charA", user_id="u1")
+    service.add_message(kept, "user", "第一条", "charA")
+    service.add_message(dropped, "user", "第二条", "charA")
+    service.clear_session(kept)
+    service.delete_session(dropped)
+    service.store.close()
+
+    reloaded = SessionService(sessions_file)
+    assert list(reloaded.sessions) == [kept]
+    assert reloaded.get_messages(kept) == []
+    count = reloaded.store._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    assert count == 0
+    reloaded.store.close()
+
+
+def test_migrates_existing_json_once(sessions_file, monkeypatch):
+    # 先用日志模式写出 sessions.json 和未压缩的日志
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    legacy = SessionService(sessions_file)
+    session_id = legacy.create_session(character_id="charA", user_id="u1")
+    legacy.add_message(session_id, "user", "快照里的消息", "charA")
+    legacy.store.compact()
+    legacy.add_message(session_id, "assistant", "日志里的消息", "charA")
+    legacy.store.close()
+
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "sqlite")
+    service = SessionService(sessions_file)
+    assert [m["content"] for m in service.get_messages(session_id)] == ["快照里的消息", "日志里的消息"]
+    service.delete_session(session_id)
+    service.store.close()
+
+    # 旧文件仍在，但不会被再次迁移
+    with open(sessions_file, encoding="utf-8") as f:
+        assert session_id in json.load(f)
+    reloaded = SessionService(sessions_file)
+    assert reloaded.sessions == {}
+    reloaded.store.close()
+
+
+def test_reload_picks_up_other_worker_commits(sessions_file):
+    worker_a = SessionService(sessions_file)
+    worker_b = SessionService(sessions_file)
+
+    session_id = worker_a.create_session(character_id="charA", user_id="u1")
+    worker_a.add_message(session_id, "user", "来自A", "charA")
+
+    worker_b.reload_if_changed()
+    assert [m["content"] for m in worker_b.get_messages(session_id)] == ["来自A"]
+
+    # 自己的提交不会触发重新加载
+    marker = worker_b.sessions
+    worker_b.add_message(session_id, "assistant", "来自B", "charA")
+    worker_b.reload_if_changed()
+    assert worker_b.sessions is marker
+
+    worker_a.reload_if_changed()
+    assert [m["content"] for m in worker_a.get_messages(session_id)] == ["来自A", "来自B"]
+
+    worker_a.store.close()
+    worker_b.store.close()
+
+
+def test_message_cache_evicts_least_recently_used(sessions_file, monkeypatch):
+    # 上限只够容纳约两个会话的消息
+    monkeypatch.setattr(Config, "SESSION_MESSAGE_CACHE_MB", 2500 / 1024 / 1024)
+    service = SessionService(sessions_file)
+    session_ids = []
+    for n in range(3):
+        session_id = service.create_session(character_id="charA", user_id="u1")
+        for i in range(3):
+            service.add_message(session_id, "user", f"会话{n}的消息{i}" * 10, "charA")
+        session_ids.append(session_id)
+    first, second, third = session_ids
+
+    # 第一个会话最久未访问，已被移出内存，消息数仍可用
+    assert "messages" not in service.sessions[first]
+    assert service.sessions[first]["message_count"] == 3
+    assert "messages" in service.sessions[third]
+
+    # 再次访问时从 SQLite 读回，同时淘汰当前最久未访问的第二个会话
+    assert [m["content"] for m in service.get_messages(first)][0].startswith("会话0的消息0")
+    assert "messages" not in service.sessions[second]
+    service.add_message(second, "assistant", "回来了", "charA")
+    assert len(service.get_messages(second)) == 4
+
+    stats = service.get_message_cache_stats()
+    assert stats["cached_bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] >= 2
+    assert stats["loads"] >= 2
+    assert len(service.get_all_sessions()[first]["messages"]) == 3
+    service.store.close()
+
+
+def test_message_stats_do_not_load_messages(sessions_file):
+    service = SessionService(sessions_file)
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    for i in range(3):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    # 一条今天之前的消息
+    with service.store._connect() as conn:
+        conn.execute("UPDATE messages SET timestamp = '2000-01-01T12:00:00' WHERE message_id = 1")
+    service.store.close()
+
+    reloaded = SessionService(sessions_file)
+    hot = reloaded.create_session(character_id="charB", user_id="u2")
+    reloaded.add_message(hot, "user", "内存中的消息", "charB")
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time.min).timestamp()
+
+    stats = {entry["session_id"]: entry for entry in reloaded.get_message_stats(today)}
+    assert stats[session_id] == {"session_id": session_id, "user_id": "u1", "character_id": "charA",
+                                 "message_count": 3, "recent_count": 2}
+    assert stats[hot]["message_count"] == 1 and stats[hot]["recent_count"] == 1
+    # 统计不读入消息，也不影响消息缓存
+    assert "messages" not in reloaded.sessions[session_id]
+    assert reloaded.get_message_cache_stats()["loads"] == 0
+    reloaded.store.close()
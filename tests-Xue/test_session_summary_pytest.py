@@ -0,0 +1,82 @@
+import pytest
+from config import Config
+from services.session_service import SessionService
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "journal")
+    monkeypatch.setattr(Config, "SESSION_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(Config, "SESSION_SUMMARY_TRIGGER", 6)
+    monkeypatch.setattr(Config, "SESSION_SUMMARY_KEEP_RECENT", 2)
+    service = SessionService(str(tmp_path / "sessions.json"))
+    calls = []
+
+    def fake_summarizer(previous, messages):
+        calls.append((previous, [m.content for m in messages]))
+        return f"摘要{len(calls)}"
+
+    service.summarizer = fake_summarizer
+    service.calls = calls
+    yield service
+    service.store.close()
+
+
+def _wait(service):
+    if service._summary_pool is not None:
+        service._summary_pool.shutdown(wait=True)
+        service._summary_pool = None
+
+
+def test_old_turns_are_folded_into_summary(service):
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    for i in range(7):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    _wait(service)
+
+    assert service.calls == [("", [f"消息{i}" for i in range(5)])]
+    session = service.sessions[session_id]
+    assert session["context_summary"] == "摘要1"
+
+    messages = service.get_context_messages(session_id, "测试角色", "描述。")
+    assert "摘要1" in messages[1]["content"]
+    assert [m["content"] for m in messages[2:]] == ["消息5", "消息6"]
+    # 原始消息仍保留在历史中
+    assert len(service.get_messages(session_id)) == 7
+    assert service.get_summary_stats()["runs"] == 1
+
+    # 再次超过阈值时在已有摘要的基础上继续折叠
+    for i in range(7, 12):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    _wait(service)
+    assert service.calls[1] == ("摘要1", [f"消息{i}" for i in range(5, 10)])
+
+
+def test_summary_survives_reload_and_clear_resets_it(service):
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    for i in range(7):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    _wait(service)
+    service.store.close()
+
+    reloaded = SessionService(service.sessions_file)
+    assert reloaded.sessions[session_id]["context_summary"] == "摘要1"
+    reloaded.clear_session(session_id)
+    assert reloaded.sessions[session_id]["context_summary"] == ""
+    reloaded.store.close()
+
+    again = SessionService(service.sessions_file)
+    assert again.sessions[session_id]["context_summary"] == ""
+    again.store.close()
+
+
+def test_failed_summary_keeps_history(service):
+    service.summarizer = lambda previous, messages: None
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    for i in range(7):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    _wait(service)
+
+    assert service.sessions[session_id]["context_summary"] == ""
+    assert len(service.get_context_messages(session_id)) == 7
+    assert service.get_summary_stats()["failures"] >= 1
@@ -0,0 +1,77 @@
+import json
+import time
+import pytest
+from config import Config
+from services.token_store import TokenStore
+from services.user_service import UserService
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TokenStore(str(tmp_path / "tokens.jsonl"), ttl=100, renew_interval=10)
+
+
+def test_tokens_expire_and_renew_sliding(store, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    token = store.issue("u1")
+    assert store.resolve(token) == "u1"
+
+    # 续期间隔内的访问不写记录
+    now[0] += 5
+    store.resolve(token)
+    assert store.get_stats()["renewed"] == 0
+
+    now[0] += 60
+    assert store.resolve(token) == "u1"
+    assert store.get_stats()["renewed"] == 1
+
+    # 续期后从最后一次续期起算 ttl
+    now[0] += 90
+    assert store.resolve(token) == "u1"
+    now[0] += 101
+    assert store.resolve(token) is None
+    # 访问时顺带清理过期令牌
+    assert store.get_stats()["expired"] == 1
+    assert len(store) == 0
+
+
+def test_records_replay_across_instances(store):
+    alice = store.issue("alice")
+    bob = store.issue("bob")
+    other = TokenStore(store.path, ttl=100, renew_interval=10)
+    assert other.resolve(alice, renew=False) == "alice"
+
+    # 另一个 worker 的登出和新签发在下一次查找时可见
+    assert other.revoke(alice)
+    carol = other.issue("carol")
+    assert store.resolve(alice) is None
+    assert store.resolve(carol) == "carol"
+    assert store.revoke_user("bob") == 1
+    assert other.resolve(bob) is None
+
+
+def test_file_is_rewritten_when_mostly_dead(store):
+    tokens = [store.issue(f"u{i}") for i in range(1200)]
+    for token in tokens[:-1]:
+        store.revoke(token)
+    assert store.get_stats()["rewrites"] >= 1
+    with open(store.path, encoding="utf-8") as f:
+        assert sum(1 for _ in f) < 1200
+    reloaded = TokenStore(store.path, ttl=100, renew_interval=10)
+    assert len(reloaded) == 1 and reloaded.resolve(tokens[-1]) == "u1199"
+
+
+def test_user_service_migrates_legacy_tokens(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 0)
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({
+        "users": {"alice": {"id": "u1", "username": "alice", "settings": {}, "chat_history": {}}},
+        "user_sessions": {"legacy-token": "u1"}
+    }), encoding="utf-8")
+    service = UserService(str(path))
+    assert service.get_user_by_token("legacy-token")["username"] == "alice"
+    assert service.store.pop_legacy("user_sessions") is None
+
+    assert service.logout_user("legacy-token")["success"] is True
+    assert service.get_user_by_token("legacy-token") is None
@@ -0,0 +1,51 @@
+import pytest
+from config import Config
+from services.user_service import UserService
+from services.user_store import SqliteUserStore
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 10000)
+    return UserService(str(tmp_path / "users.json"))
+
+
+def _register(service, username, email=None):
+    service.register_user(username, "pw", email=email)
+    return service.login_user(username, "pw")
+
+
+def test_lookups_follow_mutations(service):
+    alice = _register(service, "alice", "alice@example.com")
+    bob = _register(service, "bob", "bob@example.com")
+    assert service.get_user_by_token(alice["token"])["username"] == "alice"
+    assert service.index.by_id[alice["user"]["id"]] == "alice"
+
+    assert service.update_user_email(bob["token"], "alice@example.com")["success"] is False
+    assert service.update_user_email(alice["token"], "new@example.com")["success"] is True
+    assert service.update_user_email(bob["token"], "alice@example.com")["success"] is True
+    assert service.index.by_email["alice@example.com"] == bob["user"]["id"]
+
+    assert service.set_admin_status(bob["user"]["id"], True)
+    assert service.is_admin_user(bob["token"])
+    assert service.delete_user(bob["user"]["id"])
+    assert service.get_user_by_token(bob["token"]) is None
+    assert "alice@example.com" not in service.index.by_email
+    # 邮箱随用户一起释放
+    assert service.update_user_email(alice["token"], "alice@example.com")["success"] is True
+
+
+def test_instances_share_index_and_see_other_workers(service):
+    alice = _register(service, "alice")
+    # 路由里临时创建的 UserService 共享同一份视图和索引
+    other = UserService(service.data_file)
+    assert other.get_user_by_token(alice["token"])["username"] == "alice"
+
+    # 模拟另一个 worker 通过自己的连接写入：索引在同步后重建
+    service.store.flush()
+    worker = SqliteUserStore(service.data_file)
+    worker.read()["carol"] = dict(worker.read()["alice"], id="carol-id", username="carol")
+    worker.mark_dirty("carol")
+    worker.close()
+    assert service.update_user_nickname_by_id("carol-id", "Carol")
+    assert service.users["carol"]["nickname"] == "Carol"
@@ -0,0 +1,54 @@
+import pytest
+from services.user_store import SqliteUserStore
+
+
+@pytest.fixture
+def users_file(tmp_path):
+    return str(tmp_path / "users.json")
+
+
+def _store(users_file):
+    return SqliteUserStore(users_file, window_ms=10000)
+
+
+def test_only_dirty_users_are_written(users_file):
+    store = _store(users_file)
+    users = store.read()
+    for i in range(500):
+        users[f"user{i}"] = {"id": f"u{i}", "nickname": f"user{i}"}
+        store.mark_dirty(f"user{i}")
+    store.flush()
+    assert store.get_stats()["rows_written"] == 500
+
+    users["user7"]["nickname"] = "seven"
+    store.mark_dirty("user7")
+    store.flush()
+    assert store.get_stats()["rows_written"] == 501
+
+    del users["user8"]
+    store.mark_dirty("user8")
+    store.close()
+
+    reloaded = _store(users_file).read()
+    assert len(reloaded) == 499
+    assert reloaded["user7"]["nickname"] == "seven"
+    assert "user8" not in reloaded
+
+
+def test_concurrent_edits_to_one_user_merge_by_field(users_file):
+    a = _store(users_file)
+    a.read()["alice"] = {"id": "u1", "nickname": "alice", "settings": {"theme": "light"}}
+    a.mark_dirty("alice")
+    a.flush()
+    b = _store(users_file)
+
+    # 两个 worker 在各自同步之后修改同一用户的不同字段
+    a.read()["alice"]["nickname"] = "Alice"
+    a.mark_dirty("alice")
+    b.read()["alice"]["settings"] = {"theme": "dark"}
+    b.mark_dirty("alice")
+    b.flush()
+    a.flush()
+    assert a.get_stats()["merged"] == 1
+    assert a.read()["alice"] == {"id": "u1", "nickname": "Alice", "settings": {"theme": "dark"}}
+    assert b.read()["alice"] == a.read()["alice"]
@@ -0,0 +1,97 @@
+import json
+import os
+import time
+from config import Config
+from services.intimacy_service import IntimacyService
+from services.session_service import SessionService
+from services.write_behind import JsonFileWriter, WriteBehind, get_write_behind_stats
+
+
+def test_marks_within_window_are_coalesced():
+    calls = []
+    writer = WriteBehind("test", lambda: calls.append(time.time()), window_ms=50)
+    for _ in range(10):
+        writer.mark_dirty()
+    assert calls == []
+    time.sleep(0.3)
+
+    assert len(calls) == 1
+    stats = writer.get_stats()
+    assert stats["writes"] == 10
+    assert stats["flushes"] == 1
+    assert stats["coalesced"] == 9
+    assert stats["pending"] == 0
+    assert stats["last_flush_ms"] is not None
+
+
+def test_zero_window_writes_synchronously():
+    calls = []
+    writer = WriteBehind("test", lambda: calls.append(1), window_ms=0)
+    writer.mark_dirty()
+    writer.mark_dirty()
+    assert calls == [1, 1]
+
+
+def test_failed_flush_keeps_changes():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("disk full")
+
+    writer = WriteBehind("test", flaky, window_ms=10000)
+    writer.mark_dirty()
+    assert writer.flush() is False
+    assert writer.dirty
+    assert writer.flush() is True
+    assert writer.get_stats()["failures"] == 1
+    assert writer.get_stats()["writes"] == 1
+
+
+def test_json_writer_reads_own_pending_writes(tmp_path):
+    path = str(tmp_path / "users.json")
+    writer = JsonFileWriter(path, window_ms=10000)
+    assert writer.read() is None
+
+    writer.write({"users": {"alice": {"id": "u1"}}})
+    assert not os.path.exists(path)
+    assert writer.read()["users"]["alice"]["id"] == "u1"
+
+    writer.flush()
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"users": {"alice": {"id": "u1"}}}
+    assert not os.path.exists(path + ".tmp")
+    assert path in get_write_behind_stats()
+
+
+def test_intimacy_sees_unflushed_increase(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 10000)
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({"users": {"alice": {"id": "u1"}}}), encoding="utf-8")
+    service = IntimacyService()
+    service.users_file = str(path)
+
+    for _ in range(3):
+        service.increase_intimacy("u1", "charA")
+    assert service.get_intimacy("u1", "charA") == 3
+    assert "intimacy" not in json.loads(path.read_text(encoding="utf-8"))["users"]["alice"]
+
+
+def test_snapshot_store_coalesces_session_writes(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SESSION_PERSISTENCE", "snapshot")
+    monkeypatch.setattr(Config, "PERSIST_WRITE_BEHIND_MS", 10000)
+    service = SessionService(str(tmp_path / "sessions.json"))
+    session_id = service.create_session(character_id="charA", user_id="u1")
+    for i in range(5):
+        service.add_message(session_id, "user", f"消息{i}", "charA")
+    assert not os.path.exists(service.sessions_file)
+
+    service.store.close()
+    stats = service.store._writer.get_stats()
+    assert stats["flushes"] == 1
+    assert stats["coalesced"] == 5
+
+    reloaded = SessionService(service.sessions_file)
+    assert len(reloaded.get_messages(session_id)) == 5
+    reloaded.store.close()